@@ -0,0 +1,60 @@
+import collections
+import threading
+
+from lsa.custom_stemmer import porter
+
+
+class CachedStemmer(object):
+    """ Memoizing wrapper around a stemmer. The same word forms repeat many times in documents and queries,
+        so stems of the recently used max_size words are kept in LRU cache.
+        One instance can be shared between several Space instances.
+    """
+
+    def __init__(self, stemmer=None, max_size=100000):
+        self.stemmer = stemmer or porter.Stemmer()
+        self.max_size = max_size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def stem(self, word):
+        with self.lock:
+            stemmed = self.cache.get(word)
+            if stemmed is not None:
+                self.hits += 1
+                self.cache.move_to_end(word)
+                return stemmed
+            self.misses += 1
+
+        stemmed = self.stemmer.stem(word)
+        self.add(word, stemmed)
+        return stemmed
+
+    def add(self, word, stemmed):
+        with self.lock:
+            self.cache[word] = stemmed
+            self.cache.move_to_end(word)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.cache)}
+
+    def dump(self):
+        """ Cache content as dict word -> stem, from the least recently used to the most one """
+        with self.lock:
+            return dict(self.cache)
+
+    def load(self, cache):
+        for word, stemmed in cache.items():
+            self.add(word, stemmed)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
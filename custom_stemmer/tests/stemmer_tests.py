@@ -1,5 +1,5 @@
 import unittest
-from custom_stemmer import porter
+from custom_stemmer import porter, cache
 
 
 class TestCustomPorterStemmer(unittest.TestCase):
@@ -15,6 +15,32 @@ class TestCustomPorterStemmer(unittest.TestCase):
                 custom_stemmed = self.stemmer.stem(word.strip())
                 self.assertEqual(custom_stemmed, stemmed.strip())
 
+
+class TestCachedStemmer(unittest.TestCase):
+    def setUp(self):
+        self.stemmer = cache.CachedStemmer(max_size=2)
+
+    def test_same_stems(self):
+        for word in ['основателя', 'основатель', 'основателя', 'премии']:
+            self.assertEqual(self.stemmer.stem(word), porter.Stemmer().stem(word))
+        self.assertEqual(self.stemmer.get_stats(), {'hits': 1, 'misses': 3, 'size': 2})
+
+    def test_least_recently_used_is_removed(self):
+        self.stemmer.stem('основателя')
+        self.stemmer.stem('премии')
+        self.stemmer.stem('основателя')
+        self.stemmer.stem('суда')
+        self.assertEqual(list(self.stemmer.dump()), ['основателя', 'суда'])
+
+    def test_dump_and_load(self):
+        self.stemmer.stem('премии')
+        other_stemmer = cache.CachedStemmer()
+        other_stemmer.load(self.stemmer.dump())
+        other_stemmer.stem('премии')
+        self.assertEqual(other_stemmer.get_stats()['hits'], 1)
+
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestCustomPorterStemmer)
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestCachedStemmer))
     unittest.TextTestRunner(verbosity=3).run(suite)
\ No newline at end of file
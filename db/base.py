@@ -1,4 +1,6 @@
 class DataBaseBackend(object):
+    DEFAULT_FETCH_BATCH_SIZE = 1000
+
     def make_select_sql(self, table_name, fields, pk_field_name, where_clause=None):
         query_fields = [pk_field_name] + list(fields)
         where = "WHERE %s" % where_clause if where_clause else ''
@@ -6,5 +8,16 @@ class DataBaseBackend(object):
                                                                  'where': where}
         return query
 
+    def fetch_rows(self, cursor):
+        """ Take rows from executed cursor by batches of fetch_batch_size, only one batch is kept in memory """
+
+        while True:
+            rows = cursor.fetchmany(self.fetch_batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
     def select(self, table_name, fields, pk_field_name, where_clause):
+        """ Generator of rows (pk, field1, field2, ...). Connection is closed when all rows are taken """
         raise NotImplemented
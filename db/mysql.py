@@ -11,19 +11,21 @@ class MySQLBackend(base.DataBaseBackend):
         self.password = credentials.get('password', None)
         self.host = credentials.get('host', 'localhost')
         self.charset = credentials.get('charset', 'utf8')
+        self.fetch_batch_size = credentials.get('fetch_batch_size', self.DEFAULT_FETCH_BATCH_SIZE)
 
         if self.db_name is None or self.user is None or self.password is None:
             raise exceptions.DBImproperlyConfigured
 
     def select(self, table_name, fields, pk_field_name, where_clause):
+        # unbuffered cursor, rows are read from server while they are needed
         connection = pymysql.connect(host=self.host, user=self.user, passwd=self.password, db=self.db_name,
-                                     charset=self.charset, cursorclass=pymysql.cursors.Cursor)
+                                     charset=self.charset, cursorclass=pymysql.cursors.SSCursor)
         query = self.make_select_sql(table_name, fields, pk_field_name, where_clause)
 
         try:
             with connection.cursor() as cursor:
                 cursor.execute(query)
-                result = cursor.fetchall()
-            return result
+                for row in self.fetch_rows(cursor):
+                    yield row
         finally:
             connection.close()
@@ -10,6 +10,7 @@ class PostgreSQLBackend(base.DataBaseBackend):
         self.user = credentials.get('user', None)
         self.password = credentials.get('password', None)
         self.host = credentials.get('host', 'localhost')
+        self.fetch_batch_size = credentials.get('fetch_batch_size', self.DEFAULT_FETCH_BATCH_SIZE)
 
         if self.db_name is None or self.user is None or self.password is None:
             raise exceptions.DBImproperlyConfigured
@@ -20,9 +21,11 @@ class PostgreSQLBackend(base.DataBaseBackend):
         query = self.make_select_sql(table_name, fields, pk_field_name, where_clause)
 
         try:
-            cursor = connection.cursor()
+            # named cursor is server-side one, rows are transferred by batches
+            cursor = connection.cursor(name='lsa_select')
+            cursor.itersize = self.fetch_batch_size
             cursor.execute(query)
-            result = cursor.fetchall()
-            return result
+            for row in self.fetch_rows(cursor):
+                yield row
         finally:
             connection.close()
@@ -9,6 +9,7 @@ class SQLiteBackend(base.DataBaseBackend):
         self.db_name = credentials.get('db_file_name', None)
         if self.db_name is None:
             raise exceptions.DBImproperlyConfigured(credentials)
+        self.fetch_batch_size = credentials.get('fetch_batch_size', self.DEFAULT_FETCH_BATCH_SIZE)
 
     def select(self, table_name, fields, pk_field_name, where_clause):
         query = self.make_select_sql(table_name, fields, pk_field_name, where_clause)
@@ -16,7 +17,7 @@ class SQLiteBackend(base.DataBaseBackend):
         try:
             cursor = connection.cursor()
             cursor.execute(query)
-            res = cursor.fetchall()
+            for row in self.fetch_rows(cursor):
+                yield row
         finally:
             connection.close()
-        return res
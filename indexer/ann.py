@@ -0,0 +1,215 @@
+import numpy as np
+
+
+# indexer.ann.IvfIndex
+
+class IvfIndex(object):
+    """ Approximate nearest neighbours index (inverted file). Documents directions are clustered by spherical
+        k-means, every document is kept in the list of its nearest centroid. Search looks only into documents
+        of n_probe lists with centroids nearest to the query, distances to them are calculated exactly.
+        Every list keeps its boundary - documents with the biggest angles to its centroid. Distances to boundaries
+        of other lists estimate distance to the farthest document of the space (relevance radius), see radius_columns
+
+        n_lists - number of lists (clusters), sqrt(documents number) by default
+        n_probe - how many lists to look into. The more, the better recall and the slower search
+        iterations - k-means iterations
+        train_size - number of documents per list to train k-means on
+        chunk_size - documents are assigned to lists by chunks, it limits memory usage
+        boundary_size - number of boundary documents of every list
+        random_state - seed, set it to get reproducible index
+    """
+
+    def __init__(self, n_lists=None, n_probe=8, iterations=10, train_size=256, chunk_size=10000, boundary_size=16,
+                 random_state=None):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.train_size = train_size
+        self.chunk_size = chunk_size
+        self.boundary_size = boundary_size
+        self.random_state = random_state
+        self.centroids = None  # n_lists x latent dimensions
+        self.assignments = None  # list number of every document (column of D)
+        self.boundaries = None  # n_lists x boundary_size columns of boundary documents, -1 for empty places
+        self.boundary_angles = None  # their angles to centroids, -inf for empty places
+        self.lists = None  # cache, see get_lists
+
+    @staticmethod
+    def normalize_rows(vectors):
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1
+        return vectors / norms[:, np.newaxis]
+
+    def is_built(self):
+        return self.centroids is not None
+
+    def assign(self, vectors):
+        """ Number of the nearest centroid for every row of vectors """
+        return self.assign_with_angles(vectors)[0]
+
+    def assign_with_angles(self, vectors):
+        """ Number of the nearest centroid for every row of vectors and angle to it (-inf for zero vectors,
+            they are never found, so they are not boundary documents)
+        """
+
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        angles = np.empty(len(vectors))
+        for start in range(0, len(vectors), self.chunk_size):
+            chunk = np.asarray(vectors[start:start + self.chunk_size], dtype=float)
+            products = self.normalize_rows(chunk).dot(self.centroids.T)
+            assignments[start:start + self.chunk_size] = np.argmax(products, axis=1)
+            chunk_angles = np.arccos(np.clip(products.max(axis=1), -1, 1))
+            chunk_angles[~chunk.any(axis=1)] = -np.inf
+            angles[start:start + self.chunk_size] = chunk_angles
+        return assignments, angles
+
+    def update_boundaries(self, columns, assignments, angles):
+        """ Keep boundary_size documents with the biggest angles in every list among old boundaries and new ones """
+
+        lists = np.concatenate([np.repeat(np.arange(len(self.centroids)), self.boundary_size), assignments])
+        columns = np.concatenate([self.boundaries.ravel(), columns])
+        angles = np.concatenate([self.boundary_angles.ravel(), angles])
+        order = np.lexsort((-angles, lists))
+        lists, columns, angles = lists[order], columns[order], angles[order]
+        places = np.arange(len(lists)) - np.searchsorted(lists, lists)  # place of document in its list
+        kept = places < self.boundary_size
+
+        self.boundaries.fill(-1)
+        self.boundary_angles.fill(-np.inf)
+        self.boundaries[lists[kept], places[kept]] = columns[kept]
+        self.boundary_angles[lists[kept], places[kept]] = angles[kept]
+        self.boundary_angles[self.boundaries == -1] = -np.inf
+
+    def build(self, D):
+        """ Cluster documents (columns of D). D is not copied: only sampled columns are read for training
+            and documents are assigned to lists by chunks, so D may be memory-mapped
+        """
+
+        docs_number = D.shape[1]
+        n_lists = min(self.n_lists or max(int(np.sqrt(docs_number)), 1), max(docs_number, 1))
+        random = np.random.RandomState(self.random_state)
+
+        train = D
+        if docs_number > n_lists * self.train_size:
+            train = D[:, np.sort(random.choice(docs_number, n_lists * self.train_size, replace=False))]
+        train = self.normalize_rows(np.asarray(train, dtype=float).T)
+
+        self.centroids = train[random.choice(len(train), n_lists, replace=False)]
+        for i in range(self.iterations):
+            assignments = np.argmax(train.dot(self.centroids.T), axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, train)
+            not_empty = np.bincount(assignments, minlength=n_lists) > 0
+            self.centroids[not_empty] = self.normalize_rows(sums[not_empty])
+
+        self.assign_documents(D)
+
+    def reassign(self, D, transform=None):
+        """ Assign documents (columns of D) to lists again, k-means is not repeated.
+            transform - matrix of linear map of documents coordinates (basis of the space is changed),
+            centroids are mapped by it too
+        """
+
+        if transform is not None:
+            self.centroids = self.normalize_rows(self.centroids.dot(np.asarray(transform, dtype=float).T))
+        self.assign_documents(D)
+
+    def assign_documents(self, D):
+        """ Put all documents (columns of D) to lists of the nearest centroids and find boundaries of lists """
+
+        self.assignments, angles = self.assign_with_angles(D.T)
+        self.boundaries = np.full((len(self.centroids), self.boundary_size), -1, dtype=np.int64)
+        self.boundary_angles = np.full((len(self.centroids), self.boundary_size), -np.inf)
+        self.update_boundaries(np.arange(len(self.assignments)), self.assignments, angles)
+        self.lists = None
+
+    def add(self, columns):
+        """ Put new documents (columns of D) to lists """
+
+        assignments, angles = self.assign_with_angles(np.asarray(columns, dtype=float).T)
+        if self.boundaries is not None:
+            self.update_boundaries(np.arange(len(assignments)) + len(self.assignments), assignments, angles)
+        self.assignments = np.concatenate([self.assignments, assignments])
+        self.lists = None
+
+    def remove(self, columns):
+        """ Drop documents (column number or array of numbers). Removed documents leave boundaries of their lists,
+            their places stay empty till new documents take them
+        """
+
+        columns = np.unique(columns)
+        self.assignments = np.delete(self.assignments, columns)
+        if self.boundaries is not None:
+            removed = np.isin(self.boundaries, columns)
+            self.boundaries -= np.searchsorted(columns, self.boundaries)  # number of removed columns before
+            self.boundaries[removed] = -1
+            self.boundary_angles[removed] = -np.inf
+        self.lists = None
+
+    def get_lists(self):
+        """ Columns of documents ordered by list number and offsets of lists in this order """
+
+        if self.lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assignments, minlength=len(self.centroids)))])
+            self.lists = order, offsets
+        return self.lists
+
+    def get_probes(self, doc_coords, n_probe=None):
+        """ Numbers of lists nearest to the document """
+
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        closeness = self.centroids.dot(np.asarray(doc_coords, dtype=float).ravel())
+        return np.argpartition(-closeness, n_probe - 1)[:n_probe]
+
+    def candidates(self, doc_coords, n_probe=None):
+        """ Sorted numbers of columns of D to compare the document with """
+
+        probes = self.get_probes(doc_coords, n_probe)
+        order, offsets = self.get_lists()
+        return np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in probes]))
+
+    def radius_columns(self, doc_coords, n_probe=None):
+        """ Columns of boundary documents of lists which are not probed (see candidates). The farthest document
+            of the space is among candidates or near boundaries of other lists, so distances to candidates and these
+            documents estimate relevance radius of the whole space. None if boundaries are not kept
+        """
+
+        if self.boundaries is None:
+            return None
+        boundaries = self.boundaries.copy()
+        boundaries[self.get_probes(doc_coords, n_probe)] = -1
+        return np.sort(boundaries[boundaries != -1])
+
+    def dump(self):
+        """ Centroids, they are changed only by build. Assignments and boundaries are dumped apart:
+            assignments of new documents are appended to the index, boundaries are small
+        """
+
+        if not self.is_built():
+            return None
+        return {'centroids': self.centroids.tolist()}
+
+    def dump_assignments(self):
+        return None if self.assignments is None else self.assignments.tolist()
+
+    def dump_boundaries(self):
+        if self.boundaries is None:
+            return None
+        return {'boundaries': self.boundaries.tolist(),
+                'angles': [[None if angle == -np.inf else angle for angle in angles]
+                           for angles in self.boundary_angles.tolist()]}
+
+    def load(self, dump, assignments=None, boundaries=None):
+        """ Boundaries are None if the index was dumped before they have been kept """
+
+        self.centroids = self.assignments = self.boundaries = self.boundary_angles = None
+        if dump is not None:
+            self.centroids = np.array(dump['centroids'], dtype=float)
+            self.assignments = np.array(assignments, dtype=np.int32)
+        if dump is not None and boundaries is not None:
+            self.boundaries = np.array(boundaries['boundaries'], dtype=np.int64)
+            self.boundary_angles = np.array([[-np.inf if angle is None else angle for angle in angles]
+                                             for angles in boundaries['angles']], dtype=float)
+            self.boundary_size = self.boundaries.shape[1]
+        self.lists = None
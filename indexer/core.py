@@ -1,21 +1,44 @@
-import math
-
+import array
 import collections
+import heapq
+import os
 import numpy as np
-import operator
 from lsa.custom_stemmer import porter
+from lsa.indexer import outofcore, svd
+from lsa.indexer import tokenizer as tokenizers
+from lsa.indexer import weighting as weighting_schemes
 from lsa.utils import helpers, exceptions
-from lsa.utils.stops import STOP_WORDS, EXCLUDE_CHARS
 from random import choice
-from scipy.spatial import distance
+from scipy import sparse
 
 
 class Space(object):
-    def __init__(self, latent_dimensions, relevance_radius_threshold, use_stemming, use_tf_idf, decimals):
+    DEFAULT_VOCABULARY_OPTIONS = {
+        'min_total_frequency': 2,
+        'min_doc_frequency': 1,
+        'max_doc_frequency': None,
+        'max_vocabulary_size': None,
+    }
+    # rough memory usage per non-zero element of X chunk while building out of core (buffers and copies)
+    OUT_OF_CORE_BYTES_PER_ELEMENT = 64
+    DOT_CHUNK_SIZE = 65536  # columns of D converted to float32 at once, see dot_documents
+
+    def __init__(self, latent_dimensions, relevance_radius_threshold, use_stemming, use_tf_idf, decimals,
+                 svd_engine=None, weighting=None, stemmer=None, tokenizer=None, vocabulary_options=None,
+                 ann_index=None, storage_dtype=None):
         """
         Args:
            latent_dimensions: numbers of dimensions which provide reliable indexing (but less than number of
             indexed words). For visualisation enough 2 dem.
+           svd_engine: instance of svd.BaseSvdEngine subclass. TruncatedSvdEngine by default
+           weighting: instance of weighting.BaseWeighting subclass, used if use_tf_idf. TfIdfWeighting by default
+           stemmer: object with stem(word) method, porter.Stemmer by default. Can be shared between instances
+           tokenizer: object with tokenize(document) method returning list of words, tokenizer.Tokenizer by default
+           vocabulary_options: dict with rules of words filtering, see manage_unique_words
+           ann_index: approximate nearest neighbours index (see ann module), it is built with the space
+            and used by search. None - exact search
+           storage_dtype: dtype of T, P and D: float64 (default), float32 or float16. int8 - D is quantized
+            with scale for every column (see helpers.quantize_columns), T and P are float32
 
         """
 
@@ -24,23 +47,38 @@ class Space(object):
         self.decimals = decimals
         self.relevance_radius_threshold = relevance_radius_threshold
         self.latent_dimensions = latent_dimensions
-        self.stop_words = STOP_WORDS
-        self.chars_to_exclude = EXCLUDE_CHARS
-        self.stemmer = porter.Stemmer()
+        self.svd_engine = svd_engine or svd.TruncatedSvdEngine()
+        self.weighting = weighting or weighting_schemes.TfIdfWeighting()
+        self.tokenizer = tokenizer or tokenizers.Tokenizer()
+        self.vocabulary_options = vocabulary_options or {}
+        self.ann_index = ann_index
+        self.stemmer = stemmer or porter.Stemmer()
         self.docs = {}  # keeps documents and their ids
         self.words = []  # keeps indexed words
         self.keys = []  # keeps documents ids
+        self.word_index = {}  # indexed word -> its row in X and T
+        self.key_index = {}  # document key -> its column in X and D, see get_key_index
+        self.tombstones = np.zeros(0, dtype=bool)  # True for columns of removed documents, see remove_document
+        self.removed_number = 0
+        self.D = None  # coordinates of documents in columns, see svd
+        self.D_scales = None  # scales of columns of quantized D, see store_documents
+        self.documents_buffer = None  # growable D and D_scales, see append_documents
+        self.storage_dtype = np.dtype(storage_dtype or np.float64)
+        self.P = None  # projection matrix T * S^-1, see make_projection
+        self.neighbours = None  # precomputed nearest documents, see build_neighbours
+        self.drift = {'built_documents': 0, 'added_documents': 0, 'lost_energy': 0.}  # see get_drift
+        self.neighbours_limit = 0
+        self.docs_norms = None  # lengths of D columns, see get_docs_norms
+        self.docs_norms_source = None
 
     def clear_self_docs(self):
         self.docs = {}  # mb del self.doc
 
     def exclude_trash(self, document):
-        for char in self.chars_to_exclude:
-            document = document.replace(char, ' ')
-        return document
+        return self.tokenizer.exclude_trash(document)
 
     def exclude_stops(self, document):
-        return [word.strip() for word in document.split(' ') if word not in self.stop_words]
+        return self.tokenizer.exclude_stops(document)
 
     def stem_document(self, document, return_text=False):
         if not isinstance(document, list):
@@ -53,9 +91,7 @@ class Space(object):
         return stemmed_words
 
     def prepare_document(self, document):
-        document = helpers.lower_document(document)
-        document = self.exclude_trash(document)
-        document = self.exclude_stops(document)
+        document = self.tokenizer.tokenize(document)
         if self.use_stemming:
             document = self.stem_document(document)
         return document
@@ -65,24 +101,66 @@ class Space(object):
         self.latent_dimensions = min(self.latent_dimensions, len(self.words), len(self.keys) - 1)
 
     def manage_repeating_words(self):
-        """ List with indexed words should not have repeated entries """
+        """ List with indexed words should not have repeated entries.
+            Documents adding keeps words unique itself, use it only if self.words was changed directly
+        """
+
+        self.words = list(collections.OrderedDict.fromkeys(self.words))
+        self.index_words()
+
+    def add_words(self, document):
+        """ Add new words of the document to vocabulary. Dict lookups only, vocabulary is not rebuilt """
 
-        self.words = list(set(self.words))
+        for word in document:
+            if word not in self.word_index:
+                self.word_index[word] = len(self.words)
+                self.words.append(word)
+
+    def index_words(self):
+        """ Word position in self.words is its row in X and T. Keep it in dict to avoid list scanning """
+
+        self.word_index = {word: row for row, word in enumerate(self.words)}
 
     def manage_unique_words(self):
         """ If some word has only one entry in documents we can leave it.
         This helps to save memory
 
+        Words are filtered according to vocabulary_options (see DEFAULT_VOCABULARY_OPTIONS):
+            min_total_frequency - minimal number of word entries in all documents
+            min_doc_frequency - minimal number of documents with the word
+            max_doc_frequency - maximal number of documents with the word (float - part of all documents),
+                helps to remove too common words
+            max_vocabulary_size - keep only this number of the most frequent words
+
+        Frequencies are counted in one pass over documents
+        """
+
+        total_frequency = collections.Counter()
+        doc_frequency = collections.Counter()
+        for key in self.keys:
+            total_frequency.update(self.docs[key])
+            doc_frequency.update(set(self.docs[key]))
+        self.words = self.select_words(self.words, total_frequency, doc_frequency, len(self.keys))
+
+    def select_words(self, words, total_frequency, doc_frequency, docs_number):
+        """ Words which pass vocabulary_options rules (see manage_unique_words).
+            Frequencies are any mappings word -> number
         """
-        counters = [collections.Counter(self.docs[key]) for key in self.keys]
-        to_remove = []
-        for word in self.words:
-            cnt = 0
-            for counter in counters:
-                cnt += counter[word]
-            if cnt <= 1:
-                to_remove.append(word)
-        self.words = list(set(self.words) - set(to_remove))
+
+        options = dict(self.DEFAULT_VOCABULARY_OPTIONS, **self.vocabulary_options)
+        max_doc_frequency = options['max_doc_frequency']
+        if isinstance(max_doc_frequency, float):
+            max_doc_frequency *= docs_number
+
+        words = [word for word in words
+                 if total_frequency[word] >= options['min_total_frequency']
+                 and doc_frequency[word] >= options['min_doc_frequency']
+                 and (max_doc_frequency is None or doc_frequency[word] <= max_doc_frequency)]
+
+        max_vocabulary_size = options['max_vocabulary_size']
+        if max_vocabulary_size is not None and len(words) > max_vocabulary_size:
+            words = heapq.nlargest(max_vocabulary_size, words, key=total_frequency.__getitem__)
+        return words
 
     # TODO: метод, который бы просто говорил, занят ли такой desired_id уже или нет. без исключений
     def check_doc_key(self, desired_id):
@@ -95,10 +173,34 @@ class Space(object):
         if not isinstance(desired_id, (int, str)):
             raise exceptions.KeyTypeException(desired_id)
 
-        if desired_id in self.keys:
+        if desired_id in self.get_key_index():
             raise exceptions.UniqueKeyException(desired_id)
         return desired_id
 
+    def get_key_index(self):
+        """ Dict document key -> its column. It is rebuilt only if self.keys was changed directly.
+            Removed documents are not in it
+        """
+
+        if len(self.key_index) != len(self.keys) - self.removed_number:
+            tombstones = self.get_tombstones()
+            self.key_index = {key: column for column, key in enumerate(self.keys)
+                              if column >= len(tombstones) or not tombstones[column]}
+        return self.key_index
+
+    def get_tombstones(self):
+        """ Bitmap of removed columns of D. Columns added after removals are not removed """
+
+        columns_number = len(self.keys) if self.D is None else self.D.shape[1]
+        if len(self.tombstones) < columns_number:
+            self.tombstones = np.concatenate([self.tombstones,
+                                              np.zeros(columns_number - len(self.tombstones), dtype=bool)])
+        return self.tombstones
+
+    def append_key(self, key):
+        self.get_key_index()[key] = len(self.keys)
+        self.keys.append(key)
+
     def add_document(self, raw_document, desired_id):
         """ Adds given document in semantic space
 
@@ -112,42 +214,36 @@ class Space(object):
 
         # here documents is a list with stemmed words
         document = self.prepare_document(raw_document)
+        return self.add_prepared_document(document, desired_id)
+
+    def add_prepared_document(self, document, desired_id):
+        """ Adds document which has been already prepared (see prepare_document) in semantic space """
+
         key = self.check_doc_key(desired_id)
-        self.keys.append(key)
+        self.append_key(key)
         self.docs[key] = document
-        self.words.extend(document)
-        self.manage_repeating_words()
+        self.add_words(document)
         return key
 
-    def tf_idf_transform(self):
-        """ TF-IDF transformation. Improves accuracy
+    def add_documents(self, documents):
+        """ Adds many documents in semantic space
 
-            tf - term frequency. how many terms in each document (sum of columns)
+        :param
+         documents - iterable of (raw_document, desired_id) pairs
 
-            ids - inverse document frequency number. of documents which contains term
-            (for each elem of each line: if elem is not zero sum one to counter)
+        :return
+         list of keys
         """
 
-        XL = self.X.tolist()
-        terms_in_doc = np.sum(XL, axis=0)
-
-        docs_with_term = []
-        for row in XL:
-            cnt = 0
-            for elem in row:
-                if elem != 0:
-                    cnt += 1
-            docs_with_term.append(cnt)
+        return [self.add_document(raw_document, desired_id) for raw_document, desired_id in documents]
 
-        rows, cols = self.X.shape
-        docs_number = cols
-        for i in range(rows):
-            for j in range(cols):
-                tf = XL[i][j] / terms_in_doc[j]
-                idf = math.log(float(docs_number) / docs_with_term[i])
-                XL[i][j] = tf * idf
+    def weighting_transform(self):
+        """ Weighting of X (TF-IDF by default). Improves accuracy. See weighting module for schemes """
 
-        self.X = np.matrix(np.array(XL).round(decimals=self.decimals))
+        X = self.weighting.fit_transform(self.X)
+        X.data = X.data.round(decimals=self.decimals)
+        X.eliminate_zeros()
+        self.X = X
 
     def build_base_matrix(self):
         """
@@ -155,37 +251,44 @@ class Space(object):
             Rows - indexed words
             Columns - documents
 
-        At the intersection - how many times the word entries in the text
+        At the intersection - how many times the word entries in the text.
+        The matrix is sparse (CSC), it is built from counters of documents words only,
+        so time and memory depend on number of non-zero elements, not on words x documents
 
         """
 
-        counters = {}
+        self.index_words()
+        indptr = [0]
+        indices = []
+        data = []
         for key in self.keys:
-            counters[key] = collections.Counter(self.docs[key])
+            for word, cnt in collections.Counter(self.docs[key]).items():
+                row = self.word_index.get(word)
+                if row is not None:
+                    indices.append(row)
+                    data.append(cnt)
+            indptr.append(len(indices))
 
-        lst = []
-        for word in self.words:
-            row = []
-            for key in self.keys:
-                counter = counters[key]
-                row.append(counter[word])
-            lst.append(row)
-
-        self.X = np.matrix(lst)
+        self.X = sparse.csc_matrix((np.array(data, dtype=np.int32), np.array(indices, dtype=np.int32), indptr),
+                                   shape=(len(self.words), len(self.keys)))
+        self.X.sort_indices()
 
     def svd(self):
-        """ Singular Value Decomposition of base matrix """
+        """ Singular Value Decomposition of base matrix.
+            Engine computes only latent_dimensions components, other ones are not needed for the space
+        """
 
         x, y = self.X.shape
         if not x or not y:
             raise exceptions.SvdEmptyTarget
 
-        T, S, D = np.linalg.svd(self.X, full_matrices=True)
+        self.check_latent_dimensions()
+        T, S, D = self.svd_engine.decompose(self.X, self.latent_dimensions)
 
         # numpy returns S as flat array of diagonal elements (+ round):
-        self.T = np.matrix(T.round(decimals=self.decimals))
-        self.S = np.matrix(np.diag(S).round(decimals=self.decimals))
-        self.D = np.matrix(D.round(decimals=self.decimals))
+        self.T = T.round(decimals=self.decimals)
+        self.S = np.diag(S).round(decimals=self.decimals)
+        self.D = D.round(decimals=self.decimals)
 
     def truncate_matrices(self):
         """ Truncate T, S and D matrices within latent_dimensions number
@@ -208,9 +311,184 @@ class Space(object):
         self.build_base_matrix()
         self.clear_self_docs()
         if self.use_tf_idf:
-            self.tf_idf_transform()
+            self.weighting_transform()
         self.svd()
         self.truncate_matrices()
+        self.T = self.store_matrix(self.T)
+        self.store_documents(self.D)
+        self.make_projection()
+        if self.ann_index is not None:
+            self.ann_index.build(self.D)
+        self.drift = {'built_documents': len(self.keys), 'added_documents': 0, 'lost_energy': 0.}
+
+    def build_semantic_space_out_of_core(self, documents, spill_folder, memory_budget=2 ** 30, manage_unique=True):
+        """ Build the space from documents which do not fit in memory all together.
+            Documents are not kept: their word counts are spilled to disk by chunks (see outofcore.SpilledMatrix),
+            X is weighted and decomposed chunk by chunk (svd engine should support decompose_chunks,
+            see svd.RandomizedSvdEngine) and D is written to memory-mapped file in spill_folder.
+            Only vocabulary, keys, one chunk and words x (k + oversampling) matrices are in memory
+
+        :param
+         documents - iterable of (prepared_document, desired_id) pairs, see prepare_document
+         spill_folder - folder for temporary files, D is kept there, so remove it after dumping the index
+         memory_budget - approximate memory limit in bytes, it sets size of chunks
+
+        Raises:
+            OutOfCoreImproperlyConfigured before documents are read if svd engine can not decompose X by chunks
+        """
+
+        if not self.svd_engine.decomposes_chunks:
+            raise exceptions.OutOfCoreImproperlyConfigured(
+                '%s can not decompose matrix by chunks, use svd.RandomizedSvdEngine' % type(self.svd_engine).__name__)
+
+        counts = outofcore.SpilledMatrix(os.path.join(spill_folder, 'counts'))
+        total_frequency, doc_frequency = self.spill_counts(documents, counts, memory_budget)
+        if not counts.rows or not len(self.keys):
+            raise exceptions.SvdEmptyTarget
+
+        words = self.words
+        if manage_unique:
+            words = self.select_words(self.words, dict(zip(self.words, total_frequency)),
+                                      dict(zip(self.words, doc_frequency)), len(self.keys))
+        selection = outofcore.make_rows_selection(counts.rows, [self.word_index[word] for word in words])
+        self.words = words
+        self.index_words()
+
+        def iterate_selected_chunks():
+            return (sparse.csc_matrix(selection.dot(chunk)) for chunk in counts.iterate_chunks())
+
+        if self.use_tf_idf:
+            self.weighting.fit_chunks(iterate_selected_chunks)
+        X = outofcore.SpilledMatrix(os.path.join(spill_folder, 'x'))
+        for chunk in iterate_selected_chunks():
+            if self.use_tf_idf:
+                chunk = self.weighting.transform(chunk)
+                chunk.data = chunk.data.round(decimals=self.decimals)
+                chunk.eliminate_zeros()
+            X.append(chunk)
+        counts.delete()
+
+        self.check_latent_dimensions()
+        T, S = self.svd_engine.decompose_chunks(X, self.latent_dimensions)
+        self.T = self.store_matrix(T.round(decimals=self.decimals))
+        self.S = np.diag(S).round(decimals=self.decimals)
+
+        # D = S^-1 * T^t * X = P^t * X, chunk by chunk
+        P = T * helpers.inverse_diagonal(self.S)
+        D = np.lib.format.open_memmap(os.path.join(spill_folder, 'd.npy'), mode='w+', dtype=self.storage_dtype,
+                                      shape=(len(S), X.shape[1]))
+        scales = np.ones(X.shape[1], dtype=np.float32) if self.storage_dtype == np.int8 else None
+        start = 0
+        for chunk in X.iterate_chunks():
+            columns = np.asarray(chunk.T.dot(P)).T.round(decimals=self.decimals)
+            if scales is not None:
+                columns, scales[start:start + chunk.shape[1]] = helpers.quantize_columns(columns)
+            D[:, start:start + chunk.shape[1]] = columns
+            start += chunk.shape[1]
+        D.flush()
+        X.delete()
+        self.set_documents(D, scales)
+
+        self.make_projection()
+        if self.ann_index is not None:
+            self.ann_index.build(self.D)
+        self.drift = {'built_documents': len(self.keys), 'added_documents': 0, 'lost_energy': 0.}
+
+    def spill_counts(self, documents, counts, memory_budget):
+        """ Write word counts of documents to counts (SpilledMatrix) by chunks which fit in memory_budget.
+            Words and keys are added to vocabulary and keys as usual
+
+        :returns
+         total frequencies and documents frequencies of words (np.arrays in order of self.words)
+        """
+
+        max_elements = max(memory_budget // self.OUT_OF_CORE_BYTES_PER_ELEMENT, 1)
+        frequencies = [np.zeros(0), np.zeros(0)]  # total and documents frequencies
+
+        def spill(indptr, indices, data):
+            chunk = sparse.csc_matrix((np.frombuffer(data, dtype=np.int32), np.frombuffer(indices, dtype=np.int32),
+                                       np.frombuffer(indptr, dtype=np.int64)), shape=(len(self.words), len(indptr) - 1))
+            chunk.sort_indices()
+            counts.append(chunk)
+            chunk_frequencies = [np.bincount(chunk.indices, weights=chunk.data, minlength=len(self.words)),
+                                 np.bincount(chunk.indices, minlength=len(self.words)).astype(float)]
+            for i in range(2):  # vocabulary only grows, so chunk frequencies are not shorter
+                chunk_frequencies[i][:len(frequencies[i])] += frequencies[i]
+            frequencies[:] = chunk_frequencies
+
+        indptr, indices, data = array.array('q', [0]), array.array('i'), array.array('i')
+        for document, desired_id in documents:
+            key = self.check_doc_key(desired_id)
+            self.append_key(key)
+            self.add_words(document)
+            for word, cnt in collections.Counter(document).items():
+                indices.append(self.word_index[word])
+                data.append(cnt)
+            indptr.append(len(indices))
+
+            if len(indices) >= max_elements:
+                spill(indptr, indices, data)
+                indptr, indices, data = array.array('q', [0]), array.array('i'), array.array('i')
+        if len(indptr) > 1:
+            spill(indptr, indices, data)
+        return frequencies
+
+    def make_projection(self):
+        """ Projection matrix P = T * S^-1 maps term-vector of a new document to its coordinates in the space.
+            T and S are fixed after build, so it is calculated once and kept with the index
+        """
+
+        self.P = self.store_matrix(self.T.astype(float) * helpers.inverse_diagonal(self.S))
+
+    def get_float_dtype(self):
+        """ dtype of T and P """
+        return np.dtype(np.float32) if self.storage_dtype == np.int8 else self.storage_dtype
+
+    def store_matrix(self, matrix):
+        """ Matrix in storage dtype, it is not copied if dtype is the same (memory-mapped one for example) """
+        return np.asarray(matrix, dtype=self.get_float_dtype())
+
+    def store_documents(self, D):
+        """ Keep D (float) in storage dtype """
+
+        if self.storage_dtype == np.int8:
+            self.set_documents(*helpers.quantize_columns(D))
+        else:
+            self.set_documents(np.asarray(D, dtype=self.storage_dtype))
+
+    def set_documents(self, D, scales=None):
+        """ Replace D (already in storage dtype) and scales of its columns """
+
+        self.D = D
+        self.D_scales = scales
+        self.documents_buffer = None
+
+    def append_documents(self, columns):
+        """ Add columns (float coordinates of documents) to the end of D. D and its scales are kept
+            in growable buffers (see helpers.ColumnBuffer), so D is not copied for every append.
+            Cached norms of documents are extended with norms of new columns only
+        """
+
+        if self.documents_buffer is None or self.documents_buffer[0].view is not self.D:  # D was replaced
+            self.documents_buffer = (helpers.ColumnBuffer(self.D),
+                                     None if self.D_scales is None else helpers.ColumnBuffer(self.D_scales))
+        D_buffer, scales_buffer = self.documents_buffer
+
+        norms_are_actual = self.docs_norms is not None and self.docs_norms_source is self.D
+        if self.storage_dtype == np.int8:
+            columns, scales = helpers.quantize_columns(columns)
+            self.D_scales = scales_buffer.append(scales)
+        self.D = D_buffer.append(columns)
+        if norms_are_actual:
+            self.docs_norms = np.concatenate([self.docs_norms, self.calculate_norms(self.D[:, len(self.docs_norms):])])
+            self.docs_norms_source = self.D
+
+    def get_documents(self):
+        """ D as float np.array, quantized D is restored with scales """
+
+        if self.D_scales is not None:
+            return self.D * self.D_scales
+        return self.D
 
     def draw_semantic_space(self, file_name='semantic_space.png'):
         if self.latent_dimensions > 2:
@@ -264,61 +542,213 @@ class Space(object):
 
         """
 
-        doc_word_positions = []
-        for word in new_document:
-            try:
-                word_pos = self.words.index(word)
-                doc_word_positions.append(word_pos)
-            except ValueError:
-                continue
+        doc_word_positions = {self.word_index[word] for word in new_document if word in self.word_index}
         if not doc_word_positions:
             return None
 
         # Xq is a term-vector of retrieval query q in semantic space. Its size: 1 x, t - number of terms in the space
         # If term is in the query its coordinate 1, else 0. Simple!
-        Xq = [1 if x in doc_word_positions else 0 for x in range(len(self.words))]
-        Dq = np.matrix(Xq) * self.T * self.S.I
-        return np.array(Dq.tolist()[0]).round(decimals=self.decimals)
+        # Dq = Xq * T * S^-1 = Xq * P, only rows of P for query terms matter,
+        # so the cost depends on query length, not on number of terms
+        Dq = self.P[sorted(doc_word_positions)].sum(axis=0)
+        return Dq.round(decimals=self.decimals)
 
-    def filter_distances(self, distances):
+    def filter_distances(self, distances, radius=None):
         """ Every document has some distance to the search query, even irrelevant
         This method takes relevant documents using calculated values of distance
 
         :param
-            distances - array of float values of distances between documents and query
+            distances - np.array of float values of distances between documents and query
+            radius - distance to the farthest of documents which are not in distances (estimated by approximate
+                search, see find_similar_documents)
+        :returns
+            np.array of booleans, True for relevant distances
         """
 
-        if not distances:
-            return list()
+        if not len(distances):
+            return np.zeros(0, dtype=bool)
 
-        radius = max(*distances)
+        radius = distances.max() if radius is None else max(radius, distances.max())
         threshold = radius * self.relevance_radius_threshold
-        return [d for d in distances if d < threshold]
+        return distances < threshold
 
-    # TODO: поиск сходных не только по координатам, но и по id
-    def find_similar_documents(self, doc_coords, limit=100, with_distances=False):
+    def get_docs_norms(self):
+        """ Lengths of documents vectors (columns of D). Cosine distance to all documents is a single
+            vector-matrix product divided by them. Only norms are cached, D itself is not copied
+            (it can be memory-mapped). Cache is recalculated only when D is replaced.
+            Norms of removed documents are NaN
+        """
+
+        if self.docs_norms is None or self.docs_norms_source is not self.D:
+            norms = self.calculate_norms(self.D)
+            norms[self.get_tombstones()] = np.nan  # so removed documents are never found
+            self.docs_norms = norms
+            self.docs_norms_source = self.D
+        return self.docs_norms
+
+    @staticmethod
+    def calculate_norms(D):
+        norms = np.sqrt(np.einsum('ij,ij->j', D, D, dtype=float))
+        norms[norms == 0] = np.nan  # distance to zero vector is undefined
+        return norms
+
+    def calculate_distances(self, doc_coords, columns=None):
+        """ Cosine distances between the given doc and all documents in the space (np.array, NaN if undefined)
+            If doc_coords is a matrix (coordinates of documents in rows) the result is a matrix too,
+            row for each given document
+
+            columns - array with numbers of D columns to calculate distances to, all columns by default
+        """
+
+        doc_coords = np.asarray(doc_coords, dtype=float)
+        norms = np.linalg.norm(doc_coords, axis=-1)
+        D = self.D
+        docs_norms = self.get_docs_norms()
+        if columns is not None:
+            D = D[:, columns]
+            docs_norms = docs_norms[columns]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 1 - self.dot_documents(doc_coords, D) / np.multiply.outer(norms, docs_norms)
+
+    def dot_documents(self, doc_coords, D):
+        """ doc_coords * D in precision of D. BLAS has no float16 and int8 products, such D is converted
+            to float32 by chunks of columns, so it is never copied all together
+        """
+
+        if D.dtype in (np.float32, np.float64):
+            return doc_coords.astype(D.dtype, copy=False).dot(D)
+
+        doc_coords = doc_coords.astype(np.float32)
+        result = np.empty(doc_coords.shape[:-1] + (D.shape[1],), dtype=np.float32)
+        for start in range(0, D.shape[1], self.DOT_CHUNK_SIZE):
+            result[..., start:start + self.DOT_CHUNK_SIZE] = \
+                doc_coords.dot(D[:, start:start + self.DOT_CHUNK_SIZE].astype(np.float32))
+        return result
+
+    def rank_distances(self, distances, limit=100, with_distances=False, columns=None, radius=None):
+        """ Take top limit relevant documents by distances to them (see find_similar_documents)
+
+            columns - numbers of D columns which distances are given, all columns by default
+            radius - see filter_distances
+        """
+
+        positions = np.flatnonzero(distances > 0)  # NaN is not greater than zero too
+        positions = self.select_nearest(distances, positions[self.filter_distances(distances[positions], radius)],
+                                        limit)
+
+        doc_columns = positions if columns is None else columns[positions]
+        if with_distances:
+            return [(self.keys[column], float(distances[i])) for column, i in zip(doc_columns, positions)]
+        return [self.keys[column] for column in doc_columns]
+
+    @staticmethod
+    def select_nearest(distances, positions, limit):
+        """ limit positions with the smallest distances, sorted by distance (by position if distances are equal) """
+
+        if limit is not None and limit < len(positions):
+            limit = max(limit, 0)
+            positions = positions[np.argpartition(distances[positions], limit)[:limit]]
+        return positions[np.lexsort((positions, distances[positions]))]
+
+    def find_similar_documents(self, doc_coords, limit=100, with_distances=False, exclude_column=None):
         """  Calculate cosine distances between docs and the given doc
         :param
             doc_coords:
                 np.array with coordinates of given document
             limit:
                 how many results (documents ids) to return
+            exclude_column:
+                number of D column to skip (document itself for example)
         :returns
             A sorted tuple with ids of relevant documents. The most relevant doc is the first
+
+        If ANN index is built distances are calculated only to documents from its nearest lists.
+        Relevance radius is estimated for the whole space: by distances to boundary documents of other lists too
         """
 
-        results = []
-        for i in range(self.D.shape[1]):
-            d = distance.cosine(helpers.get_matrix_column(self.D, i), doc_coords)
-            if not np.isnan(d) and d > 0:
-                results.append((self.keys[i], d))
-
-        relevant_distances = self.filter_distances([d[1] for d in results])
-        relevant_results = [r for r in results if r[1] in relevant_distances]
-        sorted_results = sorted(relevant_results, key=operator.itemgetter(1))
+        columns = radius = None
+        if self.ann_index is not None and self.ann_index.is_built():
+            columns = self.ann_index.candidates(doc_coords)
+            radius_columns = self.ann_index.radius_columns(doc_coords)
+            if radius_columns is not None and len(radius_columns):
+                radius_distances = self.calculate_distances(doc_coords, radius_columns)
+                radius_distances = radius_distances[radius_distances > 0]
+                radius = radius_distances.max() if len(radius_distances) else None
+
+        distances = self.calculate_distances(doc_coords, columns)
+        if exclude_column is not None:
+            distances[exclude_column if columns is None else columns == exclude_column] = np.nan
+        return self.rank_distances(distances, limit, with_distances, columns, radius)
+
+    def similar_to(self, doc_id, limit=100, with_distances=False):
+        """ Find documents similar to the document from the space. Its column of D is used as is,
+            without text preparing and projection. If neighbours table has been built for enough neighbours,
+            results are taken from it (see build_neighbours)
+
+        Raises:
+            DocumentDoesNotExist exception if doc_id is wrong
+        """
+
+        column = self.get_key_index().get(doc_id)
+        if column is None:
+            raise exceptions.DocumentDoesNotExist(doc_id)
+
+        results = self.get_neighbours(doc_id, limit, with_distances)
+        if results is not None:
+            return results
+        return self.find_similar_documents(self.D[:, column], limit, with_distances,
+                                           exclude_column=column)
+
+    def get_neighbours(self, doc_id, limit=100, with_distances=False):
+        """ Results of similar_to from neighbours table, None if the table is not enough: it is not built
+            for this document or for so many neighbours, or removed documents left less than limit of them
+        """
+
+        if self.neighbours is None or doc_id not in self.neighbours or limit is None or limit > self.neighbours_limit:
+            return None
+
+        # documents removed after table building are skipped
+        results = [(key, d) for key, d in self.neighbours[doc_id] if key in self.get_key_index()]
+        if len(results) < min(limit, len(self.neighbours[doc_id])):
+            return None
+        results = results[:limit]
         if with_distances:
-            return sorted_results[:limit]
-        return [doc_id for doc_id, dist in sorted_results[:limit]]
+            return results
+        return [key for key, d in results]
+
+    def build_neighbours(self, limit=10, chunk_size=1000):
+        """ Precompute limit nearest documents for every document, then similar_to takes them from the table.
+            Distances are calculated by matrix products for chunks of chunk_size documents.
+            Table is a snapshot: documents added after its building are not in it, rebuild it from time to time
+        """
+
+        D = self.D
+        self.neighbours = {}
+        self.neighbours_limit = limit
+        for start in range(0, D.shape[1], chunk_size):
+            distances = self.calculate_distances(D[:, start:start + chunk_size].T)
+            tombstones = self.get_tombstones()
+            for i, row in enumerate(distances):
+                if tombstones[start + i]:
+                    continue
+                row[start + i] = np.nan  # document itself
+                self.neighbours[self.keys[start + i]] = self.rank_distances(row, limit, with_distances=True)
+
+    def dump_neighbours(self):
+        """ Neighbours table in JSON-friendly format (keys of documents can be integers) """
+
+        if self.neighbours is None:
+            return None
+        return {'limit': self.neighbours_limit,
+                'neighbours': [[key, [list(pair) for pair in results]] for key, results in self.neighbours.items()]}
+
+    def load_neighbours(self, dump):
+        if dump is None:
+            self.neighbours = None
+            self.neighbours_limit = 0
+        else:
+            self.neighbours = {key: [tuple(pair) for pair in results] for key, results in dump['neighbours']}
+            self.neighbours_limit = dump['limit']
 
     def search(self, query, with_distances=False, limit=100):
         """ We consider that retrieval query is like a new document.
@@ -333,35 +763,337 @@ class Space(object):
             return None
         return self.find_similar_documents(pd_coords, limit, with_distances)
 
+    def make_semantic_space_coords_for_new_docs(self, new_documents):
+        """ Coordinates of many documents at once, see make_semantic_space_coords_for_new_doc.
+            Term-vectors of documents are rows of sparse matrix Xq, so coordinates are just Xq * P
+
+            :returns
+             np.array, size: len(new_documents) x self.latent_dimensions.
+             Documents without indexed words have zero coordinates
+        """
+
+        return self.project_term_vectors(self.make_term_vectors(new_documents))
+
+    def make_term_vectors(self, new_documents):
+        """ Sparse matrix Xq, its rows are term-vectors of documents (1 for indexed words of the document).
+            Documents without indexed words have empty rows, see indexed_words_numbers
+        """
+
+        indptr = [0]
+        indices = []
+        for document in new_documents:
+            indices.extend(sorted({self.word_index[word] for word in document if word in self.word_index}))
+            indptr.append(len(indices))
+
+        return sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(indptr) - 1, len(self.words)))
+
+    @staticmethod
+    def indexed_words_numbers(Xq):
+        """ Number of indexed words of every document, see make_term_vectors """
+        return np.diff(Xq.indptr)
+
+    def project_term_vectors(self, Xq):
+        """ Coordinates of documents by their term-vectors: Xq * P """
+        return np.asarray(Xq.dot(self.P)).round(decimals=self.decimals)
+
+    def search_many(self, queries, with_distances=False, limit=100, chunk_size=1000):
+        """ Search for many queries at once. Queries are projected into the space as one matrix and compared
+            with documents by one matrix product for each chunk of chunk_size queries (it limits memory usage).
+            If ANN index is built, results are the same as search returns: every query is compared with its
+            candidates only, see find_similar_documents
+
+            :returns
+             list with search results for every query (see search method), None for query without indexed words
+        """
+
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            Xq = self.make_term_vectors([self.prepare_document(query) for query in queries[start:start + chunk_size]])
+            coords = self.project_term_vectors(Xq)
+            words_numbers = self.indexed_words_numbers(Xq)
+            if self.ann_index is not None and self.ann_index.is_built():
+                # every query has its own candidates and radius, so queries are compared with documents one by one
+                results.extend(self.find_similar_documents(doc_coords, limit, with_distances) if words_number
+                               else None for doc_coords, words_number in zip(coords, words_numbers))
+                continue
+
+            distances = self.calculate_distances(coords)
+            for i, words_number in enumerate(words_numbers):
+                if not words_number:  # like search, coordinates rounded to zeros do not matter
+                    results.append(None)
+                else:
+                    results.append(self.rank_distances(distances[i], limit, with_distances))
+        return results
+
     def update_space_with_document(self, document, desired_id=None):
         """ Folding-in a new document into semantic space
             See add_document method for params and returns info
         """
 
-        new_key = self.check_doc_key(desired_id)
-        self.keys.append(new_key)
-        clear_doc = self.prepare_document(document)
-        doc_coords = self.make_semantic_space_coords_for_new_doc(clear_doc)
-        self.D = helpers.insert_column_to_matrix(self.D, doc_coords)
+        return self.update_space_with_documents([(document, desired_id)])[0]
+
+    def update_space_with_documents(self, documents):
+        """ Folding-in of many documents, D is extended only once
+            See add_documents method for params and returns info
+
+            Document without any indexed word gets zero coordinates, it will not be found by search
+        """
+
+        return self.fold_in_documents(documents)[0]
+
+    def fold_in_documents(self, documents):
+        """ See update_space_with_documents. Space without D (basis of the space which documents are kept
+            by shards, see search.shards) gets keys of documents only
+
+        :returns
+            new keys and coordinates of documents (columns, None if there are no documents)
+        """
+
+        columns_number = len(self.keys)
+        new_keys = []
+        columns = []
+        try:
+            for document, desired_id in documents:
+                new_key = self.check_doc_key(desired_id)
+                self.append_key(new_key)
+                new_keys.append(new_key)
+                clear_doc = self.prepare_document(document)
+                doc_coords = self.make_semantic_space_coords_for_new_doc(clear_doc)
+                columns.append(doc_coords if doc_coords is not None else np.zeros(len(self.S)))
+        except Exception:
+            del self.keys[columns_number:]
+            raise
+
+        if not columns:
+            return new_keys, None
+        columns = np.column_stack(columns)
+        if self.D is not None:
+            self.append_documents(columns)
+        if self.ann_index is not None and self.ann_index.is_built():
+            self.ann_index.add(columns)
+        self.drift['added_documents'] += len(new_keys)
+        return new_keys, columns
+
+    def update_svd_with_documents(self, documents, chunk_size=100):
+        """ Add documents into the space by incremental SVD update (M. Brand, 2006).
+            Unlike folding-in, T, S and D are updated, so the space takes new documents and new words
+            into account. New words are taken if they pass min_total_frequency rule within given documents.
+            Documents are processed by chunks of chunk_size, every chunk takes SVD of small (k + c) x (k + c) matrix,
+            but coordinates of all n documents are changed too: it is O(k^2 n) for every chunk plus quantization
+            of D (if storage_dtype is int8) and assignment of documents to lists of ANN index once. So update is
+            much cheaper than rebuilding, but its cost still grows with size of the space.
+            See add_documents method for params and returns info
+
+            Raises:
+                IndexRebuildRequired if weighting statistics of the space are unknown (old index)
+        """
+
+        if self.use_tf_idf and not self.weighting.is_fitted():
+            raise exceptions.IndexRebuildRequired('weighting statistics are not kept with the index')
+
+        columns_number = len(self.keys)
+        new_keys = []
+        prepared_docs = []
+        try:
+            for document, desired_id in documents:
+                new_key = self.check_doc_key(desired_id)
+                self.append_key(new_key)
+                new_keys.append(new_key)
+                prepared_docs.append(self.prepare_document(document))
+        except Exception:
+            del self.keys[columns_number:]
+            raise
+
+        self.add_new_words(prepared_docs)
+        transform = np.identity(len(self.S))
+        for start in range(0, len(prepared_docs), chunk_size):
+            transform = self.update_svd(self.make_weighted_columns(prepared_docs[start:start + chunk_size])).dot(
+                transform)
+
+        self.make_projection()
+        if self.ann_index is not None and self.ann_index.is_built():
+            self.ann_index.reassign(self.D, transform)  # basis of the space is changed
+        self.neighbours = None
+        self.drift['added_documents'] += len(new_keys)
+        return new_keys
+
+    def add_new_words(self, documents):
+        """ Add unknown words of prepared documents to vocabulary, T gets zero rows for them """
+
+        min_total_frequency = dict(self.DEFAULT_VOCABULARY_OPTIONS, **self.vocabulary_options)['min_total_frequency']
+        counter = collections.Counter(word for document in documents for word in document
+                                      if word not in self.word_index)
+        new_words = [word for word, cnt in counter.items() if cnt >= min_total_frequency]
+        if not new_words:
+            return
+
+        self.add_words(new_words)
+        self.T = self.store_matrix(np.vstack([self.T, np.zeros((len(new_words), self.T.shape[1]))]))
+        if self.use_tf_idf:
+            self.weighting.add_terms(len(new_words))
+
+    def make_weighted_columns(self, documents):
+        """ Terms-to-documents matrix (like X) for prepared documents, weighted by weighting of the space """
+
+        indptr = [0]
+        indices = []
+        data = []
+        for document in documents:
+            for word, cnt in collections.Counter(document).items():
+                row = self.word_index.get(word)
+                if row is not None:
+                    indices.append(row)
+                    data.append(cnt)
+            indptr.append(len(indices))
+
+        A = sparse.csc_matrix((np.array(data, dtype=float), indices, indptr), shape=(len(self.words), len(documents)))
+        if self.use_tf_idf:
+            A = self.weighting.transform(A)
+        return A
+
+    def update_svd(self, A):
+        """ Rank-k update of SVD of X with new columns A: X' = [X A] ~ T' S' D'
+
+            M = T^t * A - coordinates of A in the space, R_a = A - T * M - its part orthogonal to the space,
+            R_a = Q * R (QR decomposition). Then [X A] = [T Q] * K * [[D, 0], [0, I]], where
+            K = [[S, M], [0, R]] is small (k + c) x (k + c) matrix, so only SVD of K is needed
+
+        :returns
+         k x k matrix of linear map of old documents coordinates to new ones
+        """
+
+        T = self.T.astype(float, copy=False)
+        singular_values = np.diag(self.S).astype(float)
+        D = self.get_documents().astype(float, copy=False)
+        A = A.toarray()
+        k, c = len(singular_values), A.shape[1]
+
+        M = T.T.dot(A)
+        Q, R = np.linalg.qr(A - T.dot(M))
+        K = np.zeros((k + c, k + c))
+        K[:k, :k] = np.diag(singular_values)
+        K[:k, k:] = M
+        K[k:, k:] = R
+        Tk, Sk, Dk = np.linalg.svd(K)
+
+        self.T = self.store_matrix(np.hstack([T, Q]).dot(Tk[:, :k]).round(decimals=self.decimals))
+        self.S = np.diag(Sk[:k]).round(decimals=self.decimals)
+        self.store_documents(np.hstack([Dk[:k, :k].dot(D), Dk[:k, k:]]).round(decimals=self.decimals))
+        self.drift['lost_energy'] += float((Sk[k:] ** 2).sum())
+        return Dk[:k, :k]
+
+    def get_drift(self):
+        """ How far the space is from the one full rebuild would make:
+                added_documents - documents added after building (by folding-in and SVD updates)
+                added_part - part of added documents in the space
+                lost_energy_part - part of the collection energy (sum of squared singular values)
+                    truncated by incremental SVD updates
+        """
+
+        added = self.drift['added_documents']
+        total = self.drift['built_documents'] + added
+        lost_energy = self.drift['lost_energy']
+        energy = float((np.diag(self.S).astype(float) ** 2).sum()) + lost_energy
+        return {'added_documents': added,
+                'added_part': float(added) / total if total else 0.,
+                'lost_energy_part': lost_energy / energy if energy else 0.}
+
+    def is_rebuild_advised(self, max_added_part=0.3, max_lost_energy_part=0.1):
+        drift = self.get_drift()
+        return drift['added_part'] > max_added_part or drift['lost_energy_part'] > max_lost_energy_part
+
+    def dump_meta(self):
+        """ Weighting statistics, they are changed only by building and SVD updates. Drift is kept apart,
+            it is changed by every update
+        """
+
+        return {'weighting': self.weighting.dump() if self.use_tf_idf else None}
 
-        return new_key
+    def load_meta(self, meta):
+        if meta.get('weighting') is not None:
+            self.weighting.load(meta['weighting'])
+        self.drift = meta.get('drift', self.drift)  # index dumped before drift has been kept apart
 
     def remove_document(self, doc_id):
-        """ Remove document from built space.
+        """ Remove document from built space. Its column of D is marked as removed (tombstone) and
+            is skipped by search, D is not changed. Use compact method to drop removed columns at once
+
+        :returns
+            number of removed column
 
         Raises:
             DocumentDoesNotExist exception if doc_id is not wrong
         """
-        if doc_id not in self.keys:
+        col_num = self.get_key_index().get(doc_id)
+        if col_num is None:
             raise exceptions.DocumentDoesNotExist(doc_id)
 
-        col_num = self.keys.index(doc_id)
-        self.D = np.delete(self.D, col_num, 1)  # remove document from space
-        self.keys.remove(doc_id)  # remove its pk
+        self.get_tombstones()[col_num] = True
+        self.removed_number += 1
+        del self.key_index[doc_id]
+        if self.docs_norms is not None:
+            self.docs_norms[col_num] = np.nan
+        return col_num
+
+    def get_removed_part(self):
+        return float(self.removed_number) / len(self.keys) if self.keys else 0.
+
+    def compact(self):
+        """ Drop columns of removed documents from D and their keys. D is copied once for all removals
+
+        :returns
+            number of dropped columns
+        """
+
+        if not self.removed_number:
+            return 0
+
+        tombstones = self.get_tombstones()
+        self.set_documents(self.D[:, ~tombstones], None if self.D_scales is None else self.D_scales[~tombstones])
+        self.keys = [key for key, is_removed in zip(self.keys, tombstones) if not is_removed]
+        if self.ann_index is not None and self.ann_index.is_built():
+            self.ann_index.remove(np.flatnonzero(tombstones))
+        removed_number = self.removed_number
+        self.load_tombstones([])
+        return removed_number
+
+    def dump_tombstones(self):
+        """ Numbers of removed columns """
+        return np.flatnonzero(self.get_tombstones()).tolist()
+
+    def load_tombstones(self, columns):
+        self.tombstones = np.zeros(0, dtype=bool)
+        self.get_tombstones()[columns] = True
+        self.removed_number = len(set(columns))
+        self.key_index = {}
+        self.docs_norms = None
+
+    def load_from_dump(self, t, s, d, words, keys, p=None, d_scales=None):
+        """ Matrices are converted to storage dtype if they are kept in another one.
+            d is None for basis of the space only (its documents are kept by shards, see search.shards)
+        """
 
-    def load_from_dump(self, t, s, d, words, keys):
-        self.T = t
-        self.S = s
-        self.D = d
+        self.T = self.store_matrix(t)
+        self.S = np.asarray(s)
+        self.load_documents(d, d_scales)
         self.words = words
         self.keys = keys
+        self.load_tombstones([])
+        self.index_words()
+        self.drift = {'built_documents': len(keys), 'added_documents': 0, 'lost_energy': 0.}
+        if p is None:  # index was built before projection matrix has been kept
+            self.make_projection()
+        else:
+            self.P = self.store_matrix(p)
+
+    def load_documents(self, d, d_scales=None):
+        """ Replace D with loaded one (or part of it), see load_from_dump """
+
+        if d is None:
+            self.set_documents(None)
+        elif d_scales is not None and self.storage_dtype == np.int8:
+            self.set_documents(np.asarray(d, dtype=np.int8), np.asarray(d_scales, dtype=np.float32))
+        elif d_scales is not None:  # quantized index is loaded with another storage dtype
+            self.store_documents(np.asarray(d) * np.asarray(d_scales, dtype=np.float32))
+        else:
+            self.store_documents(d)
@@ -0,0 +1,54 @@
+import os
+import shutil
+
+import numpy as np
+from scipy import sparse
+
+
+class SpilledMatrix(object):
+    """ Sparse terms-to-documents matrix kept on disk by chunks of columns. Every chunk is CSC matrix
+        saved as three .npy files (data, indices, indptr), they are memory-mapped on reading,
+        so only one chunk is in memory at once. Rows can be added between chunks (vocabulary grows)
+    """
+
+    PARTS = ('data', 'indices', 'indptr')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.chunks = []  # number of columns in every chunk
+        self.rows = 0
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+    @property
+    def shape(self):
+        return self.rows, sum(self.chunks)
+
+    def get_chunk_path(self, number, part):
+        return os.path.join(self.folder, 'chunk_%d_%s.npy' % (number, part))
+
+    def append(self, X):
+        X = sparse.csc_matrix(X)
+        for part in self.PARTS:
+            np.save(self.get_chunk_path(len(self.chunks), part), getattr(X, part))
+        self.chunks.append(X.shape[1])
+        self.rows = max(self.rows, X.shape[0])
+
+    def load_chunk(self, number):
+        arrays = tuple(np.load(self.get_chunk_path(number, part), mmap_mode='r') for part in self.PARTS)
+        return sparse.csc_matrix(arrays, shape=(self.rows, self.chunks[number]), copy=False)
+
+    def iterate_chunks(self):
+        for number in range(len(self.chunks)):
+            yield self.load_chunk(number)
+
+    def delete(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+        self.chunks = []
+
+
+def make_rows_selection(rows, selected_rows):
+    """ Sparse matrix R, R * X takes selected_rows of X in given order """
+
+    return sparse.csr_matrix((np.ones(len(selected_rows)), (np.arange(len(selected_rows)), selected_rows)),
+                             shape=(len(selected_rows), rows))
@@ -0,0 +1,62 @@
+""" Documents preparing (cleaning, stop words excluding, stemming) in a pool of processes.
+    Every worker process keeps its own Space instance which is used only to prepare documents
+"""
+
+import itertools
+import multiprocessing
+
+from lsa.indexer import core
+
+worker_space = None
+
+
+def init_worker(space_kwargs):
+    global worker_space
+    worker_space = core.Space(**space_kwargs)
+
+
+def prepare_documents(raw_documents):
+    return [worker_space.prepare_document(document) for document in raw_documents]
+
+
+def iterate_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def prepare_in_pool(documents, space_kwargs, workers, chunk_size=500):
+    """ Generator of (prepared_document, desired_id) pairs in the same order as given documents.
+        Documents are sent to workers by chunks, only 2 * workers chunks are processed at the same time,
+        the next ones are being prepared while results of previous ones are being taken
+
+    :param
+        documents - iterable of (raw_document, desired_id) pairs
+        space_kwargs - kwargs for core.Space, its settings are used to prepare documents
+        workers - number of processes
+        chunk_size - number of documents sent to a worker at once
+    """
+
+    def submit(window):
+        if not window:
+            return None
+        return pool.map_async(prepare_documents, [[doc for doc, desired_id in chunk] for chunk in window])
+
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(space_kwargs,))
+    try:
+        chunks = iterate_chunks(documents, chunk_size)
+        window = list(itertools.islice(chunks, 2 * workers))
+        pending = submit(window)
+        while pending is not None:
+            next_window = list(itertools.islice(chunks, 2 * workers))
+            next_pending = submit(next_window)
+            for chunk, prepared_chunk in zip(window, pending.get()):
+                for (raw_document, desired_id), document in zip(chunk, prepared_chunk):
+                    yield document, desired_id
+            window, pending = next_window, next_pending
+    finally:
+        pool.terminate()
+        pool.join()
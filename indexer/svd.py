@@ -0,0 +1,125 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+
+# indexer.svd.FullSvdEngine
+# indexer.svd.TruncatedSvdEngine
+# indexer.svd.RandomizedSvdEngine
+
+class BaseSvdEngine(object):
+    """ Engine computes k-rank singular value decomposition of terms-to-documents matrix X.
+        Only k components are needed for semantic space, so engines should not calculate the rest.
+    """
+
+    decomposes_chunks = False  # see decompose_chunks
+
+    def decompose(self, X, k):
+        """
+        :param
+            X: terms-to-documents matrix (scipy.sparse or numpy)
+            k: number of components to compute
+        :returns
+            T: np.array, size words x k
+            S: flat np.array with k singular values in descending order
+            D: np.array, size k x documents
+        """
+        raise NotImplementedError
+
+    def decompose_chunks(self, X, k):
+        """ Decomposition of X which does not fit in memory, see indexer.outofcore.SpilledMatrix
+
+        :param
+            X: object with shape attribute and iterate_chunks method (generator of chunks of columns of X)
+            k: number of components to compute
+        :returns
+            T and S (see decompose). D is not returned, it is as big as X, calculate it by chunks: S^-1 * T^t * X
+        """
+        raise NotImplementedError('%s can not decompose matrix by chunks' % type(self).__name__)
+
+
+class FullSvdEngine(BaseSvdEngine):
+    """ Dense LAPACK decomposition. Exact, but works with the whole dense X. Good for small collections """
+
+    def decompose(self, X, k):
+        if sparse.issparse(X):
+            X = X.toarray()
+        T, S, D = np.linalg.svd(np.asarray(X, dtype=float), full_matrices=False)
+        return T[:, :k], S[:k], D[:k]
+
+
+class TruncatedSvdEngine(BaseSvdEngine):
+    """ ARPACK solver for sparse matrices. Computes exactly k largest singular triplets """
+
+    def __init__(self, tol=0, maxiter=None):
+        self.tol = tol
+        self.maxiter = maxiter
+
+    def decompose(self, X, k):
+        if k >= min(X.shape):
+            # ARPACK can not find all the singular values, matrix is small enough for dense solver
+            return FullSvdEngine().decompose(X, k)
+
+        X = sparse.csc_matrix(X, dtype=float)
+        T, S, D = sparse_linalg.svds(X, k=k, tol=self.tol, maxiter=self.maxiter)
+        order = np.argsort(S)[::-1]  # svds returns singular values in ascending order
+        return T[:, order], S[order], D[order]
+
+
+class RandomizedSvdEngine(BaseSvdEngine):
+    """ Randomized range finder by Halko, Martinsson and Tropp.
+
+        oversampling - how many extra random vectors to use (more - better accuracy)
+        power_iterations - number of power iterations, helps when singular values decay slowly
+        random_state - seed, set it to get reproducible spaces
+    """
+
+    decomposes_chunks = True
+
+    def __init__(self, oversampling=10, power_iterations=2, random_state=None):
+        self.oversampling = oversampling
+        self.power_iterations = power_iterations
+        self.random_state = random_state
+
+    def decompose(self, X, k):
+        rows, cols = X.shape
+        size = min(k + self.oversampling, rows, cols)
+        random = np.random.RandomState(self.random_state)
+
+        Q, _ = np.linalg.qr(np.asarray(X.dot(random.standard_normal((cols, size)))))
+        for i in range(self.power_iterations):
+            Z, _ = np.linalg.qr(np.asarray(X.T.dot(Q)))
+            Q, _ = np.linalg.qr(np.asarray(X.dot(Z)))
+
+        B = np.asarray(X.T.dot(Q)).T  # size x documents
+        U, S, D = np.linalg.svd(B, full_matrices=False)
+        T = Q.dot(U)
+        return T[:, :k], S[:k], D[:k]
+
+    def decompose_chunks(self, X, k):
+        """ The same range finder, but every pass reads X by chunks of columns and only
+            words x (k + oversampling) matrices are kept in memory. Power iterations use X * X^t,
+            singular values are found from eigenvalues of B * B^t (B = Q^t * X)
+        """
+
+        rows, cols = X.shape
+        size = min(k + self.oversampling, rows, cols)
+        random = np.random.RandomState(self.random_state)
+
+        Y = np.zeros((rows, size))
+        for chunk in X.iterate_chunks():
+            Y += np.asarray(chunk.dot(random.standard_normal((chunk.shape[1], size))))
+        Q, _ = np.linalg.qr(Y)
+        for i in range(self.power_iterations):
+            Y = np.zeros((rows, size))
+            for chunk in X.iterate_chunks():
+                Y += np.asarray(chunk.dot(np.asarray(chunk.T.dot(Q))))
+            Q, _ = np.linalg.qr(Y)
+
+        BBt = np.zeros((size, size))
+        for chunk in X.iterate_chunks():
+            B = np.asarray(chunk.T.dot(Q)).T
+            BBt += B.dot(B.T)
+        eigenvalues, U = np.linalg.eigh(BBt)
+        order = np.argsort(eigenvalues)[::-1][:k]
+        return Q.dot(U[:, order]), np.sqrt(np.maximum(eigenvalues[order], 0))
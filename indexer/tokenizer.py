@@ -0,0 +1,27 @@
+from lsa.utils.stops import STOP_WORDS, EXCLUDE_CHARS
+
+
+# indexer.tokenizer.Tokenizer
+
+class Tokenizer(object):
+    """ Splits raw document to words. Trash chars are replaced by one translation table,
+        stop words are excluded with set lookups, all in one pass over the document
+
+        stop_words - collection of words to exclude (Russian stop words by default)
+        chars_to_exclude - string with chars which are not parts of words
+    """
+
+    def __init__(self, stop_words=STOP_WORDS, chars_to_exclude=EXCLUDE_CHARS):
+        self.stop_words = frozenset(stop_words)
+        self.chars_to_exclude = chars_to_exclude
+        self.translation = str.maketrans({char: ' ' for char in chars_to_exclude})
+
+    def exclude_trash(self, document):
+        return document.translate(self.translation)
+
+    def exclude_stops(self, document):
+        return [word for word in document.split() if word not in self.stop_words]
+
+    def tokenize(self, document):
+        """ Returns list of lowercase words without trash and stop words """
+        return self.exclude_stops(self.exclude_trash(document.lower()))
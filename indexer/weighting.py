@@ -0,0 +1,159 @@
+import numpy as np
+from scipy import sparse
+
+
+# indexer.weighting.TfIdfWeighting
+# indexer.weighting.LogEntropyWeighting
+# indexer.weighting.Bm25Weighting
+
+class BaseWeighting(object):
+    """ Weighting scheme transforms terms-to-documents matrix of raw counts. Weight of each element is
+        local weight (of term in document) multiplied by global weight (of term in collection).
+
+        Statistics of collection are calculated by fit method, transform method uses them.
+        All calculations are done with non-zero elements of sparse matrix only.
+
+        Statistics are sums over documents, so they can be collected by chunks of columns of X (fit_chunks),
+        it is used when X does not fit in memory. Local weights depend on the document only,
+        so transform works with any chunk of columns
+    """
+
+    def fit(self, X):
+        return self.fit_chunks(lambda: [X])
+
+    def fit_chunks(self, get_chunks):
+        """
+        :param
+            get_chunks: function returning iterator of chunks of columns of X, it can be called
+                several times if scheme needs several passes over X
+        """
+        raise NotImplementedError
+
+    def transform(self, X):
+        raise NotImplementedError
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def is_fitted(self):
+        return getattr(self, 'global_weights', None) is not None
+
+    def add_terms(self, number):
+        """ Global weights for new terms (added to the space after fitting) - mean of known ones """
+
+        mean_weight = self.global_weights.mean() if len(self.global_weights) else 1.
+        self.global_weights = np.concatenate([self.global_weights, np.full(number, mean_weight)])
+
+    def dump(self):
+        """ Fitted statistics in JSON-friendly format """
+        return {'global_weights': self.global_weights.tolist()} if self.is_fitted() else None
+
+    def load(self, state):
+        self.global_weights = np.array(state['global_weights']) if state else None
+
+    @staticmethod
+    def prepare(X):
+        X = sparse.csc_matrix(X, dtype=float, copy=True)
+        X.sum_duplicates()
+        X.eliminate_zeros()
+        return X
+
+    @staticmethod
+    def columns_of_elements(X):
+        """ Column number of every element in X.data (X is CSC matrix) """
+        return np.repeat(np.arange(X.shape[1]), np.diff(X.indptr))
+
+
+class TfIdfWeighting(BaseWeighting):
+    """ tf - frequency of term in document (count divided by number of terms in document)
+        idf - inverse document frequency, log(documents number / number of documents which contain term)
+    """
+
+    def fit_chunks(self, get_chunks):
+        docs_number = 0
+        docs_with_term = 0
+        for X in get_chunks():
+            X = self.prepare(X)
+            docs_number += X.shape[1]
+            docs_with_term = docs_with_term + np.bincount(X.indices, minlength=X.shape[0]).astype(float)
+        docs_with_term[docs_with_term == 0] = docs_number  # idf of never used term is zero
+        self.global_weights = np.log(docs_number / docs_with_term)
+        return self
+
+    def transform(self, X):
+        X = self.prepare(X)
+        terms_in_doc = np.asarray(X.sum(axis=0)).ravel()
+        terms_in_doc[terms_in_doc == 0] = 1  # empty documents stay empty, avoid division by zero
+        X.data *= self.global_weights[X.indices] / terms_in_doc[self.columns_of_elements(X)]
+        return X
+
+
+class LogEntropyWeighting(BaseWeighting):
+    """ Local weight - log(1 + count)
+        Global weight - 1 + sum(p * log(p)) / log(documents number), where p = count / total count of term.
+        Terms spread evenly over collection get low weight, the popular choice for LSA
+    """
+
+    def fit_chunks(self, get_chunks):
+        docs_number = 0
+        term_counts = 0
+        for X in get_chunks():
+            X = self.prepare(X)
+            docs_number += X.shape[1]
+            term_counts = term_counts + np.bincount(X.indices, weights=X.data, minlength=X.shape[0])
+
+        entropy = 0
+        for X in get_chunks():  # p needs total counts of terms, so the second pass
+            X = self.prepare(X)
+            p = X.data / term_counts[X.indices]
+            entropy = entropy + np.bincount(X.indices, weights=p * np.log(p), minlength=X.shape[0])
+        terms_number = len(term_counts)
+        self.global_weights = 1 + entropy / np.log(docs_number) if docs_number > 1 else np.ones(terms_number)
+        return self
+
+    def transform(self, X):
+        X = self.prepare(X)
+        X.data = np.log1p(X.data) * self.global_weights[X.indices]
+        return X
+
+
+class Bm25Weighting(BaseWeighting):
+    """ Okapi BM25. Local weight saturates with term count (k1) and is normalized by document length (b)
+        Global weight - BM25 idf: log(1 + (documents number - df + 0.5) / (df + 0.5))
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def fit_chunks(self, get_chunks):
+        docs_number = 0
+        docs_with_term = 0
+        total_length = 0
+        for X in get_chunks():
+            X = self.prepare(X)
+            docs_number += X.shape[1]
+            docs_with_term = docs_with_term + np.bincount(X.indices, minlength=X.shape[0])
+            total_length += X.sum()
+        self.global_weights = np.log(1 + (docs_number - docs_with_term + 0.5) / (docs_with_term + 0.5))
+        self.average_doc_length = total_length / docs_number if docs_number else 0
+        return self
+
+    def dump(self):
+        state = super(Bm25Weighting, self).dump()
+        if state is not None:
+            state['average_doc_length'] = float(self.average_doc_length)
+        return state
+
+    def load(self, state):
+        super(Bm25Weighting, self).load(state)
+        self.average_doc_length = state['average_doc_length'] if state else 0
+
+    def transform(self, X):
+        X = self.prepare(X)
+        doc_lengths = np.asarray(X.sum(axis=0)).ravel()
+        average_doc_length = self.average_doc_length or 1
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths / average_doc_length)
+        tf = X.data
+        X.data = tf * (self.k1 + 1) / (tf + norm[self.columns_of_elements(X)]) * self.global_weights[X.indices]
+        return X
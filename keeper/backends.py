@@ -1,3 +1,4 @@
+import io
 import json
 import os
 import shutil
@@ -8,6 +9,12 @@ from lsa.keeper import base
 
 
 class JsonIndexBackend(base.BaseIndexBackend):
+    """ Appended parts are kept in delta file (file_name + DELTA_SUFFIX) next to the object file,
+        one JSON line per append: list of matrix columns or list items
+    """
+
+    DELTA_SUFFIX = '.delta'
+
     def __init__(self, **keep_index_info):
         self.index_folder = keep_index_info.get('path_to_index_folder')
         self.manage_index_folder()
@@ -17,22 +24,209 @@ class JsonIndexBackend(base.BaseIndexBackend):
         if not os.path.exists(self.index_folder):
             os.makedirs(self.index_folder)
 
-    def dump(self, obj, file_name):
+    def dump(self, obj, file_name, appendable=False):
         self.manage_index_folder()
         file_path = os.path.join(self.index_folder, file_name)
-        if isinstance(obj, np.matrix):
-            obj = obj.tolist()
+        if isinstance(obj, np.ndarray):
+            obj = self.matrix_to_list(obj)
         with open(file_path, 'w') as file:
             json.dump(obj, file)
+        self.remove_delta(file_name)
+
+    @staticmethod
+    def matrix_to_list(matrix):
+        """ float32 and float16 numbers are written with their own precision (0.1, not 0.10000000149011612) """
+
+        matrix = np.asarray(matrix)
+        if matrix.dtype not in (np.float16, np.float32):
+            return matrix.tolist()
+        if matrix.ndim > 1:
+            return [JsonIndexBackend.matrix_to_list(row) for row in matrix]
+        return [float(str(number)) for number in matrix]
+
+    def get_delta_path(self, file_name, is_matrix=False):
+        return os.path.join(self.index_folder, file_name + self.DELTA_SUFFIX)
+
+    def remove_delta(self, file_name, is_matrix=False):
+        delta_path = self.get_delta_path(file_name, is_matrix)
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+
+    def append(self, obj, file_name):
+        if isinstance(obj, np.ndarray):
+            obj = self.matrix_to_list(np.asarray(obj).T)  # columns
+        with open(self.get_delta_path(file_name), 'a') as file:
+            file.write(json.dumps(obj, separators=(',', ':')) + '\n')
+
+    def load_delta(self, file_name):
+        """ Appended columns or items, empty list if nothing was appended """
+
+        delta_path = self.get_delta_path(file_name)
+        if not os.path.exists(delta_path):
+            return []
+        items = []
+        with open(delta_path, 'r') as file:
+            for line in file:
+                if line.endswith('\n'):  # the last line may be unfinished by concurrent append
+                    items.extend(json.loads(line))
+        return items
 
     def load(self, file_name, return_matrix=False):
         file_path = os.path.join(self.index_folder, file_name)
         with open(file_path, 'r') as file:
             obj = json.load(file)
+        delta = self.load_delta(file_name)
         if return_matrix:
-            return np.matrix(obj)
-        return obj
+            if delta:
+                return np.hstack([np.array(obj, dtype=float), np.array(delta, dtype=float).T])
+            return np.array(obj)
+        return obj + delta if delta else obj
+
+    def exists(self, file_name):
+        return os.path.exists(os.path.join(self.index_folder, file_name))
+
+    def get_index_version(self):
+        if not os.path.exists(self.index_folder):
+            return None
+        files = []
+        for entry in os.scandir(self.index_folder):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # temporary file of unfinished dump
+                continue
+            files.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(files))
 
     def delete_index(self):
         if os.path.exists(self.index_folder):
             shutil.rmtree(self.index_folder)
+
+
+class NpyIndexBackend(JsonIndexBackend):
+    """ Matrices are kept in binary .npy files and loaded memory-mapped, so loading takes no time
+        and pages of the index are shared by OS between processes. Lists are kept in compact JSON.
+        Appendable matrices (D) are kept in column-major order, appended columns are written to the end
+        of the file and its header is updated in place, so the loaded matrix stays memory-mapped.
+
+        keep_index_info:
+            path_to_index_folder
+            mmap_mode - see numpy.load, 'r' by default. None loads matrices into memory
+    """
+
+    MATRIX_EXTENSION = '.npy'
+    ARRAY_HEADER_FUNCTIONS = {
+        (1, 0): (np.lib.format.read_array_header_1_0, np.lib.format.write_array_header_1_0),
+        (2, 0): (np.lib.format.read_array_header_2_0, np.lib.format.write_array_header_2_0),
+    }
+
+    def __init__(self, **keep_index_info):
+        super(NpyIndexBackend, self).__init__(**keep_index_info)
+        self.mmap_mode = keep_index_info.get('mmap_mode', 'r')
+
+    def get_file_path(self, file_name, is_matrix=False):
+        if is_matrix:
+            file_name = os.path.splitext(file_name)[0] + self.MATRIX_EXTENSION
+        return os.path.join(self.index_folder, file_name)
+
+    def dump(self, obj, file_name, appendable=False):
+        """ Files are written to temporary path and then replaced, so processes which have mapped
+            the old file keep working with it
+        """
+
+        self.manage_index_folder()
+        is_matrix = isinstance(obj, np.ndarray)
+        file_path = self.get_file_path(file_name, is_matrix)
+        tmp_file_path = file_path + '.tmp'
+        if is_matrix:
+            with open(tmp_file_path, 'wb') as file:
+                if appendable and obj.ndim == 2:
+                    self.write_column_major(file, np.asarray(obj))
+                else:
+                    np.save(file, np.asarray(obj))
+        else:
+            with open(tmp_file_path, 'w') as file:
+                json.dump(obj, file, separators=(',', ':'))
+        # new file contains appended parts, readers may miss them for a moment, but never get them twice
+        self.remove_delta(file_name, is_matrix)
+        os.replace(tmp_file_path, file_path)
+
+    def write_column_major(self, file, matrix, chunk_size=10000):
+        """ Write .npy file of matrix in Fortran order by chunks of columns, so matrix is not copied.
+            numpy leaves space in the header for growing number of columns
+        """
+
+        header = {'descr': np.lib.format.dtype_to_descr(matrix.dtype), 'fortran_order': True, 'shape': matrix.shape}
+        np.lib.format.write_array_header_1_0(file, header)
+        for start in range(0, matrix.shape[1], chunk_size):
+            np.ascontiguousarray(matrix[:, start:start + chunk_size].T).tofile(file)
+
+    def get_delta_path(self, file_name, is_matrix=False):
+        return self.get_file_path(file_name, is_matrix) + self.DELTA_SUFFIX
+
+    def append(self, obj, file_name):
+        """ Matrix columns are written to the end of column-major matrix file, then its header gets new shape,
+            so readers never see unfinished columns. Columns of row-major matrix (index of older version)
+            are appended to delta file as raw data of dtype of the matrix file, see load
+        """
+
+        if not isinstance(obj, np.ndarray):
+            return super(NpyIndexBackend, self).append(obj, file_name)
+        with open(self.get_file_path(file_name, True), 'r+b') as file:
+            version = np.lib.format.read_magic(file)
+            read_header, write_header = self.ARRAY_HEADER_FUNCTIONS[version]
+            shape, fortran_order, dtype = read_header(file)
+            data_offset = file.tell()
+            columns = np.asarray(obj, dtype=dtype)
+            header = io.BytesIO()
+            write_header(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': True,
+                                  'shape': (shape[0], shape[1] + columns.shape[1])})
+
+            if not fortran_order or header.tell() != data_offset or \
+                    os.path.exists(self.get_delta_path(file_name, True)):
+                with open(self.get_delta_path(file_name, True), 'ab') as delta_file:
+                    columns.T.tofile(delta_file)
+                return
+
+            file.seek(data_offset + shape[0] * shape[1] * dtype.itemsize)
+            np.ascontiguousarray(columns.T).tofile(file)
+            file.flush()
+            file.seek(0)
+            file.write(header.getvalue())
+
+    def exists(self, file_name):
+        return os.path.exists(self.get_file_path(file_name)) or os.path.exists(self.get_file_path(file_name, True))
+
+    def load(self, file_name, return_matrix=False):
+        if not return_matrix:
+            with open(self.get_file_path(file_name), 'r') as file:
+                obj = json.load(file)
+            delta = self.load_delta(file_name)
+            return obj + delta if delta else obj
+
+        matrix = np.load(self.get_file_path(file_name, True), mmap_mode=self.mmap_mode)
+        delta_path = self.get_delta_path(file_name, True)
+        if os.path.exists(delta_path):
+            delta = np.fromfile(delta_path, dtype=matrix.dtype)
+            rows = matrix.shape[0]
+            delta = delta[:len(delta) // rows * rows]  # the last column may be unfinished by concurrent append
+            return np.hstack([matrix, delta.reshape(-1, rows).T])
+        return np.asarray(matrix)
+
+    def load_columns(self, file_name, start, end):
+        """ Part of memory-mapped matrix file is not read till it is used, appended columns are read
+            from their offset in delta file. Part is copied into memory if mmap_mode is None
+        """
+
+        matrix = np.load(self.get_file_path(file_name, True), mmap_mode='r')
+        rows, columns_number = matrix.shape
+        part = matrix[:, start:end]
+        if self.mmap_mode is None:
+            part = np.array(part)
+        delta_path = self.get_delta_path(file_name, True)
+        if end > columns_number and os.path.exists(delta_path):
+            delta_start = max(start - columns_number, 0)
+            delta = np.fromfile(delta_path, dtype=matrix.dtype, count=(end - columns_number - delta_start) * rows,
+                                offset=delta_start * rows * matrix.dtype.itemsize)
+            delta = delta[:len(delta) // rows * rows]
+            part = np.hstack([part, delta.reshape(-1, rows).T])
+        return part
@@ -1,9 +1,33 @@
 class BaseIndexBackend():
-    def dump(self, obj, file_name):
+    def dump(self, obj, file_name, appendable=False):
+        """ appendable - columns of the matrix will be appended (see append), backend may keep it in a layout
+            which lets to append them in place
+        """
         raise NotImplemented
 
     def load(self, file_name, return_matrix=False):
         raise NotImplemented
 
+    def append(self, obj, file_name):
+        """ Add columns (matrix) or items (list) to the end of object kept in file_name without rewriting it.
+            load returns object with appended parts, dump replaces all of them
+        """
+        raise NotImplemented
+
+    def load_columns(self, file_name, start, end):
+        """ Columns start..end of matrix (with appended ones) without reading other columns.
+            Backends which can not do it do not support sharded search, see search.shards
+        """
+        raise NotImplementedError
+
+    def exists(self, file_name):
+        raise NotImplemented
+
     def delete_index(self):
         raise NotImplemented
+
+    def get_index_version(self):
+        """ Any value which changes when index is changed on disk. SearchMachine compares it to find out
+            if loaded space is outdated. None means backend can't tell it
+        """
+        return None
@@ -2,7 +2,10 @@ import unittest
 import string
 import random
 import exceptions
-from lsa_tests.base import EmptyLsaFixtureMixin, LsaFixtureMixin, HelpTestMethodsMixin
+import core
+import parallel
+import tokenizer
+from lsa_tests.base import EmptyLsaFixtureMixin, LsaFixtureMixin, HelpTestMethodsMixin, TEST_DOCS
 
 
 class CoreExcludeTrashMethodTests(EmptyLsaFixtureMixin, HelpTestMethodsMixin, unittest.TestCase):
@@ -101,6 +104,28 @@ class CheckDocKey(EmptyLsaFixtureMixin, HelpTestMethodsMixin, unittest.TestCase)
         self.check_return_eq(self.test_key2, obj=self.lsa, method=self.method_name, compare_with=self.test_key2)
 
 
+class TokenizerTests(unittest.TestCase):
+    def test_tokenize(self):
+        words = tokenizer.Tokenizer().tokenize('Полиция Великобритании нашла основателя WikiLeaks,\nно, не арестовала')
+        self.assertEqual(words, ['полиция', 'великобритании', 'нашла', 'основателя', 'wikileaks', 'арестовала'])
+
+    def test_custom_settings(self):
+        custom_tokenizer = tokenizer.Tokenizer(stop_words=['the', 'of'], chars_to_exclude='.,')
+        self.assertEqual(custom_tokenizer.tokenize('The Lord of the Rings. Part 1,2'),
+                         ['lord', 'rings', 'part', '1', '2'])
+
+
+class PrepareInPool(unittest.TestCase):
+    def test_order_and_result(self):
+        space_kwargs = {'latent_dimensions': 3, 'relevance_radius_threshold': 0.1, 'use_stemming': True,
+                        'use_tf_idf': True, 'decimals': 2}
+        space = core.Space(**space_kwargs)
+        documents = [(doc, 'doc_%d' % i) for i, doc in enumerate(TEST_DOCS * 3)]
+        prepared = list(parallel.prepare_in_pool(iter(documents), space_kwargs, workers=2, chunk_size=2))
+        true_prepared = [(space.prepare_document(doc), desired_id) for doc, desired_id in documents]
+        self.assertEqual(prepared, true_prepared)
+
+
 if __name__ == '__main__':
     suite = unittest.TestLoader()
     suite.loadTestsFromTestCase(CoreExcludeTrashMethodTests)
@@ -108,4 +133,6 @@ if __name__ == '__main__':
     suite.loadTestsFromTestCase(CoreStemDocumentMethodTests)
     suite.loadTestsFromTestCase(CoreManageRepeatingWords)
     suite.loadTestsFromTestCase(CheckDocKey)
+    suite.loadTestsFromTestCase(TokenizerTests)
+    suite.loadTestsFromTestCase(PrepareInPool)
     unittest.TextTestRunner(verbosity=3).run(suite)
\ No newline at end of file
@@ -0,0 +1,75 @@
+""" Ranking quality and memory of storage dtypes compared with float64.
+
+    python -m lsa.lsa_tests.benchmark_storage --documents 20000 --dimensions 100
+
+Collection is synthetic: documents are mixtures of topics, every topic prefers its own part of vocabulary.
+The space is built once in float64, then it is loaded with every storage dtype and the same queries
+(other documents of the same topics) are searched. recall@limit - part of float64 results found
+with the dtype, distance error - mean absolute difference of distances to the same documents.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from lsa.indexer import core, svd
+
+
+def make_documents(documents_number, words_number, topics_number, random):
+    vocabulary = ['w%d' % i for i in range(words_number)]
+    topics = random.dirichlet(np.full(words_number, 0.05), size=topics_number)
+    for i in range(documents_number):
+        topic = random.choice(topics_number, p=random.dirichlet(np.full(topics_number, 0.1)))
+        yield [vocabulary[j] for j in random.choice(words_number, size=random.randint(20, 80), p=topics[topic])]
+
+
+def make_space(storage_dtype, dimensions):
+    return core.Space(latent_dimensions=dimensions, relevance_radius_threshold=1., use_stemming=False,
+                      use_tf_idf=True, decimals=6, svd_engine=svd.RandomizedSvdEngine(random_state=0),
+                      storage_dtype=storage_dtype)
+
+
+def search(space, queries, limit):
+    started = time.time()
+    distances = space.calculate_distances(space.make_semantic_space_coords_for_new_docs(queries))
+    results = [dict(space.rank_distances(row, limit, with_distances=True)) for row in distances]
+    return results, (time.time() - started) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--words', type=int, default=5000)
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--dimensions', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    random = np.random.RandomState(0)
+    base = make_space(None, args.dimensions)
+    for i, document in enumerate(make_documents(args.documents, args.words, args.topics, random)):
+        base.add_prepared_document(document, i)
+    base.build_semantic_space()
+    queries = list(make_documents(args.queries, args.words, args.topics, random))
+    true_results, true_time = search(base, queries, args.limit)
+
+    print('%-8s %12s %10s %15s %14s' % ('dtype', 'D, MB', 'recall', 'distance error', 'ms per query'))
+    for storage_dtype in ('float64', 'float32', 'float16', 'int8'):
+        space = make_space(storage_dtype, args.dimensions)
+        space.load_from_dump(base.T, base.S, base.D, list(base.words), list(base.keys), base.P)
+        results, query_time = search(space, queries, args.limit)
+
+        found = errors = 0
+        for true_result, result in zip(true_results, results):
+            common = set(true_result) & set(result)
+            found += len(common)
+            errors += sum(abs(true_result[key] - result[key]) for key in common)
+        total = sum(len(result) for result in true_results)
+        print('%-8s %12.1f %10.4f %15.2e %14.3f' % (storage_dtype, space.D.nbytes / 2. ** 20, float(found) / total,
+                                                   errors / max(found, 1), query_time * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,29 @@
+import shutil
 import string
+import tempfile
 import unittest
 import random
-import exceptions
-from lsa_tests.base import LsaFixtureMixin
+from lsa_tests.base import LsaFixtureMixin, TEST_DOCS
 import numpy as np
 import helpers
+import svd
+import weighting
+from scipy import sparse
+from lsa.indexer import core, outofcore
+from lsa.utils import exceptions
+
+
+class SpaceFixtureMixin():
+    """ Fixture creates Space instance and fill it with docs """
+
+    def setUp(self):
+        self.space = core.Space(latent_dimensions=3, relevance_radius_threshold=0.9, use_stemming=True,
+                                use_tf_idf=True, decimals=3)
+        for i, doc in enumerate(TEST_DOCS):
+            self.space.add_document(doc, desired_id=i)
+
+    def tearDown(self):
+        del self.space
 
 
 class CoreManageUniqueWordsMethodTests(LsaFixtureMixin, unittest.TestCase):
@@ -37,6 +56,32 @@ class CoreManageUniqueWordsMethodTests(LsaFixtureMixin, unittest.TestCase):
         self.assertEqual(type(self.lsa.words), list)
 
 
+class VocabularyFiltersTests(SpaceFixtureMixin, unittest.TestCase):
+    def set_filter_fixture(self, **vocabulary_options):
+        self.space.keys = [1, 2, 3, 4]
+        self.space.docs = {1: ['a', 'b', 'c', 'c'], 2: ['a', 'b', 'd'], 3: ['a', 'e', 'b'], 4: ['a', 'e', 'f']}
+        self.space.words = ['a', 'b', 'c', 'd', 'e', 'f']
+        self.space.vocabulary_options = vocabulary_options
+
+    def test_frequency_filters(self):
+        self.set_filter_fixture()
+        self.space.manage_unique_words()
+        self.assertEqual(self.space.words, ['a', 'b', 'c', 'e'])
+
+        self.set_filter_fixture(min_doc_frequency=2, max_doc_frequency=0.8)
+        self.space.manage_unique_words()
+        self.assertEqual(self.space.words, ['b', 'e'])
+
+        self.set_filter_fixture(min_total_frequency=1, max_doc_frequency=3)
+        self.space.manage_unique_words()
+        self.assertEqual(self.space.words, ['b', 'c', 'd', 'e', 'f'])
+
+    def test_max_vocabulary_size(self):
+        self.set_filter_fixture(max_vocabulary_size=2)
+        self.space.manage_unique_words()
+        self.assertEqual(self.space.words, ['a', 'b'])
+
+
 class CoreBuildBaseMatrixMethodTest(LsaFixtureMixin, unittest.TestCase):
     def setUp(self):
         self.true_matrix = np.matrix([[0, 1, 0, 0, 0, 0, 1, 0, 0],
@@ -52,7 +97,7 @@ class CoreBuildBaseMatrixMethodTest(LsaFixtureMixin, unittest.TestCase):
                                       [1, 0, 0, 0, 0, 0, 0, 1, 0],
                                       [0, 0, 0, 1, 0, 0, 0, 1, 0],
                                       [0, 1, 0, 0, 0, 0, 1, 0, 0]])
-        self.true_matrix_empty = np.matrix([[]])
+        self.true_matrix_empty_shape = (0, 0)
         super(CoreBuildBaseMatrixMethodTest, self).setUp()
 
     def test_result_type(self):
@@ -62,7 +107,8 @@ class CoreBuildBaseMatrixMethodTest(LsaFixtureMixin, unittest.TestCase):
         self.lsa.words = ['прот', 'основател', 'прем', 'суд', 'стран', 'wikileaks', 'нобелевск', 'вручен', 'церемон',
                           'арестова', 'полиц', 'великобритан', 'сша']
         self.lsa.build_base_matrix()
-        self.assertEqual(self.lsa.X.tolist(), self.true_matrix.tolist())
+        self.assertTrue(sparse.issparse(self.lsa.X))
+        self.assertEqual(self.lsa.X.toarray().tolist(), self.true_matrix.tolist())
 
     def test_with_empty_data(self):
         self.lsa.docs = {}
@@ -70,8 +116,21 @@ class CoreBuildBaseMatrixMethodTest(LsaFixtureMixin, unittest.TestCase):
         self.lsa.keys = []
 
         self.lsa.build_base_matrix()
-        # assertEqual fail trying to compare numpy.matrices
-        self.assertEqual(self.lsa.X.tolist(), self.true_matrix_empty.tolist())
+        self.assertEqual(self.lsa.X.shape, self.true_matrix_empty_shape)
+
+
+class CoreWeightingTransformMethodTest(SpaceFixtureMixin, unittest.TestCase):
+    def test_matrix(self):
+        self.space.X = sparse.csc_matrix([[1, 0, 2],
+                                          [1, 1, 1],
+                                          [0, 3, 0]])
+        self.space.decimals = 3
+        self.space.weighting_transform()
+
+        idf = np.log(3. / np.array([2, 3, 1]))
+        true_matrix = (np.array([[1, 0, 2], [1, 1, 1], [0, 3, 0]]) / np.array([2., 4., 3.])) * idf[:, np.newaxis]
+        self.assertTrue(sparse.issparse(self.space.X))
+        self.assertEqual(self.space.X.toarray().tolist(), true_matrix.round(decimals=3).tolist())
 
 
 class CoreSvdMethodTests(LsaFixtureMixin, unittest.TestCase):
@@ -102,14 +161,144 @@ class CoreSvdMethodTests(LsaFixtureMixin, unittest.TestCase):
             self.lsa.svd()
 
 
+class WeightingSchemesTests(unittest.TestCase):
+    def setUp(self):
+        self.counts = np.array([[1., 0, 2, 0], [1, 1, 1, 1], [0, 3, 0, 0], [4, 0, 1, 0]])
+        self.X = sparse.csc_matrix(self.counts)
+
+    def check_scheme(self, scheme, true_matrix):
+        res = scheme.fit_transform(self.X)
+        self.assertTrue(sparse.issparse(res))
+        np.testing.assert_almost_equal(res.toarray(), true_matrix)
+        np.testing.assert_almost_equal(self.X.toarray(), self.counts)  # source matrix is not changed
+
+    def test_tf_idf(self):
+        idf = np.log(4. / (self.counts > 0).sum(axis=1))
+        self.check_scheme(weighting.TfIdfWeighting(), self.counts / self.counts.sum(axis=0) * idf[:, np.newaxis])
+
+    def test_log_entropy(self):
+        p = self.counts / self.counts.sum(axis=1)[:, np.newaxis]
+        plogp = np.where(p > 0, p * np.log(np.where(p > 0, p, 1)), 0)
+        entropy = 1 + plogp.sum(axis=1) / np.log(4)
+        self.check_scheme(weighting.LogEntropyWeighting(), np.log1p(self.counts) * entropy[:, np.newaxis])
+
+    def test_bm25(self):
+        k1, b = 1.5, 0.5
+        df = (self.counts > 0).sum(axis=1)
+        idf = np.log(1 + (4 - df + 0.5) / (df + 0.5))
+        lengths = self.counts.sum(axis=0)
+        norm = k1 * (1 - b + b * lengths / lengths.mean())
+        true_matrix = self.counts * (k1 + 1) / (self.counts + norm) * idf[:, np.newaxis]
+        self.check_scheme(weighting.Bm25Weighting(k1=k1, b=b), true_matrix)
+
+    def test_fit_by_chunks(self):
+        for scheme_class in (weighting.TfIdfWeighting, weighting.LogEntropyWeighting, weighting.Bm25Weighting):
+            scheme = scheme_class().fit_chunks(lambda: [self.X[:, :1], self.X[:, 1:3], self.X[:, 3:]])
+            true_scheme = scheme_class().fit(self.X)
+            np.testing.assert_almost_equal(scheme.transform(self.X).toarray(), true_scheme.transform(self.X).toarray())
+
+
+class SvdEnginesTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.X = sparse.random(40, 30, density=0.2, random_state=random, format='csc')
+        self.k = 5
+        self.true_s = np.linalg.svd(self.X.toarray(), compute_uv=False)[:self.k]
+
+    def check_engine(self, engine, decimal=7):
+        T, S, D = engine.decompose(self.X, self.k)
+        self.assertEqual(T.shape, (self.X.shape[0], self.k))
+        self.assertEqual(S.shape, (self.k,))
+        self.assertEqual(D.shape, (self.k, self.X.shape[1]))
+        np.testing.assert_almost_equal(S, self.true_s, decimal=decimal)
+
+    def test_full(self):
+        self.check_engine(svd.FullSvdEngine())
+
+    def test_truncated(self):
+        self.check_engine(svd.TruncatedSvdEngine())
+
+    def test_truncated_small_matrix(self):
+        self.k = min(self.X.shape)
+        self.true_s = np.linalg.svd(self.X.toarray(), compute_uv=False)
+        self.check_engine(svd.TruncatedSvdEngine())
+
+    def test_randomized(self):
+        self.check_engine(svd.RandomizedSvdEngine(oversampling=20, power_iterations=4, random_state=1), decimal=3)
+
+    def test_randomized_by_chunks(self):
+        folder = tempfile.mkdtemp()
+        X = outofcore.SpilledMatrix(folder)
+        for start in range(0, self.X.shape[1], 7):
+            X.append(self.X[:, start:start + 7])
+        T, S = svd.RandomizedSvdEngine(oversampling=20, power_iterations=4, random_state=1).decompose_chunks(X, self.k)
+        shutil.rmtree(folder)
+
+        self.assertEqual(T.shape, (self.X.shape[0], self.k))
+        np.testing.assert_almost_equal(S, self.true_s, decimal=3)
+        np.testing.assert_almost_equal(T.T.dot(T), np.eye(self.k))
+
+    def test_not_chunked_engine(self):
+        with self.assertRaises(NotImplementedError):
+            svd.TruncatedSvdEngine().decompose_chunks(self.X, self.k)
+
+
+class OutOfCoreBuildTests(unittest.TestCase):
+    def setUp(self):
+        self.spill_folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_folder, ignore_errors=True)
+
+    def make_space(self):
+        return core.Space(latent_dimensions=3, relevance_radius_threshold=0.9, use_stemming=True, use_tf_idf=True,
+                          decimals=6, svd_engine=svd.RandomizedSvdEngine(power_iterations=4, random_state=0))
+
+    def test_same_as_in_memory(self):
+        true_space = self.make_space()
+        for i, doc in enumerate(TEST_DOCS):
+            true_space.add_document(doc, desired_id=i)
+        true_space.build_semantic_space()
+
+        space = self.make_space()
+        documents = ((space.prepare_document(doc), i) for i, doc in enumerate(TEST_DOCS))
+        # a few words per chunk, so there are many chunks
+        space.build_semantic_space_out_of_core(documents, self.spill_folder,
+                                               memory_budget=10 * space.OUT_OF_CORE_BYTES_PER_ELEMENT)
+        self.assertEqual(space.words, true_space.words)
+        self.assertEqual(space.keys, true_space.keys)
+        self.assertEqual(space.docs, {})
+        np.testing.assert_almost_equal(space.S, true_space.S)
+        self.assertEqual(space.search('основатель wikileaks'), true_space.search('основатель wikileaks'))
+
+    def test_empty(self):
+        with self.assertRaises(exceptions.SvdEmptyTarget):
+            self.make_space().build_semantic_space_out_of_core(iter([]), self.spill_folder)
+
+    def test_not_chunked_engine(self):
+        space = core.Space(latent_dimensions=3, relevance_radius_threshold=0.9, use_stemming=True, use_tf_idf=True,
+                           decimals=6)
+        documents = ((space.prepare_document(doc), i) for i, doc in enumerate(TEST_DOCS))
+        with self.assertRaises(exceptions.OutOfCoreImproperlyConfigured):
+            space.build_semantic_space_out_of_core(documents, self.spill_folder)
+        self.assertEqual(len(list(documents)), len(TEST_DOCS))  # nothing is read
+
+    def test_spilled_matrix(self):
+        X = outofcore.SpilledMatrix(self.spill_folder)
+        X.append(sparse.csc_matrix([[1, 0], [0, 2]]))
+        X.append(sparse.csc_matrix([[3], [0], [4]]))  # vocabulary grows
+        self.assertEqual(X.shape, (3, 3))
+        self.assertEqual(sparse.hstack(list(X.iterate_chunks())).toarray().tolist(), [[1, 0, 3], [0, 2, 0], [0, 0, 4]])
+
+
 class MatrixFixtures():
     def setUp(self):
-        self.matrix = np.matrix([[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        self.matrix = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]])
         self.normal_limit = 2
         self.bigget_limit = 7
         self.wrong_limit = -2
         self.zero_limit = 0
-        self.empty_matrix = np.matrix([[]])
+        self.empty_matrix = np.array([[]])
 
     def tearDown(self):
         del self.matrix
@@ -137,6 +326,9 @@ class TruncateCommon(MatrixFixtures):
         res = self.truncate(self.normal_limit, empty=True)
         self.assertEqual(res.shape, self.empty_matrix.shape)
 
+    def test_not_copied(self):
+        self.assertTrue(np.shares_memory(self.truncate(self.normal_limit), self.matrix))
+
 
 class TruncateColumnsTests(TruncateCommon, unittest.TestCase):
     def truncate(self, limit, empty=False):
@@ -162,11 +354,53 @@ class TruncateRowsTests(TruncateCommon, unittest.TestCase):
         self.assertEqual(res.shape, true_shape)
 
 
+class QuantizeColumnsTests(unittest.TestCase):
+    def test_quantize(self):
+        matrix = np.array([[0.5, 0., -2.], [-1., 0., 1.]])
+        quantized, scales = helpers.quantize_columns(matrix)
+        self.assertEqual(quantized.dtype, np.int8)
+        self.assertEqual(quantized.tolist(), [[64, 0, -127], [-127, 0, 64]])
+        np.testing.assert_almost_equal(scales, [1. / 127, 1, 2. / 127])
+        np.testing.assert_almost_equal(quantized * scales, matrix, decimal=2)
+
+
+class ColumnBufferTests(unittest.TestCase):
+    def test_append(self):
+        matrix = np.array([[1., 2.], [3., 4.]])
+        buffer = helpers.ColumnBuffer(matrix)
+        self.assertIs(buffer.view, matrix)
+        buffer.append(np.array([[5.], [6.]]))
+        self.assertEqual(buffer.capacity, 4)
+        view = buffer.append(np.array([[7.], [8.]]))
+        self.assertEqual(buffer.capacity, 4)  # no reallocation
+        self.assertTrue(np.shares_memory(view, buffer.data))
+        self.assertEqual(view.tolist(), [[1., 2., 5., 7.], [3., 4., 6., 8.]])
+        self.assertEqual(matrix.tolist(), [[1., 2.], [3., 4.]])  # source is not changed
+
+        buffer.append(np.ones((2, 5)))
+        self.assertEqual(buffer.capacity, 9)
+        self.assertEqual(buffer.view.shape, (2, 9))
+
+    def test_flat(self):
+        buffer = helpers.ColumnBuffer(np.zeros(0, dtype=np.float32))
+        for i in range(5):
+            buffer.append([i])
+        self.assertEqual(buffer.view.tolist(), [0., 1., 2., 3., 4.])
+        self.assertEqual(buffer.view.dtype, np.float32)
+
+
 if __name__ == '__main__':
     suite = unittest.TestLoader()
     suite.loadTestsFromTestCase(CoreManageUniqueWordsMethodTests)
+    suite.loadTestsFromTestCase(VocabularyFiltersTests)
     suite.loadTestsFromTestCase(CoreBuildBaseMatrixMethodTest)
+    suite.loadTestsFromTestCase(CoreWeightingTransformMethodTest)
     suite.loadTestsFromTestCase(CoreSvdMethodTests)
+    suite.loadTestsFromTestCase(WeightingSchemesTests)
+    suite.loadTestsFromTestCase(SvdEnginesTests)
+    suite.loadTestsFromTestCase(OutOfCoreBuildTests)
     suite.loadTestsFromTestCase(TruncateColumnsTests)
     suite.loadTestsFromTestCase(TruncateRowsTests)
+    suite.loadTestsFromTestCase(QuantizeColumnsTests)
+    suite.loadTestsFromTestCase(ColumnBufferTests)
     unittest.TextTestRunner(verbosity=3).run(suite)
\ No newline at end of file
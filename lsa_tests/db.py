@@ -0,0 +1,48 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import types
+import unittest
+
+from lsa.db.sqlite import SQLiteBackend
+from lsa_tests.base import TEST_DOCS
+
+
+class SQLiteBackendTests(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.db_file_name = os.path.join(self.folder, 'test.db')
+        connection = sqlite3.connect(self.db_file_name)
+        connection.execute('CREATE TABLE news (id INTEGER PRIMARY KEY, title TEXT, text TEXT)')
+        connection.executemany('INSERT INTO news VALUES (?, ?, ?)',
+                               [(i, doc, '') for i, doc in enumerate(TEST_DOCS, 1)])
+        connection.commit()
+        connection.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_select_streams_rows(self):
+        backend = SQLiteBackend(db_file_name=self.db_file_name, fetch_batch_size=2)
+        rows = backend.select('news', ('title', 'text'), 'id', 'id > 1')
+        self.assertIsInstance(rows, types.GeneratorType)
+        self.assertEqual([row[0] for row in rows], list(range(2, len(TEST_DOCS) + 1)))
+
+    def test_fetch_rows_by_batches(self):
+        backend = SQLiteBackend(db_file_name=self.db_file_name, fetch_batch_size=3)
+        batches = []
+
+        class Cursor():
+            def fetchmany(self, size):
+                batches.append(size)
+                return [(1,), (2,)] if len(batches) == 1 else []
+
+        self.assertEqual(list(backend.fetch_rows(Cursor())), [(1,), (2,)])
+        self.assertEqual(batches, [3, 3])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader()
+    suite.loadTestsFromTestCase(SQLiteBackendTests)
+    unittest.TextTestRunner(verbosity=3).run(suite)
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from lsa.keeper import backends
+
+
+class IndexBackendTestsMixin():
+    backend_class = None
+
+    def setUp(self):
+        self.index_folder = tempfile.mkdtemp()
+        self.backend = self.backend_class(path_to_index_folder=self.index_folder)
+        self.matrix = np.matrix([[1.5, 2., 3.], [4., 5., 6.25]])
+        self.words = ['основател', 'wikileaks']
+        self.keys = [1, 'news_2']
+
+    def tearDown(self):
+        shutil.rmtree(self.index_folder, ignore_errors=True)
+
+    def test_matrix(self):
+        self.backend.dump(self.matrix, 'd.json')
+        loaded = self.backend.load('d.json', return_matrix=True)
+        self.assertIsInstance(loaded, np.ndarray)
+        self.assertNotIsInstance(loaded, np.matrix)
+        self.assertEqual(loaded.tolist(), self.matrix.tolist())
+
+    def test_lists(self):
+        self.backend.dump(self.words, 'words.json')
+        self.backend.dump(self.keys, 'keys.json')
+        self.assertEqual(self.backend.load('words.json'), self.words)
+        self.assertEqual(self.backend.load('keys.json'), self.keys)
+
+    def test_append(self):
+        self.backend.dump(self.matrix, 'd.json')
+        self.backend.dump(self.keys, 'keys.json')
+        self.backend.append(np.matrix([[7.], [8.]]), 'd.json')
+        self.backend.append(np.matrix([[9., 10.], [11., 12.]]), 'd.json')
+        self.backend.append(['news_3'], 'keys.json')
+        self.assertEqual(self.backend.load('d.json', return_matrix=True).tolist(),
+                         [[1.5, 2., 3., 7., 9., 10.], [4., 5., 6.25, 8., 11., 12.]])
+        self.assertEqual(self.backend.load('keys.json'), self.keys + ['news_3'])
+
+        # dump replaces appended parts
+        self.backend.dump(self.matrix, 'd.json')
+        self.backend.dump(self.keys, 'keys.json')
+        self.assertEqual(self.backend.load('d.json', return_matrix=True).tolist(), self.matrix.tolist())
+        self.assertEqual(self.backend.load('keys.json'), self.keys)
+
+    def test_append_changes_index_version(self):
+        self.backend.dump(self.keys, 'keys.json')
+        version = self.backend.get_index_version()
+        self.backend.append([3], 'keys.json')
+        self.assertNotEqual(self.backend.get_index_version(), version)
+
+    def test_float32_matrix(self):
+        self.backend.dump(np.matrix([[0.1, 2.5]], dtype=np.float32), 'd.json')
+        np.testing.assert_almost_equal(self.backend.load('d.json', return_matrix=True), [[0.1, 2.5]])
+
+    def test_index_version(self):
+        self.backend.dump(self.keys, 'keys.json')
+        version = self.backend.get_index_version()
+        self.assertEqual(self.backend.get_index_version(), version)
+        self.backend.dump(self.keys + [3], 'keys.json')
+        self.assertNotEqual(self.backend.get_index_version(), version)
+        self.backend.delete_index()
+        self.assertIsNone(self.backend.get_index_version())
+
+
+class JsonIndexBackendTests(IndexBackendTestsMixin, unittest.TestCase):
+    backend_class = backends.JsonIndexBackend
+
+    def test_float32_is_written_short(self):
+        self.backend.dump(np.matrix([[0.1, 2.5]], dtype=np.float32), 'd.json')
+        with open(os.path.join(self.index_folder, 'd.json')) as file:
+            self.assertEqual(file.read(), '[[0.1, 2.5]]')
+
+
+class NpyIndexBackendTests(IndexBackendTestsMixin, unittest.TestCase):
+    backend_class = backends.NpyIndexBackend
+
+    def test_memory_mapped(self):
+        self.backend.dump(self.matrix, 'd.json')
+        loaded = self.backend.load('d.json', return_matrix=True)
+        self.assertIsInstance(loaded.base, np.memmap)
+
+        self.backend.dump(self.matrix.astype(np.float16), 'p.json')
+        self.assertEqual(self.backend.load('p.json', return_matrix=True).dtype, np.float16)
+
+        # mapped file is replaced, not overwritten
+        self.backend.dump(self.matrix * 2, 'd.json')
+        self.assertEqual(loaded.tolist(), self.matrix.tolist())
+
+    def test_append_in_place(self):
+        self.backend.dump(self.matrix, 'd.json', appendable=True)
+        self.backend.append(np.matrix([[7.], [8.]]), 'd.json')
+        self.backend.append(np.matrix([[9., 10.], [11., 12.]]), 'd.json')
+        self.assertFalse(os.path.exists(os.path.join(self.index_folder, 'd.npy.delta')))
+        loaded = self.backend.load('d.json', return_matrix=True)
+        self.assertIsInstance(loaded.base, np.memmap)  # appended columns are not merged in memory
+        self.assertEqual(loaded.tolist(), [[1.5, 2., 3., 7., 9., 10.], [4., 5., 6.25, 8., 11., 12.]])
+
+        # matrix of older index is row-major, its columns are appended to delta file
+        self.backend.dump(self.matrix, 'd.json')
+        self.backend.append(np.matrix([[7.], [8.]]), 'd.json')
+        self.assertTrue(os.path.exists(os.path.join(self.index_folder, 'd.npy.delta')))
+        self.assertEqual(self.backend.load('d.json', return_matrix=True).tolist(),
+                         [[1.5, 2., 3., 7.], [4., 5., 6.25, 8.]])
+
+    def test_load_columns(self):
+        self.backend.dump(self.matrix, 'd.json')
+        self.backend.append(np.array([[7., 9., 10.], [8., 11., 12.]]), 'd.json')
+        full = self.backend.load('d.json', return_matrix=True)
+        for start, end in ((0, 2), (1, 4), (3, 5), (4, 6), (0, 6)):
+            self.assertEqual(self.backend.load_columns('d.json', start, end).tolist(), full[:, start:end].tolist())
+        self.assertIsInstance(self.backend.load_columns('d.json', 0, 2).base, np.memmap)
+
+        self.backend.dump(self.matrix, 'd.json', appendable=True)
+        self.backend.append(np.array([[7., 9., 10.], [8., 11., 12.]]), 'd.json')
+        for start, end in ((0, 2), (1, 4), (3, 5), (4, 6), (0, 6)):
+            self.assertEqual(self.backend.load_columns('d.json', start, end).tolist(), full[:, start:end].tolist())
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader()
+    suite.loadTestsFromTestCase(JsonIndexBackendTests)
+    suite.loadTestsFromTestCase(NpyIndexBackendTests)
+    unittest.TextTestRunner(verbosity=3).run(suite)
@@ -0,0 +1,538 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+from lsa.search import shards
+from lsa.search.machine import SearchMachine
+from lsa.utils import exceptions
+from lsa_tests.base import TEST_DOCS
+
+
+class SearchMachineFixtureMixin():
+    """ Fixture builds index of test documents in temporary folder without database """
+
+    machine_kwargs = {}
+
+    def make_machine(self, **kwargs):
+        params = {'latent_dimensions': 3, 'index_backend': 'lsa.keeper.backends.JsonIndexBackend',
+                  'keep_index_info': {'path_to_index_folder': self.index_folder}}
+        params.update(self.machine_kwargs)
+        params.update(kwargs)
+        return SearchMachine(**params)
+
+    def make_built_machine(self, **kwargs):
+        """ Machine with index of test documents built with its settings """
+
+        machine = self.make_machine(**kwargs)
+        machine.init_space()
+        for i, doc in enumerate(TEST_DOCS):
+            machine.feed_with_document(doc, i)
+        machine.build_semantic_space()
+        machine.dump_semantic_space()
+        machine.deinit_space()
+        return machine
+
+    def setUp(self):
+        self.index_folder = tempfile.mkdtemp()
+        self.machine = self.make_built_machine()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_folder, ignore_errors=True)
+
+
+class ResidentModeTests(SearchMachineFixtureMixin, unittest.TestCase):
+    def count_loads(self, machine):
+        self.loads = 0
+        load = machine.load_space_from_dump
+
+        def counting_load():
+            self.loads += 1
+            load()
+
+        machine.load_space_from_dump = counting_load
+
+    def test_not_resident(self):
+        self.count_loads(self.machine)
+        self.machine.search('основатель wikileaks')
+        self.machine.search('основатель wikileaks')
+        self.assertEqual(self.loads, 2)
+        self.assertIsNone(self.machine.space)
+
+    def test_resident(self):
+        with self.machine as machine:
+            self.count_loads(machine)
+            results = machine.search('основатель wikileaks')
+            self.assertEqual(machine.search('основатель wikileaks'), results)
+            self.assertEqual(self.loads, 0)
+            self.assertIsNotNone(machine.space)
+        self.assertIsNone(self.machine.space)
+
+    def test_reload_changed_index(self):
+        self.machine.open()
+        self.count_loads(self.machine)
+
+        other_machine = self.make_machine()
+        other_machine.update_index_with_doc('Основатель Wikileaks арестован', 'new')
+        self.machine.search('основатель wikileaks')
+        self.assertIn('new', self.machine.space.keys)
+        self.assertEqual(self.loads, 1)
+
+        # own changes do not require reloading
+        self.machine.remove_document('new')
+        self.machine.search('основатель wikileaks')
+        self.assertNotIn('new', self.machine.space.get_key_index())
+        self.assertEqual(self.loads, 1)
+        self.machine.close()
+
+
+class AddDocumentsTests(SearchMachineFixtureMixin, unittest.TestCase):
+    def test_vocabulary_is_unique(self):
+        self.machine.init_space()
+        keys = self.machine.space.add_documents((doc, i) for i, doc in enumerate(TEST_DOCS))
+        self.assertEqual(keys, list(range(len(TEST_DOCS))))
+        words = self.machine.space.words
+        self.assertEqual(len(words), len(set(words)))
+        self.assertEqual(set(words), set(w for doc in self.machine.space.docs.values() for w in doc))
+        with self.assertRaises(exceptions.UniqueKeyException):
+            self.machine.space.add_document(TEST_DOCS[0], 3)
+
+    def test_fold_in_many(self):
+        keys = self.machine.add_documents([('Основатель Wikileaks арестован', 'new_1'),
+                                           ('Нобелевская премия мира', 'new_2')])
+        self.assertEqual(keys, ['new_1', 'new_2'])
+        self.machine.load_space_from_dump()
+        self.assertEqual(self.machine.space.keys[-2:], keys)
+        self.assertEqual(self.machine.space.D.shape[1], len(TEST_DOCS) + 2)
+
+    def test_fold_in_rollback(self):
+        with self.assertRaises(exceptions.UniqueKeyException):
+            self.machine.add_documents([('Основатель Wikileaks арестован', 'new_1'), ('Нобелевская премия', 1)])
+        self.machine.load_space_from_dump()
+        self.assertEqual(len(self.machine.space.keys), len(TEST_DOCS))
+
+
+class NeighboursTests(SearchMachineFixtureMixin, unittest.TestCase):
+    def test_table_is_kept(self):
+        results = self.machine.similar_to(0, limit=3)
+        self.machine.build_neighbours(limit=5)
+        self.machine.load_space_from_dump()
+        self.assertEqual(self.machine.space.neighbours_limit, 5)
+        self.assertEqual(self.machine.space.similar_to(0, limit=3), results)
+
+    def test_removed_document_is_skipped(self):
+        self.machine.build_neighbours(limit=5)
+        removed = self.machine.similar_to(0, limit=5)[0]
+        self.machine.remove_document(removed)
+        self.assertNotIn(removed, self.machine.similar_to(0, limit=5))
+
+
+class ProjectionTests(SearchMachineFixtureMixin, unittest.TestCase):
+    def test_projection_is_kept(self):
+        self.machine.load_space_from_dump()
+        space = self.machine.space
+        np.testing.assert_almost_equal(space.P, space.T.dot(np.linalg.inv(space.S)))
+
+    def test_index_without_projection(self):
+        results = self.machine.search('основатель wikileaks')
+        os.remove(os.path.join(self.index_folder, SearchMachine.P_INDEX_NAME))
+        self.assertEqual(self.machine.search('основатель wikileaks'), results)
+
+
+class IncrementalUpdateTests(SearchMachineFixtureMixin, unittest.TestCase):
+    def test_update_is_kept(self):
+        keys = self.machine.update_index_incrementally([('Квазар обнаружен, квазар далеко', 'new')])
+        self.assertEqual(keys, ['new'])
+        self.machine.load_space_from_dump()
+        self.assertIn('new', self.machine.space.keys)
+        self.assertEqual(self.machine.get_drift()['added_documents'], 1)
+
+    def test_weighting_is_kept(self):
+        self.machine.load_space_from_dump()
+        self.assertTrue(self.machine.space.weighting.is_fitted())
+
+    def test_index_without_meta(self):
+        os.remove(os.path.join(self.index_folder, SearchMachine.META_INDEX_NAME))
+        with self.assertRaises(exceptions.IndexRebuildRequired):
+            self.machine.update_index_incrementally([('Квазар', 'new')])
+
+
+class UpdateSessionTests(SearchMachineFixtureMixin, unittest.TestCase):
+    def count_writes(self):
+        self.written = []
+        dump, append = self.machine.index_backend.dump, self.machine.index_backend.append
+
+        def counting_dump(obj, file_name, appendable=False):
+            self.written.append(file_name)
+            dump(obj, file_name, appendable)
+
+        def counting_append(obj, file_name):
+            self.written.append(file_name)
+            append(obj, file_name)
+
+        self.machine.index_backend.dump = counting_dump
+        self.machine.index_backend.append = counting_append
+
+    def test_fold_in_writes_changes_only(self):
+        self.count_writes()
+        self.machine.update_index_with_doc('Основатель Wikileaks арестован', 'new')
+        self.assertNotIn(SearchMachine.T_INDEX_NAME, self.written)
+        self.assertNotIn(SearchMachine.WORDS_INDEX_NAME, self.written)
+        self.assertIn(SearchMachine.D_INDEX_NAME, self.written)
+        self.assertNotIn(SearchMachine.META_INDEX_NAME, self.written)
+        self.assertIn(SearchMachine.DRIFT_INDEX_NAME, self.written)
+
+        self.machine.load_space_from_dump()
+        self.assertEqual(self.machine.space.keys[-1], 'new')
+        self.assertEqual(self.machine.space.D.shape[1], len(TEST_DOCS) + 1)
+        self.assertTrue(self.machine.space.weighting.is_fitted())
+        self.assertEqual(self.machine.get_drift()['added_documents'], 1)
+
+    def test_fold_in_appends_ann_assignments(self):
+        self.machine = self.make_built_machine(ann_index='lsa.indexer.ann.IvfIndex', ann_options={'n_lists': 3})
+        self.machine.open()
+        self.count_writes()
+        self.machine.add_documents([('Основатель Wikileaks арестован', 'new_1'), ('Нобелевская премия', 'new_2')])
+        self.assertNotIn(SearchMachine.ANN_INDEX_NAME, self.written)
+        self.assertIn(SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME, self.written)
+        self.assertTrue(os.path.exists(self.machine.index_backend.get_delta_path(
+            SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME)))  # appended, not rewritten
+
+        ann_index = self.machine.space.ann_index
+        self.machine.close()
+        other_machine = self.make_machine(ann_index='lsa.indexer.ann.IvfIndex', ann_options={'n_lists': 3})
+        other_machine.load_space_from_dump()
+        self.assertEqual(other_machine.space.ann_index.assignments.tolist(), ann_index.assignments.tolist())
+        self.assertEqual(other_machine.space.ann_index.boundaries.tolist(), ann_index.boundaries.tolist())
+
+    def test_stems_are_written_by_session_and_close(self):
+        self.machine = self.make_built_machine(persist_stem_cache=True)
+        self.count_writes()
+        self.machine.update_index_with_doc('Квазар обнаружен астрономами', 'new_1')
+        self.assertNotIn(SearchMachine.STEMS_INDEX_NAME, self.written)
+        with self.machine.update_session() as machine:
+            machine.update_index_with_doc('Квазары далеко', 'new_2')
+        self.assertIn(SearchMachine.STEMS_INDEX_NAME, self.written)
+
+        self.written = []
+        self.machine.open()
+        self.machine.search('основатель wikileaks')
+        self.machine.close()
+        self.assertEqual(self.written, [])  # no new stems
+        self.machine.open()
+        self.machine.search('неизвестные слова')
+        self.machine.close()
+        self.assertEqual(self.written, [SearchMachine.STEMS_INDEX_NAME])
+        self.assertIn('неизвестные', self.make_machine(persist_stem_cache=True).index_backend.load(
+            SearchMachine.STEMS_INDEX_NAME))
+
+    def test_session(self):
+        documents = [('Основатель Wikileaks арестован', 'new_1'), ('Нобелевская премия мира', 'new_2')]
+        other_folder = os.path.join(tempfile.mkdtemp(), 'index')
+        shutil.copytree(self.index_folder, other_folder)
+        other_machine = self.make_machine(keep_index_info={'path_to_index_folder': other_folder})
+        for document, desired_id in documents:
+            other_machine.update_index_with_doc(document, desired_id)
+        other_machine.remove_document(0)
+        other_machine.load_space_from_dump()
+
+        self.count_writes()
+        with self.machine.update_session() as machine:
+            for document, desired_id in documents:
+                machine.update_index_with_doc(document, desired_id)
+            machine.remove_document(0)
+            self.assertEqual(self.written, [])
+        self.assertIsNone(self.machine.space)
+        self.assertEqual(len(self.written), len(set(self.written)))
+
+        self.machine.load_space_from_dump()
+        self.assertEqual(self.machine.space.keys, other_machine.space.keys)
+        np.testing.assert_almost_equal(self.machine.space.D, other_machine.space.D)
+        shutil.rmtree(os.path.dirname(other_folder))
+
+    def test_failed_session(self):
+        self.count_writes()
+        with self.assertRaises(exceptions.UniqueKeyException):
+            with self.machine.update_session() as machine:
+                machine.update_index_with_doc('Основатель Wikileaks арестован', 'new')
+                machine.update_index_with_doc('Нобелевская премия мира', 0)
+        self.assertEqual(self.written, [])
+        self.assertNotIn('new', self.make_machine().similar_to(0, limit=100))
+
+
+class RemoveDocumentTests(SearchMachineFixtureMixin, unittest.TestCase):
+    def test_removal_is_appended(self):
+        self.machine.index_backend.dump = None  # nothing should be rewritten
+        self.machine.remove_document(0)
+        self.machine.remove_document(1)
+
+        self.machine.load_space_from_dump()
+        self.assertEqual(self.machine.space.dump_tombstones(), [0, 1])
+        self.assertNotIn(0, self.machine.search('основатель wikileaks', limit=100))
+
+    def test_compaction(self):
+        self.machine.remove_document(0)
+        results = self.machine.similar_to(1, limit=100, with_distances=True)
+        self.assertEqual(self.machine.compact_index(), 1)
+        self.assertEqual(self.machine.compact_index(), 0)
+
+        self.machine.load_space_from_dump()
+        self.assertEqual(self.machine.space.keys, list(range(1, len(TEST_DOCS))))
+        self.assertEqual(self.machine.space.dump_tombstones(), [])
+        self.assertEqual(self.machine.similar_to(1, limit=100, with_distances=True), results)
+
+    def test_automatic_compaction(self):
+        machine = self.make_machine(max_removed_part=0.25)
+        machine.remove_document(0)
+        machine.remove_document(1)
+        machine.load_space_from_dump()
+        self.assertEqual(len(machine.space.keys), len(TEST_DOCS))  # 2 of 9 are removed, not compacted yet
+        machine.remove_document(2)
+        machine.load_space_from_dump()
+        self.assertEqual(machine.space.D.shape[1], len(TEST_DOCS) - 3)
+
+
+class DbBuildFixtureMixin(SearchMachineFixtureMixin):
+    """ Fixture puts test documents into SQLite database """
+
+    def setUp(self):
+        super(DbBuildFixtureMixin, self).setUp()
+        self.db_file_name = os.path.join(self.index_folder, 'test.db')
+        connection = sqlite3.connect(self.db_file_name)
+        connection.execute('CREATE TABLE news (id INTEGER PRIMARY KEY, title TEXT)')
+        connection.executemany('INSERT INTO news VALUES (?, ?)', [(i, doc) for i, doc in enumerate(TEST_DOCS)])
+        connection.commit()
+        connection.close()
+
+    def make_db_machine(self, **kwargs):
+        return self.make_machine(db_backend='lsa.db.sqlite.SQLiteBackend',
+                                 db_credentials={'db_file_name': self.db_file_name},
+                                 tables_info={'news': {'fields': ('title',), 'pk_field_name': 'id'}}, **kwargs)
+
+
+class OutOfCoreBuildTests(DbBuildFixtureMixin, unittest.TestCase):
+    def test_build_from_db(self):
+        spill_folder = tempfile.mkdtemp()
+        machine = self.make_db_machine(
+            index_backend='lsa.keeper.backends.NpyIndexBackend', svd_engine='lsa.indexer.svd.RandomizedSvdEngine',
+            keep_index_info={'path_to_index_folder': os.path.join(self.index_folder, 'index')},
+            out_of_core_options={'memory_budget': 2 ** 12, 'spill_folder': spill_folder})
+        machine.build_index()
+
+        self.assertEqual(os.listdir(spill_folder), [])
+        os.rmdir(spill_folder)
+        machine.load_space_from_dump()
+        self.assertEqual(machine.space.keys, list(range(len(TEST_DOCS))))
+        self.assertIn(0, machine.search('основатель wikileaks'))
+
+
+class ParallelBuildTests(DbBuildFixtureMixin, unittest.TestCase):
+    def build(self, workers):
+        folder = os.path.join(self.index_folder, 'workers_%d' % workers)
+        machine = self.make_db_machine(workers=workers, preprocess_chunk_size=2,
+                                       keep_index_info={'path_to_index_folder': folder})
+        machine.build_index()
+        machine.load_space_from_dump()
+        return machine.space
+
+    def test_same_as_one_worker(self):
+        space, true_space = self.build(2), self.build(1)
+        self.assertEqual(space.keys, true_space.keys)
+        self.assertEqual(space.words, true_space.words)
+        # signs of singular vectors are arbitrary, so products of document columns are compared
+        np.testing.assert_almost_equal(space.D.T.dot(space.D), true_space.D.T.dot(true_space.D), decimal=3)
+        self.assertEqual(space.search('основатель wikileaks'), true_space.search('основатель wikileaks'))
+
+
+class StorageDtypeTests(SearchMachineFixtureMixin, unittest.TestCase):
+    machine_kwargs = {'storage_dtype': 'int8'}
+
+    def test_quantized_index(self):
+        self.machine.load_space_from_dump()
+        space = self.machine.space
+        self.assertEqual(space.D.dtype, np.int8)
+        self.assertEqual(len(space.D_scales), len(TEST_DOCS))
+
+        self.machine.update_index_with_doc('Основатель Wikileaks арестован', 'new')
+        self.machine.load_space_from_dump()
+        self.assertEqual(len(self.machine.space.D_scales), len(TEST_DOCS) + 1)
+
+        # index is loaded with another storage dtype
+        machine = self.make_machine(storage_dtype='float32')
+        machine.load_space_from_dump()
+        self.assertEqual(machine.space.D.dtype, np.float32)
+        np.testing.assert_almost_equal(machine.space.get_documents(), self.machine.space.get_documents())
+
+
+class NpyStorageDtypeTests(StorageDtypeTests):
+    machine_kwargs = {'storage_dtype': 'int8', 'index_backend': 'lsa.keeper.backends.NpyIndexBackend'}
+
+
+class NpyUpdateSessionTests(UpdateSessionTests):
+    machine_kwargs = {'index_backend': 'lsa.keeper.backends.NpyIndexBackend'}
+
+    def test_folded_in_documents_stay_memory_mapped(self):
+        self.machine.update_index_with_doc('Основатель Wikileaks арестован', 'new')
+        self.machine.load_space_from_dump()
+        self.assertIsInstance(self.machine.space.D.base, np.memmap)
+        self.assertEqual(self.machine.space.D.shape[1], len(TEST_DOCS) + 1)
+        self.assertIn('new', self.machine.search('основатель wikileaks'))
+
+
+class ShardsTests(SearchMachineFixtureMixin, unittest.TestCase):
+    machine_kwargs = {'index_backend': 'lsa.keeper.backends.NpyIndexBackend', 'relevance_radius_threshold': 0.9}
+    queries = ['основатель wikileaks', 'нобелевская премия', 'суд США', 'неизвестноеслово']
+
+    def assert_same_results(self, results, true_results):
+        self.assertEqual(len(results), len(true_results))
+        for result, true_result in zip(results, true_results):
+            if true_result is None:
+                self.assertIsNone(result)
+            else:
+                self.assertEqual([k for k, d in result], [k for k, d in true_result])
+                np.testing.assert_almost_equal([d for k, d in result], [d for k, d in true_result])
+
+    def check_same_as_one_space(self, machine):
+        for limit in (2, 100):
+            self.assert_same_results(machine.search_many(self.queries, limit=limit, with_distances=True),
+                                     self.machine.search_many(self.queries, limit=limit, with_distances=True))
+        self.assert_same_results([machine.search(self.queries[0], with_distances=True)],
+                                 [self.machine.search(self.queries[0], with_distances=True)])
+        self.assert_same_results([machine.similar_to(key, limit=3, with_distances=True) for key in range(5)],
+                                 [self.machine.similar_to(key, limit=3, with_distances=True) for key in range(5)])
+
+    def test_same_as_one_space(self):
+        for shards_number in (1, 2, 4):
+            with self.make_machine(shards_options={'shards': shards_number}) as machine:
+                self.assertEqual(len(machine.shards.processes), shards_number)
+                self.check_same_as_one_space(machine)
+            self.assertIsNone(machine.shards)
+
+    def count_loads(self, machine):
+        self.loads = 0
+        load = machine.shards.load
+
+        def counting_load():
+            self.loads += 1
+            load()
+
+        machine.shards.load = counting_load
+
+    def test_shards_keep_their_parts(self):
+        with self.make_machine(shards_options={'shards': 2}) as machine:
+            self.assertIsNone(machine.space.D)  # coordinator keeps basis only
+            self.assertEqual(machine.shards.ranges, [[0, 4], [4, 9]])
+
+        server = shards.ShardServer(self.make_machine(), 1, 2)
+        self.assertEqual(server.load(), (4, 9))
+        self.assertEqual(server.space.keys, list(range(4, 9)))
+        self.assertIsInstance(server.space.D.base, np.memmap)
+        self.machine.load_space_from_dump()
+        np.testing.assert_equal(server.get_columns(5, 7)[0], self.machine.space.D[:, 5:7])
+
+        json_index = {'index_backend': 'lsa.keeper.backends.JsonIndexBackend',
+                      'keep_index_info': {'path_to_index_folder': os.path.join(self.index_folder, 'json')}}
+        self.make_built_machine(**json_index)
+        machine = self.make_machine(shards_options={'shards': 2}, **json_index)
+        with self.assertRaises(NotImplementedError):  # JSON index can not be loaded by parts
+            machine.open()
+        self.assertIsNone(machine.shards)
+
+    def test_updates_are_sent_to_shards(self):
+        with self.make_machine(shards_options={'shards': 3}) as machine:
+            self.count_loads(machine)
+            machine.add_documents([('Основатель Wikileaks арестован', 'new'), ('Нобелевская премия', 'new_2')])
+            self.assertIn('new', machine.search('основатель wikileaks'))
+            self.assertEqual(machine.similar_to('new', limit=3), self.machine.similar_to('new', limit=3))
+            machine.remove_document(0)
+            self.assertNotIn(0, machine.search('основатель wikileaks', limit=100))
+            self.assertEqual(self.loads, 0)
+            self.assertEqual(machine.shards.ranges[-1][1], len(TEST_DOCS) + 2)
+            self.assertIsNone(machine.space.D)
+
+            self.assertEqual(machine.compact_index(), 1)  # D is rewritten
+            self.assertEqual(self.loads, 1)
+            self.assertIsNone(machine.space.D)
+            self.assert_same_results(machine.search_many(self.queries, limit=100, with_distances=True),
+                                     self.machine.search_many(self.queries, limit=100, with_distances=True))
+
+            with machine.update_session():
+                machine.update_index_with_doc('Основатель Wikileaks арестован снова', 'new_3')
+                machine.remove_document('new')
+                self.assertEqual(machine.compact_index(), 1)
+                machine.update_index_with_doc('Нобелевская премия мира', 'new_4')  # shards are reloaded at the end
+                machine.remove_document(1)
+            self.assertIsNone(machine.space.D)
+            self.assert_same_results(machine.search_many(self.queries, limit=100, with_distances=True),
+                                     self.machine.search_many(self.queries, limit=100, with_distances=True))
+            self.assertEqual(machine.similar_to('new_3', limit=3), self.machine.similar_to('new_3', limit=3))
+
+    def test_neighbours_table_after_removal(self):
+        self.machine.build_neighbours(limit=3)
+        with self.make_machine(shards_options={'shards': 2}) as machine:
+            machine.remove_document(machine.similar_to(0, limit=3)[0])  # table of 0 has 2 results now
+            self.machine.load_space_from_dump()
+            self.machine.space.neighbours = None
+            self.assertEqual(machine.similar_to(0, limit=3), self.machine.space.similar_to(0, limit=3))
+
+    def test_coords_rounded_to_zeros(self):
+        with self.make_machine(shards_options={'shards': 2}) as machine:
+            word = machine.space.words[0]
+            machine.space.P = machine.space.P.copy()
+            machine.space.P[machine.space.word_index[word]] = 0
+            self.assertEqual(machine.search_many([word, 'неизвестноеслово']), [[], None])
+
+    def test_shards_are_reloaded(self):
+        with self.make_machine(shards_options={'shards': 3}) as machine:
+            machine.update_index_with_doc('Основатель Wikileaks арестован', 'new')
+            self.assertIn('new', machine.search('основатель wikileaks'))
+            machine.remove_document('new')
+            self.assertNotIn('new', machine.search('основатель wikileaks'))
+
+            self.make_machine().update_index_with_doc('Основатель Wikileaks арестован', 'other')  # another process
+            self.assertIn('other', machine.search('основатель wikileaks'))
+            with self.assertRaises(exceptions.DocumentDoesNotExist):
+                machine.similar_to('new')
+
+    def test_shard_servers(self):
+        authkey = b'secret'
+        addresses = [os.path.join(self.index_folder, 'shard_%d.sock' % shard) for shard in range(2)]
+        processes = []
+        for shard, address in enumerate(addresses):
+            ready, child_ready = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=shards.serve_shard, args=(self.make_machine(), shard, 2),
+                                              kwargs={'address': address, 'authkey': authkey, 'ready': child_ready})
+            process.start()
+            ready.recv()
+            processes.append(process)
+
+        try:
+            for i in range(2):  # servers are not stopped by coordinator
+                with self.make_machine(shards_options={'addresses': addresses, 'authkey': authkey}) as machine:
+                    self.check_same_as_one_space(machine)
+            self.assertTrue(all(process.is_alive() for process in processes))
+        finally:
+            for process in processes:
+                process.terminate()
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader()
+    suite.loadTestsFromTestCase(ResidentModeTests)
+    suite.loadTestsFromTestCase(AddDocumentsTests)
+    suite.loadTestsFromTestCase(NeighboursTests)
+    suite.loadTestsFromTestCase(ProjectionTests)
+    suite.loadTestsFromTestCase(IncrementalUpdateTests)
+    suite.loadTestsFromTestCase(UpdateSessionTests)
+    suite.loadTestsFromTestCase(RemoveDocumentTests)
+    suite.loadTestsFromTestCase(OutOfCoreBuildTests)
+    suite.loadTestsFromTestCase(ParallelBuildTests)
+    suite.loadTestsFromTestCase(StorageDtypeTests)
+    suite.loadTestsFromTestCase(NpyStorageDtypeTests)
+    suite.loadTestsFromTestCase(NpyUpdateSessionTests)
+    suite.loadTestsFromTestCase(ShardsTests)
+    unittest.TextTestRunner(verbosity=3).run(suite)
@@ -0,0 +1,423 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from scipy.spatial import distance
+
+from lsa.indexer import ann, core, svd
+from lsa.utils import exceptions
+from lsa_tests.base import TEST_DOCS
+from lsa_tests.benchmark_storage import make_documents
+
+
+class SpaceFixtureMixin():
+    """ Fixture creates Space instance with built semantic space """
+
+    def setUp(self):
+        self.space = core.Space(latent_dimensions=3, relevance_radius_threshold=0.9, use_stemming=True,
+                                use_tf_idf=True, decimals=3)
+        for i, doc in enumerate(TEST_DOCS):
+            self.space.add_document(doc, desired_id=i)
+        self.space.build_semantic_space()
+
+    def tearDown(self):
+        del self.space
+
+
+class FindSimilarDocumentsTests(SpaceFixtureMixin, unittest.TestCase):
+    def brute_force(self, coords):
+        """ Reference implementation: cosine distance to every column one by one """
+
+        results = []
+        for i in range(self.space.D.shape[1]):
+            d = distance.cosine(np.asarray(self.space.D[:, i]).ravel(), coords)
+            if not np.isnan(d) and d > 0:
+                results.append((self.space.keys[i], d))
+        threshold = max(d for k, d in results) * self.space.relevance_radius_threshold
+        return sorted([r for r in results if r[1] < threshold], key=lambda r: r[1])
+
+    def test_same_as_brute_force(self):
+        coords = self.space.make_semantic_space_coords_for_new_doc(self.space.prepare_document(TEST_DOCS[0]))
+        true_results = self.brute_force(coords)
+        results = self.space.find_similar_documents(coords, limit=100, with_distances=True)
+        self.assertEqual([k for k, d in results], [k for k, d in true_results])
+        np.testing.assert_almost_equal([d for k, d in results], [d for k, d in true_results])
+
+    def test_limit(self):
+        coords = self.space.make_semantic_space_coords_for_new_doc(self.space.prepare_document(TEST_DOCS[0]))
+        results = self.space.find_similar_documents(coords, limit=100)
+        self.assertEqual(self.space.find_similar_documents(coords, limit=2), results[:2])
+        self.assertEqual(self.space.find_similar_documents(coords, limit=0), [])
+
+    def test_filter_distances(self):
+        self.space.relevance_radius_threshold = 0.5
+        mask = self.space.filter_distances(np.array([0.1, 0.6, 0.4, 1.0]))
+        self.assertEqual(mask.tolist(), [True, False, True, False])
+        self.assertEqual(len(self.space.filter_distances(np.array([]))), 0)
+
+
+class NewDocCoordsTests(SpaceFixtureMixin, unittest.TestCase):
+    def test_same_as_full_projection(self):
+        document = self.space.prepare_document(TEST_DOCS[3] + ' неизвестноеслово')
+        Xq = np.array([1 if word in document else 0 for word in self.space.words])
+        true_coords = Xq.dot(self.space.T).dot(np.linalg.inv(self.space.S)).round(decimals=self.space.decimals)
+        coords = self.space.make_semantic_space_coords_for_new_doc(document)
+        np.testing.assert_almost_equal(coords, true_coords)
+
+    def test_unknown_words(self):
+        self.assertIsNone(self.space.make_semantic_space_coords_for_new_doc(['неизвестноеслово']))
+
+
+class SearchManyTests(SpaceFixtureMixin, unittest.TestCase):
+    def test_same_as_search(self):
+        queries = ['основатель wikileaks', 'неизвестноеслово', 'нобелевская премия', 'суд США']
+        true_results = [self.space.search(query, with_distances=True, limit=3) for query in queries]
+        for chunk_size in (1, 3, 10):
+            results = self.space.search_many(queries, with_distances=True, limit=3, chunk_size=chunk_size)
+            self.assertIsNone(results[1])
+            for result, true_result in zip(results, true_results):
+                if true_result is not None:
+                    self.assertEqual([k for k, d in result], [k for k, d in true_result])
+                    np.testing.assert_almost_equal([d for k, d in result], [d for k, d in true_result])
+
+    def test_coords_rounded_to_zeros(self):
+        word = self.space.words[0]
+        self.space.P[self.space.word_index[word]] = 0
+        self.assertEqual(self.space.search(word), [])
+        self.assertEqual(self.space.search_many([word, 'неизвестноеслово']), [[], None])
+
+
+class SimilarToTests(SpaceFixtureMixin, unittest.TestCase):
+    def test_same_as_coords_search(self):
+        coords = np.asarray(self.space.D[:, 3]).ravel()
+        true_results = [r for r in self.space.find_similar_documents(coords, with_distances=True) if r[0] != 3]
+        results = self.space.similar_to(3, with_distances=True)
+        self.assertEqual([k for k, d in results], [k for k, d in true_results])
+
+    def test_neighbours_table(self):
+        true_results = [self.space.similar_to(key, limit=3, with_distances=True) for key in self.space.keys]
+        self.space.build_neighbours(limit=3, chunk_size=4)
+        self.space.D = None  # table only is used
+        for key, true_result in zip(self.space.keys, true_results):
+            result = self.space.similar_to(key, limit=3, with_distances=True)
+            self.assertEqual([k for k, d in result], [k for k, d in true_result])
+            np.testing.assert_almost_equal([d for k, d in result], [d for k, d in true_result])
+
+        dump = self.space.dump_neighbours()
+        self.space.load_neighbours(None)
+        self.space.load_neighbours(dump)
+        self.assertEqual(self.space.similar_to(0, limit=2), [k for k, d in true_results[0][:2]])
+
+    def test_neighbours_table_after_removal(self):
+        self.space.build_neighbours(limit=3)
+        removed = self.space.similar_to(0, limit=3)[0]
+        self.space.remove_document(removed)
+        neighbours = self.space.neighbours
+        self.space.neighbours = None
+        true_results = self.space.similar_to(0, limit=3)
+        self.space.neighbours = neighbours
+        self.assertEqual(len(true_results), 3)
+        self.assertEqual(self.space.similar_to(0, limit=3), true_results)  # table has 2 results only
+        self.assertEqual(self.space.similar_to(0, limit=2), true_results[:2])
+
+    def test_wrong_id(self):
+        with self.assertRaises(exceptions.DocumentDoesNotExist):
+            self.space.similar_to('wrong_id')
+
+
+class IvfIndexTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        centers = random.standard_normal((20, 10))
+        self.D = (centers[random.randint(0, 20, 2000)] + 0.1 * random.standard_normal((2000, 10))).T
+        self.index = ann.IvfIndex(n_lists=20, n_probe=3, random_state=0)
+        self.index.build(self.D)
+
+    def test_lists(self):
+        order, offsets = self.index.get_lists()
+        self.assertEqual(sorted(order.tolist()), list(range(self.D.shape[1])))
+        self.assertEqual(offsets[-1], self.D.shape[1])
+
+    def test_candidates(self):
+        for column in range(0, self.D.shape[1], 50):
+            candidates = self.index.candidates(self.D[:, column])
+            self.assertIn(column, candidates)
+            self.assertLess(len(candidates), self.D.shape[1] / 2)
+
+    def test_all_lists_probed(self):
+        self.assertEqual(self.index.candidates(self.D[:, 0], n_probe=20).tolist(), list(range(self.D.shape[1])))
+
+    def test_add_remove_dump(self):
+        self.index.add(self.D[:, :5])
+        self.assertEqual(self.index.assignments[-5:].tolist(), self.index.assignments[:5].tolist())
+        self.index.remove(0)
+        self.assertEqual(len(self.index.assignments), self.D.shape[1] + 4)
+
+        other_index = ann.IvfIndex()
+        other_index.load(self.index.dump(), self.index.dump_assignments(), self.index.dump_boundaries())
+        self.assertEqual(other_index.candidates(self.D[:, 1], 3).tolist(), self.index.candidates(self.D[:, 1]).tolist())
+        self.assertEqual(other_index.radius_columns(self.D[:, 1], 3).tolist(),
+                         self.index.radius_columns(self.D[:, 1]).tolist())
+
+    def test_boundaries(self):
+        removed = self.index.boundaries[:2, 0].copy()
+        self.index.remove(removed)
+        vectors = self.index.normalize_rows(np.delete(self.D, removed, axis=1).T)
+        angles = np.arccos(np.clip((vectors * self.index.centroids[self.index.assignments]).sum(axis=1), -1, 1))
+        for i, boundary in enumerate(self.index.boundaries):
+            members = np.flatnonzero(self.index.assignments == i)
+            boundary = boundary[boundary != -1]
+            self.assertTrue(set(boundary) <= set(members))
+            if len(boundary):  # other documents of the list are not farther from centroid
+                self.assertGreaterEqual(angles[boundary].min(), angles[np.setdiff1d(members, boundary)].max(initial=0))
+
+        radius_columns = self.index.radius_columns(self.D[:, 1])
+        self.assertFalse(set(radius_columns) & set(self.index.candidates(self.D[:, 1])))
+
+    def test_memory_mapped(self):
+        with tempfile.TemporaryDirectory() as folder:
+            D = np.lib.format.open_memmap(os.path.join(folder, 'd.npy'), mode='w+', dtype=np.float32,
+                                          shape=self.D.shape)
+            D[:] = self.D
+            index = ann.IvfIndex(n_lists=20, train_size=10, chunk_size=100, random_state=0)
+            index.build(D)
+            true_index = ann.IvfIndex(n_lists=20, train_size=10, random_state=0)
+            true_index.build(self.D.astype(np.float32))
+            np.testing.assert_almost_equal(index.centroids, true_index.centroids)
+            self.assertEqual(index.assignments.tolist(), true_index.assignments.tolist())
+            del D
+
+
+class SpaceWithAnnTests(SpaceFixtureMixin, unittest.TestCase):
+    def test_all_lists_probed_is_exact(self):
+        true_results = self.space.search('основатель wikileaks', with_distances=True)
+        self.space.ann_index = ann.IvfIndex(n_lists=3, n_probe=3, random_state=0)
+        self.space.ann_index.build(self.space.D)
+        results = self.space.search('основатель wikileaks', with_distances=True)
+        self.assertEqual([k for k, d in results], [k for k, d in true_results])
+        np.testing.assert_almost_equal([d for k, d in results], [d for k, d in true_results])
+        self.assertNotIn(0, self.space.similar_to(0))
+
+
+class AnnRelevanceRadiusTests(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.space = core.Space(latent_dimensions=30, relevance_radius_threshold=0.9, use_stemming=False,
+                                use_tf_idf=True, decimals=6, svd_engine=svd.RandomizedSvdEngine(random_state=0))
+        for i, document in enumerate(make_documents(2000, 1000, 20, random)):
+            self.space.add_prepared_document(document, i)
+        self.space.build_semantic_space()
+        self.texts = [' '.join(query) for query in make_documents(30, 1000, 20, random)]
+        self.queries = [self.space.make_semantic_space_coords_for_new_doc(self.space.prepare_document(text))
+                        for text in self.texts]
+        self.ann_index = ann.IvfIndex(n_probe=4, random_state=0)
+        self.ann_index.build(self.space.D)
+
+    def test_same_threshold_as_exact_search(self):
+        for threshold in (0.7, 0.5):
+            self.space.relevance_radius_threshold = threshold
+            found = reachable = 0
+            for coords in self.queries:
+                self.space.ann_index = None
+                true_results = set(self.space.find_similar_documents(coords, limit=None))
+                self.space.ann_index = self.ann_index
+                results = set(self.space.find_similar_documents(coords, limit=None))
+                candidates = set(self.space.keys[i] for i in self.ann_index.candidates(coords))
+                self.assertTrue(results <= true_results)  # estimated radius is not bigger than the true one
+                found += len(results)
+                reachable += len(true_results & candidates)
+            self.assertGreater(reachable, 0)
+            self.assertGreater(found / reachable, 0.95)
+
+    def test_search_many_uses_index(self):
+        self.space.ann_index = ann.IvfIndex(n_probe=1, random_state=0)
+        self.space.ann_index.build(self.space.D)
+        true_results = [self.space.search(text, with_distances=True, limit=10) for text in self.texts]
+        results = self.space.search_many(self.texts, with_distances=True, limit=10, chunk_size=7)
+        self.assertEqual([[k for k, d in result] for result in results],
+                         [[k for k, d in result] for result in true_results])
+
+
+class SvdUpdateTests(SpaceFixtureMixin, unittest.TestCase):
+    new_docs = [('Квазар обнаружен астрономами, квазар далеко', 'new_1'), ('Основатель Wikileaks арестован', 'new_2')]
+
+    def test_same_as_decomposition_of_updated_matrix(self):
+        space = core.Space(latent_dimensions=3, relevance_radius_threshold=0.9, use_stemming=True,
+                           use_tf_idf=True, decimals=10)
+        for i, doc in enumerate(TEST_DOCS):
+            space.add_document(doc, desired_id=i)
+        space.build_semantic_space()
+        approximation = space.T.dot(space.S).dot(space.D)
+        documents = [space.prepare_document(doc) for doc, key in self.new_docs]
+        space.add_new_words(documents)
+        approximation = np.vstack([approximation, np.zeros((len(space.words) - len(approximation), len(space.keys)))])
+        A = space.make_weighted_columns(documents)
+        space.update_svd(A)
+
+        true_S = np.linalg.svd(np.hstack([approximation, A.toarray()]), compute_uv=False)
+        np.testing.assert_almost_equal(np.diag(space.S), true_S[:space.latent_dimensions])
+        np.testing.assert_almost_equal(np.asarray(space.T).T.dot(np.asarray(space.T)), np.eye(3))
+
+    def test_new_words_and_keys(self):
+        words_number = len(self.space.words)
+        keys = self.space.update_svd_with_documents(self.new_docs)
+        self.assertEqual(keys, ['new_1', 'new_2'])
+        self.assertEqual(self.space.keys[-2:], keys)
+        self.assertIn(self.space.stemmer.stem('квазар'), self.space.words)
+        self.assertEqual(len(self.space.words), words_number + 1)
+        self.assertEqual(self.space.T.shape[0], len(self.space.words))
+        self.assertEqual(self.space.P.shape, self.space.T.shape)
+        self.assertEqual(self.space.D.shape[1], len(TEST_DOCS) + 2)
+        self.assertTrue(self.space.T[self.space.word_index[self.space.stemmer.stem('квазар')]].any())
+        self.assertTrue(self.space.D[:, -2].any())
+
+    def test_rollback(self):
+        with self.assertRaises(exceptions.UniqueKeyException):
+            self.space.update_svd_with_documents([('Квазар', 'new_1'), ('Нобелевская премия', 1)])
+        self.assertEqual(len(self.space.keys), len(TEST_DOCS))
+
+    def test_drift(self):
+        self.assertEqual(self.space.get_drift(), {'added_documents': 0, 'added_part': 0., 'lost_energy_part': 0.})
+        self.space.update_svd_with_documents(self.new_docs, chunk_size=1)
+        drift = self.space.get_drift()
+        self.assertEqual(drift['added_documents'], 2)
+        self.assertAlmostEqual(drift['added_part'], 2. / (len(TEST_DOCS) + 2))
+        self.assertTrue(0 < drift['lost_energy_part'] < 1)
+        self.assertTrue(self.space.is_rebuild_advised(max_added_part=0.1))
+
+    def test_unknown_weighting_statistics(self):
+        self.space.weighting.global_weights = None
+        with self.assertRaises(exceptions.IndexRebuildRequired):
+            self.space.update_svd_with_documents(self.new_docs)
+
+    def test_ann_index_follows_basis(self):
+        self.space.ann_index = ann.IvfIndex(n_lists=3, n_probe=3, random_state=0)
+        self.space.ann_index.build(self.space.D)
+        assignments = self.space.ann_index.assignments.copy()
+        self.space.ann_index.build = None  # k-means is not repeated
+        self.space.update_svd_with_documents(self.new_docs, chunk_size=1)
+
+        index = self.space.ann_index
+        self.assertEqual(len(index.assignments), len(self.space.keys))
+        np.testing.assert_array_equal(index.assignments[:len(assignments)], assignments)
+        np.testing.assert_array_equal(index.assignments, index.assign(self.space.D.T))
+        self.assertIn('new_2', self.space.search('основатель wikileaks'))
+
+
+class RemoveDocumentTests(SpaceFixtureMixin, unittest.TestCase):
+    def test_removed_is_not_found(self):
+        D = self.space.D
+        self.assertIn(3, self.space.similar_to(0, limit=100))
+        self.space.remove_document(3)
+        self.assertIs(self.space.D, D)
+        self.assertNotIn(3, self.space.similar_to(0, limit=100))
+        self.assertNotIn(3, self.space.search_many(['основатель wikileaks'], limit=100)[0])
+        with self.assertRaises(exceptions.DocumentDoesNotExist):
+            self.space.remove_document(3)
+        with self.assertRaises(exceptions.DocumentDoesNotExist):
+            self.space.similar_to(3)
+
+    def test_key_can_be_added_again(self):
+        self.space.remove_document(3)
+        self.assertEqual(self.space.update_space_with_document(TEST_DOCS[3], 3), 3)
+        self.assertEqual(self.space.get_key_index()[3], len(TEST_DOCS))
+
+    def test_compact(self):
+        self.space.remove_document(3)
+        self.space.remove_document(5)
+        results = self.space.similar_to(0, limit=100, with_distances=True)
+        self.assertEqual(self.space.compact(), 2)
+        self.assertEqual(self.space.D.shape[1], len(TEST_DOCS) - 2)
+        self.assertEqual(self.space.keys, [key for key in range(len(TEST_DOCS)) if key not in (3, 5)])
+        self.assertEqual(self.space.similar_to(0, limit=100, with_distances=True), results)
+
+
+class FoldInTests(SpaceFixtureMixin, unittest.TestCase):
+    def test_same_as_stacked_columns(self):
+        true_D = self.space.D.copy()
+        queries = ['Основатель Wikileaks арестован', 'Нобелевская премия', 'суд США']
+        for i, query in enumerate(queries):
+            self.space.update_space_with_document(query, 'new_%d' % i)
+            true_D = np.column_stack([true_D, self.space.make_semantic_space_coords_for_new_doc(
+                self.space.prepare_document(query))])
+        self.assertIsInstance(self.space.D, np.ndarray)
+        np.testing.assert_almost_equal(self.space.D, true_D)
+
+    def test_not_copied(self):
+        self.space.update_space_with_document('Основатель Wikileaks арестован', 'new_1')
+        D = self.space.D
+        self.space.update_space_with_document('Нобелевская премия', 'new_2')
+        self.assertTrue(np.shares_memory(self.space.D, D))  # capacity is doubled, the column fits
+
+    def test_norms_are_extended(self):
+        self.space.remove_document(0)
+        self.space.get_docs_norms()
+        self.space.update_space_with_documents([('Основатель Wikileaks арестован', 'new_1'), ('', 'new_2')])
+        norms = self.space.get_docs_norms()
+        self.space.docs_norms = None
+        np.testing.assert_almost_equal(norms, self.space.get_docs_norms())
+        self.assertTrue(np.isnan(norms[[0, -1]]).all())  # removed one and the one without indexed words
+
+
+class SpaceWithoutDocumentsTests(SpaceFixtureMixin, unittest.TestCase):
+    def test_fold_in(self):
+        space = core.Space(latent_dimensions=3, relevance_radius_threshold=0.9, use_stemming=True, use_tf_idf=True,
+                           decimals=3)
+        space.load_from_dump(self.space.T, self.space.S, None, list(self.space.words), list(self.space.keys),
+                             self.space.P)
+        self.assertIsNone(space.D)
+
+        keys, columns = space.fold_in_documents([('Основатель Wikileaks арестован', 'new')])
+        self.space.update_space_with_document('Основатель Wikileaks арестован', 'new')
+        self.assertEqual(keys, ['new'])
+        np.testing.assert_almost_equal(columns[:, 0], self.space.D[:, -1])
+        self.assertIsNone(space.D)
+        self.assertEqual(space.remove_document('new'), len(TEST_DOCS))
+        self.assertEqual(space.dump_tombstones(), [len(TEST_DOCS)])
+
+
+class StorageDtypeTests(SpaceFixtureMixin, unittest.TestCase):
+    def make_space(self, storage_dtype):
+        space = core.Space(latent_dimensions=3, relevance_radius_threshold=0.9, use_stemming=True, use_tf_idf=True,
+                           decimals=3, storage_dtype=storage_dtype)
+        space.load_from_dump(self.space.T, self.space.S, self.space.D, list(self.space.words), list(self.space.keys))
+        return space
+
+    def test_dtypes(self):
+        for storage_dtype, size in (('float32', 4), ('float16', 2), ('int8', 1)):
+            space = self.make_space(storage_dtype)
+            self.assertEqual(space.D.dtype.itemsize, size)
+            self.assertEqual(space.P.dtype, np.float32 if storage_dtype == 'int8' else np.dtype(storage_dtype))
+            np.testing.assert_allclose(space.get_documents(), self.space.D, atol=0.01)
+            results = space.search('основатель wikileaks', limit=3)
+            self.assertEqual(set(results), set(self.space.search('основатель wikileaks', limit=3)))
+
+    def test_quantized_fold_in(self):
+        space = self.make_space('int8')
+        for s in (space, self.space):
+            s.update_space_with_documents([('Основатель Wikileaks арестован', 'new')])
+        self.assertEqual(space.D.dtype, np.int8)
+        self.assertEqual(len(space.D_scales), space.D.shape[1])
+        # the nearest document may become identical to the new one after quantization, so it is skipped
+        self.assertLessEqual(set(space.similar_to('new', limit=3)), set(self.space.similar_to('new', limit=4)))
+        space.remove_document(0)
+        space.compact()
+        self.assertEqual(len(space.D_scales), space.D.shape[1])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader()
+    suite.loadTestsFromTestCase(FindSimilarDocumentsTests)
+    suite.loadTestsFromTestCase(NewDocCoordsTests)
+    suite.loadTestsFromTestCase(SearchManyTests)
+    suite.loadTestsFromTestCase(SimilarToTests)
+    suite.loadTestsFromTestCase(IvfIndexTests)
+    suite.loadTestsFromTestCase(SpaceWithAnnTests)
+    suite.loadTestsFromTestCase(AnnRelevanceRadiusTests)
+    suite.loadTestsFromTestCase(SvdUpdateTests)
+    suite.loadTestsFromTestCase(RemoveDocumentTests)
+    suite.loadTestsFromTestCase(FoldInTests)
+    suite.loadTestsFromTestCase(SpaceWithoutDocumentsTests)
+    suite.loadTestsFromTestCase(StorageDtypeTests)
+    unittest.TextTestRunner(verbosity=3).run(suite)
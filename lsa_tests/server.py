@@ -0,0 +1,221 @@
+import asyncio
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from lsa.search.server import SearchServer
+from lsa.utils import locks
+from lsa_tests.machine import SearchMachineFixtureMixin
+
+
+class SearchServerFixtureMixin(SearchMachineFixtureMixin):
+    server_kwargs = {}
+
+    def setUp(self):
+        super(SearchServerFixtureMixin, self).setUp()
+        self.searches = []  # sizes of search_many calls
+        machine = self.make_machine(relevance_radius_threshold=0.9)
+        search_many = machine.search_many
+
+        def counting_search_many(queries, *args, **kwargs):
+            self.searches.append(len(queries))
+            return search_many(queries, *args, **kwargs)
+
+        machine.search_many = counting_search_many
+        self.server = SearchServer(machine, **self.server_kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.call_in_loop(self.server.start(**self.get_address()))
+
+    def get_address(self):
+        return {'host': 'localhost', 'port': 0}
+
+    def call_in_loop(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout=30)
+
+    def tearDown(self):
+        self.call_in_loop(self.server.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        super(SearchServerFixtureMixin, self).tearDown()
+
+    def request(self, path, params):
+        connection = http.client.HTTPConnection('localhost', self.server.server.sockets[0].getsockname()[1])
+        try:
+            connection.request('POST', path, json.dumps(params))
+            response = connection.getresponse()
+            return response.status, json.loads(response.read().decode('utf-8'))
+        finally:
+            connection.close()
+
+
+class SearchServerTests(SearchServerFixtureMixin, unittest.TestCase):
+    def test_search(self):
+        true_results = self.make_machine(relevance_radius_threshold=0.9).search_many(
+            ['основатель wikileaks', 'неизвестноеслово'], limit=3, with_distances=True)
+        status, response = self.request('/search', {'query': 'основатель wikileaks', 'limit': 3,
+                                                    'with_distances': True})
+        self.assertEqual(status, 200)
+        self.assertEqual(response['results'], [list(result) for result in true_results[0]])
+        self.assertIsNone(self.request('/search', {'query': 'неизвестноеслово'})[1]['results'])
+
+        status, response = self.request('/search_many', {'queries': ['основатель wikileaks', 'неизвестноеслово'],
+                                                         'limit': 3, 'with_distances': True})
+        self.assertEqual(response['results'], [[list(pair) for pair in true_results[0]], None])
+
+    def test_similar_to(self):
+        true_results = self.make_machine(relevance_radius_threshold=0.9).similar_to(3, limit=3)
+        self.assertEqual(self.request('/similar_to', {'doc_id': 3, 'limit': 3}), (200, {'results': true_results}))
+        self.assertEqual(self.request('/similar_to', {'doc_id': 'unknown'})[0], 404)
+
+    def test_errors(self):
+        self.assertEqual(self.request('/unknown', {})[0], 404)
+        self.assertEqual(self.request('/search', {})[0], 400)
+        self.assertEqual(self.request('/search', ['query'])[0], 400)
+        self.assertEqual(self.request('/add_documents', {'documents': [['Нобелевская премия', 0]]})[0], 400)
+
+    def test_malformed_search_does_not_stop_batching(self):
+        for params in ({'query': 'основатель wikileaks', 'limit': [3]}, {'query': 'основатель wikileaks', 'limit': True},
+                       {'query': 'основатель wikileaks', 'limit': 0}, {'query': 'основатель wikileaks', 'limit': -1},
+                       {'query': 'основатель wikileaks', 'with_distances': 'yes'}, {'query': ['основатель']},
+                       {'queries': 'основатель wikileaks'}):
+            path = '/search_many' if 'queries' in params else '/search'
+            self.assertEqual(self.request(path, params)[0], 400)
+        status, response = self.request('/search', {'query': 'основатель wikileaks', 'limit': 3})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(response['results']), 3)
+
+        # failed batch fails its requests only
+        self.server.batch_size = None  # len(batch) < None raises TypeError in the batcher
+        self.assertNotEqual(self.request('/search', {'query': 'основатель wikileaks'})[0], 200)
+        self.server.batch_size = 100
+        self.assertEqual(self.request('/search', {'query': 'основатель wikileaks', 'limit': 3})[0], 200)
+
+    def test_updates(self):
+        status, response = self.request('/add_documents', {'documents': [['Основатель Wikileaks арестован', 'new']]})
+        self.assertEqual(response, {'keys': ['new']})
+        self.assertIn('new', self.request('/search', {'query': 'основатель wikileaks'})[1]['results'])
+        self.assertEqual(self.request('/remove_document', {'doc_id': 'new'}), (200, {}))
+        self.assertNotIn('new', self.request('/search', {'query': 'основатель wikileaks'})[1]['results'])
+
+        # index changed by another process is reloaded
+        self.make_machine().update_index_with_doc('Основатель Wikileaks арестован', 'other')
+        self.assertIn('other', self.request('/search', {'query': 'основатель wikileaks'})[1]['results'])
+
+    def test_keep_alive(self):
+        connection = http.client.HTTPConnection('localhost', self.server.server.sockets[0].getsockname()[1])
+        for i in range(3):
+            connection.request('POST', '/similar_to', json.dumps({'doc_id': i}))
+            self.assertEqual(connection.getresponse().read(), json.dumps(
+                {'results': self.server.machine.similar_to(i)}, ensure_ascii=False).encode('utf-8'))
+        connection.close()
+
+
+class BatchingTests(SearchServerFixtureMixin, unittest.TestCase):
+    server_kwargs = {'threads': 2, 'batch_delay': 0.05}
+
+    def test_concurrent_searches_are_batched(self):
+        queries = ['основатель wikileaks', 'нобелевская премия', 'суд США', 'полиция великобритании'] * 5
+        true_results = self.server.machine.search_many(queries, limit=5)
+        self.searches = []
+        with ThreadPoolExecutor(len(queries)) as executor:
+            responses = list(executor.map(lambda query: self.request('/search', {'query': query, 'limit': 5}),
+                                          queries))
+        self.assertEqual([response['results'] for status, response in responses], true_results)
+        self.assertEqual(sum(self.searches), len(queries))
+        self.assertLess(len(self.searches), len(queries))
+
+
+class AnnSearchServerTests(SearchServerFixtureMixin, unittest.TestCase):
+    machine_kwargs = {'ann_index': 'lsa.indexer.ann.IvfIndex',
+                      'ann_options': {'n_lists': 3, 'n_probe': 1, 'random_state': 0}}
+
+    def test_same_as_machine_search(self):
+        machine = self.make_machine(relevance_radius_threshold=0.9)
+        for query in ('основатель wikileaks', 'нобелевская премия', 'суд США', 'полиция великобритании'):
+            self.assertEqual(self.request('/search', {'query': query, 'with_distances': True})[1]['results'],
+                             [list(pair) for pair in machine.search(query, with_distances=True)])
+
+
+class UnixSocketTests(SearchServerFixtureMixin, unittest.TestCase):
+    def get_address(self):
+        return {'path': os.path.join(self.index_folder, 'server.sock')}
+
+    def test_search(self):
+        body = json.dumps({'query': 'основатель wikileaks', 'limit': 3}).encode('utf-8')
+        with socket.socket(socket.AF_UNIX) as client:
+            client.connect(os.path.join(self.index_folder, 'server.sock'))
+            client.sendall(b'POST /search HTTP/1.0\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+            response = b''
+            while True:
+                data = client.recv(65536)
+                if not data:  # HTTP/1.0 connection is closed after response
+                    break
+                response += data
+        headers, body = response.split(b'\r\n\r\n', 1)
+        self.assertTrue(headers.startswith(b'HTTP/1.1 200 OK'))
+        self.assertEqual(json.loads(body.decode('utf-8'))['results'], self.server.machine.search_many(
+            ['основатель wikileaks'], limit=3)[0])
+
+
+class ReadWriteLockTests(unittest.TestCase):
+    def test_readers_and_writer(self):
+        lock = locks.ReadWriteLock()
+        events = []
+
+        def read(name):
+            with lock.reading():
+                events.append(name + ' start')
+                time.sleep(0.05)
+                events.append(name + ' end')
+
+        def write():
+            with lock.writing():
+                events.append('writer')
+
+        readers = [threading.Thread(target=read, args=('reader %d' % i,)) for i in range(2)]
+        for reader in readers:
+            reader.start()
+        time.sleep(0.01)
+        writer = threading.Thread(target=write)
+        writer.start()
+        for thread in readers + [writer]:
+            thread.join()
+
+        self.assertEqual(sorted(events[:2]), ['reader 0 start', 'reader 1 start'])  # readers at once
+        self.assertEqual(events[-1], 'writer')  # writer waits for readers
+
+    def test_waiting_writer_blocks_new_readers(self):
+        lock = locks.ReadWriteLock()
+        lock.acquire_read()
+        writer = threading.Thread(target=lock.acquire_write)
+        writer.start()
+        while not lock.waiting_writers:
+            time.sleep(0.001)
+        reader = threading.Thread(target=lock.acquire_read)
+        reader.start()
+        time.sleep(0.05)
+        self.assertEqual(lock.readers, 1)  # new reader waits
+        lock.release_read()
+        writer.join()
+        self.assertTrue(lock.writer)
+        lock.release_write()
+        reader.join()
+        self.assertEqual(lock.readers, 1)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader()
+    suite.loadTestsFromTestCase(SearchServerTests)
+    suite.loadTestsFromTestCase(BatchingTests)
+    suite.loadTestsFromTestCase(AnnSearchServerTests)
+    suite.loadTestsFromTestCase(UnixSocketTests)
+    suite.loadTestsFromTestCase(ReadWriteLockTests)
+    unittest.TextTestRunner(verbosity=3).run(suite)
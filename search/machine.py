@@ -1,4 +1,13 @@
-from lsa.indexer import core
+import collections
+import contextlib
+import shutil
+import tempfile
+
+import numpy as np
+
+from lsa.custom_stemmer.cache import CachedStemmer
+from lsa.indexer import core, parallel
+from lsa.search import shards
 from lsa.utils import helpers, exceptions
 from lsa.utils.decorators import with_manage_space_instance
 
@@ -9,6 +18,35 @@ from lsa.utils.decorators import with_manage_space_instance
 
 # keeper.backends.JsonIndexBackend
 
+# indexer.svd.FullSvdEngine
+# indexer.svd.TruncatedSvdEngine
+# indexer.svd.RandomizedSvdEngine
+
+# indexer.weighting.TfIdfWeighting
+# indexer.weighting.LogEntropyWeighting
+# indexer.weighting.Bm25Weighting
+
+# indexer.ann.IvfIndex
+
+class IndexChanges(object):
+    """ Parts of the index changed in memory, see SearchMachine.dump_changes
+
+        components - names of index files to rewrite
+        appended - number of documents appended to the end of D and keys
+        removed - numbers of columns of removed documents
+    """
+
+    def __init__(self, *components):
+        self.components = set(components)
+        self.appended = 0
+        self.removed = []
+
+    def update(self, changes):
+        self.components.update(changes.components)
+        self.appended += changes.appended
+        self.removed.extend(changes.removed)
+
+
 # Divide SearchMachine into SearchMachine and Indexer, they are logically different
 class SearchMachine():
     # TODO: encapsulate names it in keeper
@@ -17,11 +55,67 @@ class SearchMachine():
     D_INDEX_NAME = 'd.json'
     WORDS_INDEX_NAME = 'words.json'
     KEYS_INDEX_NAME = 'keys.json'
+    P_INDEX_NAME = 'p.json'
+    STEMS_INDEX_NAME = 'stems.json'
+    NEIGHBOURS_INDEX_NAME = 'neighbours.json'
+    ANN_INDEX_NAME = 'ann.json'
+    ANN_ASSIGNMENTS_INDEX_NAME = 'ann_assignments.json'
+    ANN_BOUNDARIES_INDEX_NAME = 'ann_boundaries.json'
+    META_INDEX_NAME = 'meta.json'
+    DRIFT_INDEX_NAME = 'drift.json'
+    REMOVED_INDEX_NAME = 'removed.json'
+    D_SCALES_INDEX_NAME = 'd_scales.json'
 
     def __init__(self, latent_dimensions, index_backend, keep_index_info, default_search_limit=100, db_backend=None,
                  db_credentials=None, tables_info=None, manage_unique=True, use_stemming=True, use_tf_idf=True,
-                 decimals=2, relevance_radius_threshold=0.1):
+                 decimals=2, relevance_radius_threshold=0.1, svd_engine='lsa.indexer.svd.TruncatedSvdEngine',
+                 svd_engine_options=None, weighting='lsa.indexer.weighting.TfIdfWeighting', weighting_options=None,
+                 resident=False, workers=1, preprocess_chunk_size=500, stem_cache_size=100000,
+                 persist_stem_cache=False, tokenizer='lsa.indexer.tokenizer.Tokenizer', tokenizer_options=None,
+                 vocabulary_options=None, ann_index=None, ann_options=None, max_removed_part=0.3,
+                 out_of_core_options=None, storage_dtype=None, shards_options=None):
+        """
+        Args:
+            use_tf_idf: apply weighting scheme to terms-to-documents matrix
+            svd_engine: path to svd engine class, see indexer.svd module. svd_engine_options - its kwargs
+            weighting: path to weighting scheme class, see indexer.weighting module. weighting_options - its kwargs
+            resident: keep loaded space in memory between calls, see open method
+            workers: number of processes to prepare documents with while building index
+            preprocess_chunk_size: number of documents sent to a worker process at once
+            stem_cache_size: how many stems of recently used words to keep in memory, 0 disables cache
+            persist_stem_cache: keep stems cache with the index
+            tokenizer: path to tokenizer class, see indexer.tokenizer module. tokenizer_options - its kwargs,
+                custom stop words collection for example
+            vocabulary_options: rules of words filtering (used if manage_unique), see Space.manage_unique_words
+            ann_index: path to approximate nearest neighbours index class, see indexer.ann module.
+                ann_options - its kwargs. None - exact search
+            max_removed_part: removed documents are skipped by search till index compaction, it is done
+                automatically when their part exceeds this value, see compact_index
+            out_of_core_options: build index without keeping the collection in memory, dict with keys:
+                memory_budget - approximate memory limit in bytes (1 GB by default),
+                spill_folder - folder for temporary files (system temporary folder by default).
+                svd_engine should support decomposition by chunks (indexer.svd.RandomizedSvdEngine).
+                None - usual build
+            storage_dtype: dtype of matrices in memory and on disk: 'float64' (default), 'float32', 'float16'
+                or 'int8' (D is quantized, T and P are float32), see Space
+            shards_options: partition documents between shard processes and search them in parallel, dict with keys:
+                shards - number of shard processes on this node,
+                addresses - addresses of shard servers on other nodes instead (see search.shards.serve_shard),
+                authkey - bytes for authentication of connections, required with addresses.
+                Shards are started by open method and stopped by close one (resident mode only). None - one process.
+                Sharded search requires index backend which loads part of D (NpyIndexBackend)
+        """
         self.space = None
+        self.resident = resident
+        self.workers = workers
+        self.preprocess_chunk_size = preprocess_chunk_size
+        self.index_version = None
+        self.changes = None  # IndexChanges of running update session
+        self.max_removed_part = max_removed_part
+        self.out_of_core_options = out_of_core_options
+        self.storage_dtype = storage_dtype
+        self.shards_options = shards_options
+        self.shards = None  # shards.ShardPool, see open
         self.use_tf_idf = use_tf_idf
         self.use_stemming = use_stemming
         self.decimals = decimals
@@ -29,31 +123,109 @@ class SearchMachine():
         self.relevance_radius_threshold = relevance_radius_threshold
         self.latent_dimensions = latent_dimensions
         self.manage_unique = manage_unique
+        self.vocabulary_options = vocabulary_options
+        self.ann_index_class = helpers.import_from_package_and_module(ann_index) if ann_index else None
+        self.ann_options = ann_options or {}
         if db_backend and db_credentials and tables_info:
             self.db_backend = helpers.import_from_package_and_module(db_backend)(**db_credentials)
         self.tables_info = tables_info
         self.index_backend = helpers.import_from_package_and_module(index_backend)(**keep_index_info)
+        self.svd_engine = helpers.import_from_package_and_module(svd_engine)(**(svd_engine_options or {}))
+        self.weighting_class = helpers.import_from_package_and_module(weighting)
+        self.weighting_options = weighting_options or {}
+        self.stemmer = CachedStemmer(max_size=stem_cache_size) if stem_cache_size else None
+        self.persist_stem_cache = persist_stem_cache and self.stemmer is not None
+        self.dumped_stem_misses = 0  # stems are new if stemmer misses exceed it, see dump_new_stems
+        self.tokenizer = helpers.import_from_package_and_module(tokenizer)(**(tokenizer_options or {}))
+
+    def get_space_kwargs(self):
+        """ Weighting and ANN index are fitted to the space, so every space gets its own instances """
+
+        return dict(latent_dimensions=self.latent_dimensions, use_stemming=self.use_stemming,
+                    use_tf_idf=self.use_tf_idf, decimals=self.decimals,
+                    relevance_radius_threshold=self.relevance_radius_threshold, svd_engine=self.svd_engine,
+                    weighting=self.weighting_class(**self.weighting_options), stemmer=self.stemmer, tokenizer=self.tokenizer,
+                    vocabulary_options=self.vocabulary_options,
+                    ann_index=self.ann_index_class(**self.ann_options) if self.ann_index_class else None,
+                    storage_dtype=self.storage_dtype)
 
     def init_space(self):
         """ Create LSA instance not from dump """
 
-        self.space = core.Space(self.latent_dimensions, use_stemming=self.use_stemming, use_tf_idf=self.use_tf_idf,
-                                decimals=self.decimals, relevance_radius_threshold=self.relevance_radius_threshold)
+        self.space = core.Space(**self.get_space_kwargs())
 
     def deinit_space(self):
         """ Delete created LSA instance """
 
         self.space = None
+        self.index_version = None
+
+    def open(self):
+        """ Load space and keep it in memory till close method call. Space will be reloaded only if the index
+            is changed on disk (by another process for example). Use it in long-running processes
+        """
+
+        self.resident = True
+        if self.shards_options is not None and self.shards is None:
+            self.shards = shards.ShardPool(self, **self.shards_options)
+        try:
+            self.load_space_from_dump()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """ Forget loaded space, every call will load it from disk again. New stems are written to the index """
+
+        self.dump_new_stems()
+        self.resident = False
+        self.deinit_space()
+        if self.shards is not None:
+            self.shards.close()
+            self.shards = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def is_space_outdated(self):
+        """ Loaded space is outdated if index has been changed on disk after loading """
+
+        if self.space is None:
+            return True
+        index_version = self.index_backend.get_index_version()
+        return index_version is not None and index_version != self.index_version
 
     def feed_from_db(self):
-        """ Manage tables_info dict adn grab data from database """
+        """ Manage tables_info dict adn grab data from database.
+            Rows are streamed from database, they are not kept in memory all together
+        """
 
         # 'credentials' : { все для соединения в БД }
         # 'tables_info': {'table_name_1': {'fields': ('fname1', 'fname2', ...), 'pk_field_name': 'pk_field_name', 'prefix': 'd_', 'where': '...'}, 'table_name_2':{...}}
 
+        for document, desired_id in self.iterate_prepared_db_documents():
+            self.space.add_prepared_document(document, desired_id)
+
+    def iterate_prepared_db_documents(self):
+        """ Iterator of (prepared_document, desired_id) pairs, see Space.prepare_document """
+
         if not hasattr(self, 'db_backend'):
             raise exceptions.DBBackendIsNotConfigured
 
+        documents = self.iterate_db_documents()
+        if self.workers > 1:
+            # documents are prepared in a pool of processes, results come in the same order
+            return parallel.prepare_in_pool(documents, self.get_space_kwargs(), self.workers,
+                                            self.preprocess_chunk_size)
+        return ((self.space.prepare_document(document), desired_id) for document, desired_id in documents)
+
+    def iterate_db_documents(self):
+        """ Generator of (raw_document, desired_id) pairs from all tables of tables_info """
+
         for table in self.tables_info:
             where_clause = self.tables_info[table].get('where', None)
             rows = self.db_backend.select(table, self.tables_info[table]['fields'],
@@ -62,7 +234,7 @@ class SearchMachine():
             for row in rows:
                 document = ' '.join([row[i] for i in range(1, 1 + len(self.tables_info[table]['fields']))])
                 desired_id = table_prefix + str(row[0]) if table_prefix else row[0]
-                self.feed_with_document(document, desired_id)
+                yield document, desired_id
 
     def feed_with_document(self, raw_document, desired_id):
         """ Give individual document to LSA algorithm """
@@ -71,24 +243,192 @@ class SearchMachine():
     def build_semantic_space(self):
         self.space.build_semantic_space(manage_unique=self.manage_unique)
 
-    def dump_semantic_space(self):
-        self.index_backend.dump(self.space.T, SearchMachine.T_INDEX_NAME)
-        self.index_backend.dump(self.space.S, SearchMachine.S_INDEX_NAME)
-        self.index_backend.dump(self.space.D, SearchMachine.D_INDEX_NAME)
-        self.index_backend.dump(self.space.words, SearchMachine.WORDS_INDEX_NAME)
-        self.index_backend.dump(self.space.keys, SearchMachine.KEYS_INDEX_NAME)
+    def get_index_components(self):
+        """ Index file name -> function returning object to dump in it, in order of dumping """
+
+        components = collections.OrderedDict([
+            (SearchMachine.T_INDEX_NAME, lambda: self.space.T),
+            (SearchMachine.S_INDEX_NAME, lambda: self.space.S),
+            (SearchMachine.D_INDEX_NAME, lambda: self.space.D),
+            (SearchMachine.WORDS_INDEX_NAME, lambda: self.space.words),
+            (SearchMachine.KEYS_INDEX_NAME, lambda: self.space.keys),
+            (SearchMachine.P_INDEX_NAME, lambda: self.space.P),
+            (SearchMachine.NEIGHBOURS_INDEX_NAME, self.space.dump_neighbours),
+            (SearchMachine.META_INDEX_NAME, self.space.dump_meta),
+            (SearchMachine.DRIFT_INDEX_NAME, lambda: self.space.drift),
+            (SearchMachine.REMOVED_INDEX_NAME, self.space.dump_tombstones),
+            (SearchMachine.D_SCALES_INDEX_NAME,
+             lambda: None if self.space.D_scales is None else self.space.D_scales.tolist()),
+        ])
+        if self.space.ann_index is not None:
+            components[SearchMachine.ANN_INDEX_NAME] = self.space.ann_index.dump
+            components[SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME] = self.space.ann_index.dump_assignments
+            components[SearchMachine.ANN_BOUNDARIES_INDEX_NAME] = self.space.ann_index.dump_boundaries
+        if self.persist_stem_cache:
+            components[SearchMachine.STEMS_INDEX_NAME] = self.stemmer.dump
+        return components
+
+    def dump_semantic_space(self, components=None):
+        """ Dump all index files or only given ones """
+
+        for name, get_object in self.get_index_components().items():
+            if components is None or name in components:
+                if name == SearchMachine.STEMS_INDEX_NAME:
+                    self.dumped_stem_misses = self.stemmer.misses
+                self.index_backend.dump(get_object(), name, appendable=name == SearchMachine.D_INDEX_NAME)
+        self.index_version = self.index_backend.get_index_version()
+        if self.shards is not None:
+            if components is None or SearchMachine.D_INDEX_NAME in components:
+                self.shards.load()  # other changes of documents have been sent to shards
+            if self.space is not None:
+                self.space.set_documents(None)  # see load_documents
+
+    def dump_changes(self, changes):
+        """ Write only changed parts of the index. Documents appended to the end of D and keys (and their lists
+            of ANN index) and numbers of removed columns are appended to the index files, they are not rewritten
+        """
+
+        components = set(changes.components)
+        if SearchMachine.D_INDEX_NAME in components:
+            components.add(SearchMachine.D_SCALES_INDEX_NAME)
+        if SearchMachine.ANN_INDEX_NAME in components:
+            components.update([SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME, SearchMachine.ANN_BOUNDARIES_INDEX_NAME])
+        if changes.appended and SearchMachine.D_INDEX_NAME not in components:
+            columns, scales = self.get_columns(len(self.space.keys) - changes.appended, len(self.space.keys))
+            self.index_backend.append(np.asarray(columns), SearchMachine.D_INDEX_NAME)
+            self.index_backend.append(self.space.keys[-changes.appended:], SearchMachine.KEYS_INDEX_NAME)
+            if scales is not None:
+                self.index_backend.append(scales.tolist(), SearchMachine.D_SCALES_INDEX_NAME)
+        ann_index = self.space.ann_index
+        if changes.appended and ann_index is not None and ann_index.is_built() and \
+                SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME not in components:
+            if self.index_backend.exists(SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME):
+                self.index_backend.append(ann_index.dump_assignments()[-changes.appended:],
+                                          SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME)
+            else:  # ANN index was not built with the index
+                components.update([SearchMachine.ANN_INDEX_NAME, SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME,
+                                   SearchMachine.ANN_BOUNDARIES_INDEX_NAME])
+        if changes.removed and SearchMachine.REMOVED_INDEX_NAME not in components:
+            if self.index_backend.exists(SearchMachine.REMOVED_INDEX_NAME):
+                self.index_backend.append(changes.removed, SearchMachine.REMOVED_INDEX_NAME)
+            else:  # index was built before removed documents have been kept
+                components.add(SearchMachine.REMOVED_INDEX_NAME)
+        self.dump_semantic_space(components)
+
+    def get_columns(self, start, end):
+        """ Columns start..end of D in storage dtype and their scales, coordinator of shards takes them from shards """
+
+        if self.space.D is None:
+            return self.shards.get_columns(start, end)
+        return self.space.D[:, start:end], None if self.space.D_scales is None else self.space.D_scales[start:end]
+
+    def load_documents(self):
+        """ Coordinator of shards keeps basis of the space only (D is kept by shards). The whole D is loaded
+            for operations which need it (compaction, SVD update, neighbours), it is forgotten after dumping
+            the index, see forget_documents
+        """
+
+        if self.space.D is not None:
+            return
+        D = self.index_backend.load(SearchMachine.D_INDEX_NAME, return_matrix=True)
+        self.space.load_documents(D, self.index_backend.load(SearchMachine.D_SCALES_INDEX_NAME)
+                                  if self.index_backend.exists(SearchMachine.D_SCALES_INDEX_NAME) else None)
+        if D.shape[1] < len(self.space.keys):  # documents folded-in during update session are kept by shards only
+            self.space.append_documents(self.shards.get_documents(D.shape[1], len(self.space.keys)))
+
+    def shards_follow_updates(self):
+        """ Changes of documents are sent to shards, except ones of update session which rewrites D
+            (shards are reloaded at its end, column numbers of the session do not match ones of shards)
+        """
+
+        return self.shards is not None and (self.changes is None or
+                                            SearchMachine.D_INDEX_NAME not in self.changes.components)
+
+    def forget_documents(self):
+        """ D loaded by load_documents is kept till the end of update session, it may be changed by the session """
+
+        if self.shards is not None and self.changes is None:
+            self.space.set_documents(None)
+
+    def save_changes(self, changes):
+        """ Dump changes at once or keep them till the end of update session """
+
+        if self.changes is not None:
+            self.changes.update(changes)
+        else:
+            self.dump_changes(changes)
+
+    @contextlib.contextmanager
+    def update_session(self):
+        """ Apply many updates (update_index_with_doc, add_documents, remove_document etc) to the space in memory
+            and write changed parts of the index once at the end of the session. Nothing is written
+            if the session fails. The space is not reloaded during the session
+
+            with sm.update_session():
+                for document, desired_id in documents:
+                    sm.update_index_with_doc(document, desired_id)
+        """
+
+        if self.space is None or self.is_space_outdated():
+            self.load_space_from_dump()
+        self.changes = IndexChanges()
+        if self.persist_stem_cache:
+            self.changes.components.add(SearchMachine.STEMS_INDEX_NAME)
+        try:
+            yield self
+        except Exception:
+            self.deinit_space()  # space in memory does not match the index on disk any more
+            raise
+        else:
+            self.dump_changes(self.changes)
+        finally:
+            self.changes = None
+            if not self.resident:
+                self.deinit_space()
 
     def load_space_from_dump(self):
-        self.init_space()
-        self.space.load_from_dump(
+        """ Loaded space replaces the current one at once, threads searching in the current one are not affected """
+
+        space = core.Space(**self.get_space_kwargs())
+        index_version = self.index_backend.get_index_version()
+        with_documents = self.shards is None  # coordinator of shards keeps basis of the space only
+        space.load_from_dump(
             t=self.index_backend.load(SearchMachine.T_INDEX_NAME, return_matrix=True),
             s=self.index_backend.load(SearchMachine.S_INDEX_NAME, return_matrix=True),
-            d=self.index_backend.load(SearchMachine.D_INDEX_NAME, return_matrix=True),
+            d=self.index_backend.load(SearchMachine.D_INDEX_NAME, return_matrix=True) if with_documents else None,
             words=self.index_backend.load(SearchMachine.WORDS_INDEX_NAME),
             keys=self.index_backend.load(SearchMachine.KEYS_INDEX_NAME),
+            p=self.index_backend.load(SearchMachine.P_INDEX_NAME, return_matrix=True)
+            if self.index_backend.exists(SearchMachine.P_INDEX_NAME) else None,
+            d_scales=self.index_backend.load(SearchMachine.D_SCALES_INDEX_NAME)
+            if with_documents and self.index_backend.exists(SearchMachine.D_SCALES_INDEX_NAME) else None,
         )
+        if self.index_backend.exists(SearchMachine.REMOVED_INDEX_NAME):
+            space.load_tombstones(self.index_backend.load(SearchMachine.REMOVED_INDEX_NAME))
+        if self.index_backend.exists(SearchMachine.META_INDEX_NAME):
+            space.load_meta(self.index_backend.load(SearchMachine.META_INDEX_NAME))
+        if self.index_backend.exists(SearchMachine.DRIFT_INDEX_NAME):
+            space.drift = self.index_backend.load(SearchMachine.DRIFT_INDEX_NAME)
+        if space.ann_index is not None and self.index_backend.exists(SearchMachine.ANN_INDEX_NAME) and \
+                self.index_backend.exists(SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME):
+            space.ann_index.load(self.index_backend.load(SearchMachine.ANN_INDEX_NAME),
+                                 self.index_backend.load(SearchMachine.ANN_ASSIGNMENTS_INDEX_NAME),
+                                 self.index_backend.load(SearchMachine.ANN_BOUNDARIES_INDEX_NAME)
+                                 if self.index_backend.exists(SearchMachine.ANN_BOUNDARIES_INDEX_NAME) else None)
+        if self.index_backend.exists(SearchMachine.NEIGHBOURS_INDEX_NAME):
+            space.load_neighbours(self.index_backend.load(SearchMachine.NEIGHBOURS_INDEX_NAME))
+        if self.persist_stem_cache and not self.stemmer.cache and \
+                self.index_backend.exists(SearchMachine.STEMS_INDEX_NAME):
+            self.stemmer.load(self.index_backend.load(SearchMachine.STEMS_INDEX_NAME))
+            self.dumped_stem_misses = self.stemmer.misses
+        self.space, self.index_version = space, index_version
+        if self.shards is not None:
+            self.shards.load()
 
     def build_index(self):
+        if self.out_of_core_options is not None:
+            return self.build_index_out_of_core()
+
         self.init_space()
         self.feed_from_db()
         self.build_semantic_space()
@@ -96,6 +436,20 @@ class SearchMachine():
 
         self.deinit_space()
 
+    def build_index_out_of_core(self):
+        """ Build index of the collection which does not fit in memory, see Space.build_semantic_space_out_of_core """
+
+        options = self.out_of_core_options
+        spill_folder = tempfile.mkdtemp(dir=options.get('spill_folder'))
+        try:
+            self.init_space()
+            self.space.build_semantic_space_out_of_core(self.iterate_prepared_db_documents(), spill_folder,
+                                                        options.get('memory_budget', 2 ** 30), self.manage_unique)
+            self.dump_semantic_space()
+        finally:
+            self.deinit_space()
+            shutil.rmtree(spill_folder, ignore_errors=True)
+
     def remove_index(self):
         self.deinit_space()
         self.index_backend.delete_index()
@@ -106,22 +460,147 @@ class SearchMachine():
 
     @with_manage_space_instance
     def search(self, query, limit=None, with_distances=False):
+        if self.shards is not None:
+            return self.shards.search_many(self.space, [query], with_distances,
+                                           limit=limit or self.default_search_limit)[0]
         return self.space.search(query, with_distances, limit=limit or self.default_search_limit)
 
+    @with_manage_space_instance
+    def search_many(self, queries, limit=None, with_distances=False, chunk_size=1000):
+        """ Search for many queries at once, returns list of results (like search method returns) """
+
+        if self.shards is not None:
+            return self.shards.search_many(self.space, list(queries), with_distances,
+                                           limit=limit or self.default_search_limit, chunk_size=chunk_size)
+        return self.space.search_many(list(queries), with_distances, limit=limit or self.default_search_limit,
+                                      chunk_size=chunk_size)
+
+    @with_manage_space_instance
+    def similar_to(self, doc_id, limit=None, with_distances=False):
+        """ More like this: documents similar to the indexed document with doc_id """
+
+        if self.shards is not None:
+            return self.shards.similar_to(self.space, doc_id, limit=limit or self.default_search_limit,
+                                          with_distances=with_distances)
+        return self.space.similar_to(doc_id, limit=limit or self.default_search_limit, with_distances=with_distances)
+
+    @with_manage_space_instance
+    def build_neighbours(self, limit=10, chunk_size=1000):
+        """ Precompute limit nearest documents for every indexed document and keep them with the index.
+            similar_to method with the same or smaller limit takes results from this table
+        """
+
+        self.load_documents()
+        self.space.build_neighbours(limit, chunk_size)
+        self.index_backend.dump(self.space.dump_neighbours(), SearchMachine.NEIGHBOURS_INDEX_NAME)
+        self.index_version = self.index_backend.get_index_version()
+        self.forget_documents()
+
     @with_manage_space_instance
     def update_index_with_doc(self, document, desired_id):
         """ Use it to add a new document to already existed semantic space """
 
-        ney_key = self.space.update_space_with_document(document, desired_id)
-        self.dump_semantic_space()
+        ney_key = self.fold_in([(document, desired_id)])[0]
+        self.save_changes(self.get_fold_in_changes(1))
         return ney_key
 
+    @with_manage_space_instance
+    def add_documents(self, documents):
+        """ Use it to add many documents to already existed semantic space. Index is dumped once
+
+        :param
+         documents - iterable of (document, desired_id) pairs
+        """
+
+        new_keys = self.fold_in(documents)
+        self.save_changes(self.get_fold_in_changes(len(new_keys)))
+        return new_keys
+
+    def fold_in(self, documents):
+        """ See Space.update_space_with_documents, folded-in documents are sent to the last shard in sharded mode """
+
+        new_keys, columns = self.space.fold_in_documents(documents)
+        if self.shards_follow_updates() and columns is not None:
+            self.shards.append_documents(columns, new_keys)
+        return new_keys
+
+    def get_fold_in_changes(self, documents_number):
+        """ Folding-in appends documents to D and keys, other matrices stay the same.
+            Only small files are rewritten: drift counters and boundaries of ANN lists
+        """
+
+        changes = IndexChanges(SearchMachine.DRIFT_INDEX_NAME)
+        if self.space.ann_index is not None:
+            changes.components.add(SearchMachine.ANN_BOUNDARIES_INDEX_NAME)
+        changes.appended = documents_number
+        return changes
+
+    def dump_new_stems(self):
+        """ Stems cache is written by build, at the end of update session and by close, not by every update """
+
+        if self.persist_stem_cache and self.stemmer.misses > self.dumped_stem_misses and \
+                self.index_backend.exists(SearchMachine.T_INDEX_NAME):
+            self.dump_semantic_space([SearchMachine.STEMS_INDEX_NAME])
+
+    @with_manage_space_instance
+    def update_index_incrementally(self, documents, chunk_size=100):
+        """ Add documents (iterable of (document, desired_id) pairs) to already existed semantic space
+            by incremental SVD update. Unlike update_index_with_doc, the space takes new words into account.
+            Use get_drift to find out when full rebuild is worthwhile
+        """
+
+        self.load_documents()
+        new_keys = self.space.update_svd_with_documents(documents, chunk_size)
+        changes = IndexChanges(*self.get_index_components())
+        changes.components.discard(SearchMachine.STEMS_INDEX_NAME)
+        self.save_changes(changes)
+        return new_keys
+
+    @with_manage_space_instance
+    def get_drift(self):
+        """ See Space.get_drift """
+        return self.space.get_drift()
+
     @with_manage_space_instance
     def draw_space(self, **kwargs):
+        self.load_documents()
         self.space.draw_semantic_space(**kwargs)
+        self.forget_documents()
 
     @with_manage_space_instance
     def remove_document(self, doc_id):
-        """ Use to remove doc from already built semantic space """
-        self.space.remove_document(doc_id)
-        self.dump_semantic_space()
+        """ Use to remove doc from already built semantic space. Document is marked as removed,
+            the index is compacted when part of removed documents exceeds max_removed_part
+        """
+
+        changes = IndexChanges()
+        changes.removed.append(self.space.remove_document(doc_id))
+        if self.shards_follow_updates():
+            self.shards.remove_document(changes.removed[-1])
+        if self.space.get_removed_part() > self.max_removed_part:
+            self.load_documents()
+            self.space.compact()
+            changes = self.get_compaction_changes()
+        self.save_changes(changes)
+
+    @with_manage_space_instance
+    def compact_index(self):
+        """ Drop removed documents from the index at once
+
+        :returns
+         number of dropped documents
+        """
+
+        if not self.space.removed_number:
+            return 0
+        self.load_documents()
+        dropped = self.space.compact()
+        if dropped:
+            self.save_changes(self.get_compaction_changes())
+        return dropped
+
+    def get_compaction_changes(self):
+        """ Compaction rewrites D and everything what refers to its columns """
+
+        return IndexChanges(SearchMachine.D_INDEX_NAME, SearchMachine.KEYS_INDEX_NAME,
+                            SearchMachine.ANN_INDEX_NAME, SearchMachine.REMOVED_INDEX_NAME)
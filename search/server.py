@@ -0,0 +1,278 @@
+""" Query server: SearchMachine behind asyncio HTTP server. The index is loaded once, requests are answered
+    by a pool of threads, updates wait till running searches end (read-write lock).
+
+    python -m lsa.search.server --settings settings.json --port 8000
+
+    settings.json contains kwargs of SearchMachine. Requests are POST with JSON body, responses are JSON:
+
+        /search - {"query": "...", "limit": 10, "with_distances": false} -> {"results": [...]}
+        /search_many - {"queries": ["...", ...], "limit": 10, "with_distances": false} -> {"results": [[...], ...]}
+        /similar_to - {"doc_id": 1, "limit": 10, "with_distances": false} -> {"results": [...]}
+        /add_documents - {"documents": [["text", "desired_id"], ...]} -> {"keys": [...]}
+        /remove_document - {"doc_id": 1} -> {}
+
+    Concurrent /search requests are batched: queries which come while all threads are busy (or during batch_delay)
+    are searched together by one search_many call, so queries are projected and compared with documents
+    by matrix products. Results are the same as SearchMachine.search returns (ANN index is used if it is set)
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import http
+import json
+import logging
+import urllib.parse
+
+from lsa.search.machine import SearchMachine
+from lsa.utils import exceptions, locks
+
+logger = logging.getLogger(__name__)
+
+
+class SearchServer(object):
+    BAD_REQUEST_ERRORS = (KeyError, TypeError, ValueError, exceptions.KeyTypeException,
+                          exceptions.UniqueKeyException)
+
+    def __init__(self, machine, threads=4, batch_size=100, batch_delay=0.):
+        """
+        Args:
+            machine: SearchMachine, it is opened (resident mode) by start method
+            threads: number of threads which call the machine
+            batch_size: maximal number of /search queries searched together
+            batch_delay: seconds to wait for more queries before searching a batch. Queries are batched
+                without delay too, while all threads are busy
+        """
+
+        self.machine = machine
+        self.threads = threads
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.lock = locks.ReadWriteLock()
+        self.executor = None
+        self.server = None
+        self.queue = None  # /search queries waiting for batching, see batch_searches
+        self.batcher = None
+        self.handlers = {
+            '/search': self.search,
+            '/search_many': self.search_many,
+            '/similar_to': self.similar_to,
+            '/add_documents': self.add_documents,
+            '/remove_document': self.remove_document,
+        }
+
+    # machine calls, they are done in threads of executor
+
+    def read(self, method, *args, **kwargs):
+        self.reload_outdated_space()
+        with self.lock.reading():
+            return getattr(self.machine, method)(*args, **kwargs)
+
+    def write(self, method, *args, **kwargs):
+        with self.lock.writing():
+            return getattr(self.machine, method)(*args, **kwargs)
+
+    def reload_outdated_space(self):
+        """ Index changed on disk by another process is reloaded by writer, so it does not change under readers """
+
+        if self.machine.is_space_outdated():
+            with self.lock.writing():
+                if self.machine.is_space_outdated():
+                    self.machine.load_space_from_dump()
+
+    def run(self, function, *args, **kwargs):
+        return asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+    # handlers of requests
+
+    @staticmethod
+    def get_results_params(params):
+        """ limit and with_distances of request, ValueError if they are wrong """
+
+        limit = params.get('limit')
+        with_distances = params.get('with_distances', False)
+        if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+            # zero is not passed to the machine, it would take default limit instead
+            raise ValueError('limit should be positive integer or null, not %r' % (limit,))
+        if not isinstance(with_distances, bool):
+            raise ValueError('with_distances should be boolean, not %r' % (with_distances,))
+        return limit, with_distances
+
+    async def search(self, params):
+        query = params['query']
+        if not isinstance(query, str):
+            raise ValueError('query should be string, not %r' % (query,))
+        limit, with_distances = self.get_results_params(params)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, limit, with_distances, future))
+        return {'results': await future}
+
+    async def search_many(self, params):
+        queries = params['queries']
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError('queries should be list of strings')
+        results = await self.run(self.read, 'search_many', queries, *self.get_results_params(params))
+        return {'results': results}
+
+    async def similar_to(self, params):
+        results = await self.run(self.read, 'similar_to', params['doc_id'], *self.get_results_params(params))
+        return {'results': results}
+
+    async def add_documents(self, params):
+        documents = [(document, desired_id) for document, desired_id in params['documents']]
+        return {'keys': await self.run(self.write, 'add_documents', documents)}
+
+    async def remove_document(self, params):
+        await self.run(self.write, 'remove_document', params['doc_id'])
+        return {}
+
+    async def batch_searches(self):
+        """ Take queries of /search requests from queue and search them by batches. Every batch takes a thread,
+            so queries wait in queue while all threads are busy and the next batch is bigger
+        """
+
+        slots = asyncio.Semaphore(self.threads)
+        while True:
+            await slots.acquire()
+            batch = [await self.queue.get()]
+            try:
+                if self.batch_delay:
+                    await asyncio.sleep(self.batch_delay)
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+
+                groups = collections.defaultdict(list)  # one search_many call for the same limit and with_distances
+                for query, limit, with_distances, future in batch:
+                    groups[limit, with_distances].append((query, future))
+                tasks = [self.search_batch(items, limit, with_distances)
+                         for (limit, with_distances), items in groups.items()]
+                asyncio.ensure_future(asyncio.gather(*tasks)).add_done_callback(lambda task: slots.release())
+            except Exception as e:  # the batcher serves all next requests, so it never stops
+                logger.exception('Batch of %d queries failed', len(batch))
+                slots.release()
+                for query, limit, with_distances, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def search_batch(self, items, limit, with_distances):
+        try:
+            results = await self.run(self.read, 'search_many', [query for query, future in items], limit,
+                                     with_distances)
+        except Exception as e:
+            results = [e] * len(items)
+        for (query, future), result in zip(items, results):
+            if future.done():  # client has gone
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    # HTTP
+
+    async def dispatch(self, method, path, body):
+        """ Returns HTTP status and response object """
+
+        handler = self.handlers.get(urllib.parse.urlsplit(path).path)
+        if handler is None:
+            return http.HTTPStatus.NOT_FOUND, {'error': 'Unknown path %s' % path}
+        if method != 'POST':
+            return http.HTTPStatus.METHOD_NOT_ALLOWED, {'error': 'Use POST method'}
+
+        try:
+            params = json.loads(body.decode('utf-8')) if body else {}
+            if not isinstance(params, dict):
+                raise TypeError('Request body should be JSON object')
+            return http.HTTPStatus.OK, await handler(params)
+        except exceptions.DocumentDoesNotExist as e:
+            return http.HTTPStatus.NOT_FOUND, {'error': str(e)}
+        except self.BAD_REQUEST_ERRORS as e:
+            return http.HTTPStatus.BAD_REQUEST, {'error': '%s: %s' % (type(e).__name__, e)}
+        except Exception as e:
+            return http.HTTPStatus.INTERNAL_SERVER_ERROR, {'error': '%s: %s' % (type(e).__name__, e)}
+
+    async def handle_connection(self, reader, writer):
+        """ HTTP/1.1 connection, it is kept alive till client closes it or asks to close """
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode('latin-1').split(':', 1)
+                    headers[name.strip().lower()] = value.strip().lower()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                status, response = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', 'keep-alive' if version == 'HTTP/1.1' else 'close') != 'close'
+                data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json; charset=utf-8\r\n'
+                              'Content-Length: %d\r\nConnection: %s\r\n\r\n' %
+                              (status, status.phrase, len(data), 'keep-alive' if keep_alive else 'close')).encode())
+                writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass  # malformed request or client has gone
+        finally:
+            writer.close()
+
+    async def start(self, host='localhost', port=8000, path=None):
+        """ Load the index and listen host:port or unix socket path if it is given """
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        await self.run(self.machine.open)
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self.batch_searches())
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        await self.run(self.machine.close)
+        self.executor.shutdown()
+
+    async def serve(self, host='localhost', port=8000, path=None):
+        await self.start(host, port, path)
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', required=True, help='JSON file with SearchMachine kwargs')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', help='listen unix socket instead of host and port')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--batch-delay', type=float, default=0., help='seconds')
+    args = parser.parse_args()
+
+    with open(args.settings) as file:
+        machine = SearchMachine(**json.load(file))
+    server = SearchServer(machine, threads=args.threads, batch_size=args.batch_size, batch_delay=args.batch_delay)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+""" Sharded search. Columns of D (documents) are partitioned between shards, every shard is served by its own
+    process (see serve_shard), on this or another node. Basis of the space (words, T, S, P) is global:
+    queries are projected into the space once by SearchMachine, their coordinates are sent to all shards
+    at once (scatter), every shard calculates distances to its documents only and returns the nearest ones,
+    then they are merged (gather), see ShardPool. Coordinator keeps basis of the space only, documents are kept
+    by shards: folded-in documents are appended to the last shard, removed ones are marked by their shards,
+    shards reload the index only when D is rewritten (by compaction or SVD update).
+
+    Index backend should load part of D without reading the rest (NpyIndexBackend), see BaseIndexBackend.load_columns.
+
+    Transport is multiprocessing.connection: address is (host, port) tuple or path of unix socket,
+    connections are authenticated by authkey.
+"""
+
+import multiprocessing
+import os
+import threading
+from multiprocessing import connection
+
+import numpy as np
+
+from lsa.indexer import core
+
+
+class ShardServer(object):
+    """ Keeps one shard of the index: columns of D from shard * n / shards_number to (shard + 1) * n / shards_number,
+        where n is number of indexed documents, and their keys. Only this part of D is read from disk.
+        machine - SearchMachine with the same settings as coordinator has, its index backend and space settings are used
+    """
+
+    def __init__(self, machine, shard, shards_number):
+        self.machine = machine
+        self.shard = shard
+        self.shards_number = shards_number
+        self.space = None
+        self.start = 0
+
+    def load(self):
+        """ (Re)load the shard part of the index, coordinator calls it when D is rewritten
+
+        :returns
+         start and end of columns range of the shard
+        """
+
+        backend = self.machine.index_backend
+        keys = backend.load(self.machine.KEYS_INDEX_NAME)
+        start = len(keys) * self.shard // self.shards_number
+        end = len(keys) * (self.shard + 1) // self.shards_number
+        scales = backend.load(self.machine.D_SCALES_INDEX_NAME) \
+            if backend.exists(self.machine.D_SCALES_INDEX_NAME) else None
+        removed = backend.load(self.machine.REMOVED_INDEX_NAME) \
+            if backend.exists(self.machine.REMOVED_INDEX_NAME) else []
+
+        space = core.Space(**self.machine.get_space_kwargs())
+        space.load_documents(backend.load_columns(self.machine.D_INDEX_NAME, start, end),
+                             None if scales is None else scales[start:end])
+        space.keys = keys[start:end]
+        space.load_tombstones([column - start for column in removed if start <= column < end])
+        self.space, self.start = space, start
+        return start, end
+
+    def append_documents(self, columns, keys):
+        """ Folded-in documents (float columns) are appended to the last shard """
+
+        self.space.append_documents(columns)
+        for key in keys:
+            self.space.append_key(key)
+
+    def remove_document(self, column):
+        self.space.remove_document(self.space.keys[column - self.start])
+
+    def get_columns(self, start, end):
+        """ Columns start..end of the shard part of D in storage dtype and their scales (None if D is not quantized) """
+
+        start, end = start - self.start, end - self.start
+        return self.space.D[:, start:end], None if self.space.D_scales is None else self.space.D_scales[start:end]
+
+    def search(self, coords, limit, exclude_column=None):
+        """ The nearest documents of the shard for every row of coords (coordinates of queries)
+
+        :returns
+         list of (radius, nearest) pairs, radius - the maximal distance to documents of the shard (None if there are
+         no documents with defined distance), nearest - up to limit (distance, column, key) tuples sorted by distance.
+         Distances are not filtered by relevance_radius_threshold, it is done with radius of the whole space,
+         see ShardPool.find_similar_documents
+        """
+
+        distances = self.space.calculate_distances(coords)
+        if exclude_column is not None and 0 <= exclude_column - self.start < distances.shape[1]:
+            distances[:, exclude_column - self.start] = np.nan
+        results = []
+        for row in distances:
+            positions = np.flatnonzero(row > 0)  # NaN is not greater than zero too
+            radius = float(row[positions].max()) if len(positions) else None
+            nearest = [(float(row[i]), self.start + int(i), self.space.keys[i])
+                       for i in self.space.select_nearest(row, positions, limit)]
+            results.append((radius, nearest))
+        return results
+
+    def serve(self, conn):
+        """ Answer requests (method name, args) of one client till it disconnects.
+            Exceptions are sent back to the client
+
+        :returns
+         False if client asked to stop the server
+        """
+
+        while True:
+            try:
+                method, args = conn.recv()
+            except EOFError:
+                return True
+            if method == 'stop':
+                conn.send(None)
+                return False
+            try:
+                conn.send(getattr(self, method)(*args))
+            except Exception as e:
+                conn.send(e)
+
+
+def serve_shard(machine, shard, shards_number, address=('localhost', 0), authkey=None, ready=None):
+    """ Serve shard of the index on address till coordinator stops it. Run it on other nodes and give their
+        addresses to SearchMachine (see shards_options) to spread the index between nodes:
+
+            machine = SearchMachine(**same_settings)
+            serve_shard(machine, 1, 4, address=('0.0.0.0', 6001), authkey=b'secret')
+
+    :param
+     ready - connection to send listening address to when the server is ready (free port is taken for port 0)
+    """
+
+    server = ShardServer(machine, shard, shards_number)
+    with connection.Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        while True:
+            with listener.accept() as conn:
+                if not server.serve(conn):
+                    break
+
+
+class ShardPool(object):
+    """ Connections to shard servers. Shards are searched in parallel: request is sent to every shard
+        and only then their answers are received. Connections are used by one request at a time
+
+        machine - SearchMachine, local shard servers are started with its copy
+        shards - number of local shard processes (started on the same node)
+        addresses - addresses of already running shard servers, see serve_shard. Shards are not started if given
+        authkey - bytes for authentication of connections, required for remote servers (random key for local ones)
+    """
+
+    def __init__(self, machine, shards=None, addresses=None, authkey=None):
+        self.authkey = authkey or os.urandom(32)
+        self.processes = []
+        if addresses is None:
+            addresses = [self.start_server(machine, shard, shards) for shard in range(shards)]
+        self.connections = [connection.Client(address, authkey=self.authkey) for address in addresses]
+        self.lock = threading.Lock()
+        self.ranges = []  # [start, end] of columns of every shard, see load
+
+    def start_server(self, machine, shard, shards_number):
+        """ Start shard server in a new process and wait till it listens. Returns its address """
+
+        ready, child_ready = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=serve_shard, args=(machine, shard, shards_number),
+                                          kwargs={'authkey': self.authkey, 'ready': child_ready}, daemon=True)
+        process.start()
+        child_ready.close()
+        self.processes.append(process)
+        try:
+            return ready.recv()
+        finally:
+            ready.close()
+
+    def call(self, method, *args):
+        """ Call method of all shard servers at once, returns list of their results """
+
+        with self.lock:
+            for conn in self.connections:
+                conn.send((method, args))
+            results = [conn.recv() for conn in self.connections]  # all answers are received to keep the protocol
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def call_shard(self, shard, method, *args):
+        """ Call method of one shard server """
+
+        with self.lock:
+            self.connections[shard].send((method, args))
+            result = self.connections[shard].recv()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def load(self):
+        self.ranges = [list(columns_range) for columns_range in self.call('load')]
+
+    def get_shard(self, column):
+        """ Number of the shard which keeps the column """
+
+        for shard, (start, end) in enumerate(self.ranges):
+            if column < end:
+                return shard
+        return len(self.ranges) - 1
+
+    def append_documents(self, columns, keys):
+        """ Folded-in documents are appended to the last shard, see Space.fold_in_documents """
+
+        self.call_shard(len(self.ranges) - 1, 'append_documents', columns, keys)
+        self.ranges[-1][1] += len(keys)
+
+    def remove_document(self, column):
+        self.call_shard(self.get_shard(column), 'remove_document', column)
+
+    def get_columns(self, start, end):
+        """ Columns start..end of D in storage dtype and their scales (None if D is not quantized),
+            they are taken from shards which keep them
+        """
+
+        parts = [self.call_shard(shard, 'get_columns', max(start, shard_start), min(end, shard_end))
+                 for shard, (shard_start, shard_end) in enumerate(self.ranges)
+                 if shard_start < end and start < shard_end]
+        columns = np.hstack([columns for columns, scales in parts])
+        if parts[0][1] is None:
+            return columns, None
+        return columns, np.concatenate([scales for columns, scales in parts])
+
+    def get_documents(self, start, end):
+        """ Float columns start..end of D, see Space.get_documents """
+
+        columns, scales = self.get_columns(start, end)
+        return columns if scales is None else columns * scales
+
+    def find_similar_documents(self, coords, limit, with_distances, relevance_radius_threshold, exclude_column=None):
+        """ Results of Space.find_similar_documents for every row of coords, merged from all shards.
+            Relevance threshold is taken from the maximal distance in all shards, so results are the same
+            as the whole space would return
+        """
+
+        results = []
+        for shard_results in zip(*self.call('search', coords, limit, exclude_column)):
+            radiuses = [radius for radius, nearest in shard_results if radius is not None]
+            threshold = max(radiuses) * relevance_radius_threshold if radiuses else 0
+            nearest = sorted(item for radius, items in shard_results for item in items if item[0] < threshold)
+            if with_distances:
+                results.append([(key, distance) for distance, column, key in nearest[:limit]])
+            else:
+                results.append([key for distance, column, key in nearest[:limit]])
+        return results
+
+    def search_many(self, space, queries, with_distances=False, limit=100, chunk_size=1000):
+        """ See Space.search_many, space of coordinator is used to project queries.
+            Search by shards is always exact, ANN index is not used
+        """
+
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            Xq = space.make_term_vectors([space.prepare_document(query) for query in queries[start:start + chunk_size]])
+            found = self.find_similar_documents(space.project_term_vectors(Xq), limit, with_distances,
+                                                space.relevance_radius_threshold)
+            results.extend(result if words_number else None
+                           for words_number, result in zip(space.indexed_words_numbers(Xq), found))
+        return results
+
+    def similar_to(self, space, doc_id, limit=100, with_distances=False):
+        """ See Space.similar_to. Neighbours table of coordinator space is used if it is enough,
+            otherwise column of the document is taken from its shard
+        """
+
+        column = space.get_key_index().get(doc_id)
+        if column is None:
+            return space.similar_to(doc_id, limit, with_distances)  # DocumentDoesNotExist is raised by space
+        results = space.get_neighbours(doc_id, limit, with_distances)
+        if results is not None:
+            return results
+        return self.find_similar_documents(self.get_documents(column, column + 1).T, limit, with_distances,
+                                           space.relevance_radius_threshold, exclude_column=column)[0]
+
+    def close(self):
+        """ Stop local shard servers, connections to remote ones are just closed """
+
+        with self.lock:
+            for conn, process in zip(self.connections, self.processes):
+                conn.send(('stop', ()))
+                conn.recv()
+            for conn in self.connections:
+                conn.close()
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
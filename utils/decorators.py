@@ -2,17 +2,23 @@ def with_manage_space_instance(method):
     """ Decorator creates lsa instance from dump, let a method do its job and removes lsa instance.
         This allow you concentrate only on important logic of your method.
 
+        In resident mode lsa instance is kept in memory and is loaded again only if index on disk was changed.
+        Update session keeps lsa instance till its end
+
     """
 
     def wrapper(*args, **kwargs):
         self = args[0]  # instance of SearchMachine (self)
+        in_session = getattr(self, 'changes', None) is not None
 
-        if not getattr(self, 'space'):
+        if not in_session and (not getattr(self, 'space') or getattr(self, 'is_space_outdated')()):
             getattr(self, 'load_space_from_dump')()
 
-        method_result = method(*args, **kwargs)
-
-        getattr(self, 'deinit_space')()
+        try:
+            method_result = method(*args, **kwargs)
+        finally:
+            if not getattr(self, 'resident') and not in_session:
+                getattr(self, 'deinit_space')()
 
         return method_result
 
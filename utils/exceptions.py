@@ -58,4 +58,20 @@ class DocumentDoesNotExist(Exception):
         self.data = data
 
     def __str__(self):
-        return u'Document with id (%s) does not exist in space' % self.data
\ No newline at end of file
+        return u'Document with id (%s) does not exist in space' % self.data
+
+
+class IndexRebuildRequired(Exception):
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return u'Index should be rebuilt: %s' % self.data
+
+
+class OutOfCoreImproperlyConfigured(Exception):
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return u'Index can not be built out of core: %s' % self.data
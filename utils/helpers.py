@@ -6,16 +6,11 @@ from lsa.utils import exceptions
 
 
 def truncate_columns(matrix, limit):
-    """ Work with numpy matrices """
+    """ First limit columns of numpy array. It is a view, matrix is not copied """
 
     if limit < 1:
         raise exceptions.TruncateMatrixError(limit)
-
-    lst = []
-    matrix = matrix.tolist()
-    for row in matrix:
-        lst.append(row[:limit])
-    return np.matrix(lst)
+    return matrix[:, :limit]
 
 
 def truncate_rows(matrix, limit):
@@ -27,29 +22,75 @@ def truncate_rows(matrix, limit):
 def get_matrix_row(matrix, n):
     """ Take matrix row with number n
     Returns:
-        type of return object - scalar python list
+        type of return object - flat numpy.array, view of the row
     """
-    return matrix[n, :].tolist()[0]
+    return np.asarray(matrix)[n]
 
 
 def get_matrix_column(matrix, n):
     """ Take matrix column with number n
     Returns:
-        type of return object - scalar python list
+        type of return object - flat numpy.array, view of the column
+    """
+    return np.asarray(matrix)[:, n]
+
+
+class ColumnBuffer(object):
+    """ Array which grows by columns (by elements if it is flat). Columns are written to preallocated data,
+        when it is full its capacity is doubled, so appending of n columns one by one copies O(n) columns
+        in total instead of whole array every time.
+
+        view - filled part of data, it is a view, not a copy. It is replaced by every append
+    """
+
+    def __init__(self, data):
+        self.data = data  # can be memory-mapped, it is copied on the first append only
+        self.size = data.shape[-1]
+        self.view = data
+
+    @property
+    def capacity(self):
+        return self.data.shape[-1]
+
+    def append(self, columns):
+        columns = np.asarray(columns, dtype=self.data.dtype)
+        size = self.size + columns.shape[-1]
+        if size > self.capacity:
+            data = np.empty(self.data.shape[:-1] + (max(size, 2 * self.capacity),), dtype=self.data.dtype)
+            data[..., :self.size] = self.view
+            self.data = data
+        self.data[..., self.size:size] = columns
+        self.size = size
+        self.view = self.data[..., :size]
+        return self.view
+
+
+def quantize_columns(matrix):
+    """ Scalar quantization of matrix columns to int8: column ~ quantized column * scale,
+        scale of column is its maximal absolute element / 127. Zero columns get scale 1
+
+    Returns:
+        type of return object - tuple of int8 numpy.array and float32 numpy.array of scales
     """
-    return matrix[:, n].flatten().tolist()[0]
+
+    matrix = np.asarray(matrix, dtype=float)
+    scales = np.abs(matrix).max(axis=0) / 127 if len(matrix) else np.ones(matrix.shape[1])
+    scales[scales == 0] = 1
+    return np.round(matrix / scales).astype(np.int8), scales.astype(np.float32)
 
 
-def insert_column_to_matrix(matrix, to_insrt):
-    """ Insert column into nampy matrix (to the end of matrix)
+def inverse_diagonal(matrix):
+    """ Inverse of diagonal matrix as flat array of its diagonal. Zero elements stay zero (pseudo-inverse)
 
     Returns:
-        type of return object - numpy.matrix
+        type of return object - numpy.array
     """
 
-    tmp = matrix.T.tolist()
-    tmp.append(to_insrt)
-    return np.matrix(tmp).T
+    diagonal = np.diag(np.asarray(matrix)).astype(float)
+    inverse = np.zeros_like(diagonal)
+    non_zero = diagonal != 0
+    inverse[non_zero] = 1. / diagonal[non_zero]
+    return inverse
 
 
 def lower_document(document):